@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# کلاس‌های حجمی برای گزارش میانگین زمان تکمیل کارها
+SIZE_CLASSES = (
+    ('<10MB', 10 * MB),
+    ('10-50MB', 50 * MB),
+    ('50-500MB', 500 * MB),
+    ('>500MB', None),
+)
+
+
+def size_class(size: int) -> str:
+    """نام کلاس حجمی یک کار"""
+    for name, limit in SIZE_CLASSES:
+        if limit is None or size < limit:
+            return name
+    return SIZE_CLASSES[-1][0]
+
+
+class AdmissionRejected(Exception):
+    """درخواست توسط کنترل پذیرش رد شد (پیام قابل نمایش به کاربر)"""
+
+
+class TokenBucket:
+    """سطل توکن ساده برای محدود کردن نرخ درخواست‌های هر کاربر"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # توکن در ثانیه
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def try_consume(self, amount: float = 1.0) -> bool:
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def time_until(self, amount: float = 1.0) -> float:
+        """زمان لازم (ثانیه) تا در دسترس بودن amount توکن"""
+        self._refill()
+        if self.tokens >= amount or self.rate <= 0:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class CostEstimator:
+    """تخمین حجم کارها بر اساس حجم‌های مشاهده‌شده قبلی هر هاست"""
+
+    def __init__(self, max_hosts: int = 2000):
+        self.max_hosts = max_hosts
+        self._sizes = OrderedDict()  # {host: میانگین متحرک حجم}
+
+    def observe(self, host: str, size: int):
+        if not host or size <= 0:
+            return
+        previous = self._sizes.pop(host, None)
+        self._sizes[host] = size if previous is None else previous * 0.7 + size * 0.3
+        while len(self._sizes) > self.max_hosts:
+            self._sizes.popitem(last=False)
+
+    def estimate(self, host: str) -> int:
+        size = self._sizes.get(host)
+        return int(size) if size else 0
+
+
+class AdmissionController:
+    """
+    کنترل پذیرش جلوی pipeline دانلود
+
+    - سطل توکن برای هر کاربر
+    - سقف کارهای همزمان هر کاربر
+    - زمان‌بندی منصفانه بین کاربران: از هر کاربر کوتاه‌ترین کار نامزد می‌شود و
+      بین نامزدها کوتاه‌ترین کار (بر اساس حجم تخمینی) با در نظر گرفتن aging انتخاب می‌شود
+    - رد زودهنگام درخواست‌ها وقتی صف سراسری پر است (backpressure)
+    - اگر memory (MemoryGovernor) داده شود، کار انتخاب‌شده فقط وقتی شروع می‌شود که
+      بودجه حافظه اجازه دهد؛ تا آن موقع در صف می‌ماند
+    """
+
+    # هزینه ثابت هر کار (ثانیه) جدا از زمان انتقال داده
+    JOB_OVERHEAD = 5.0
+
+    def __init__(self, max_active: int = 5, per_user_active: int = 2, max_queued: int = 50,
+                 user_rate_per_min: float = 6.0, user_burst: float = 5.0, aging: float = 1.0, memory=None):
+        self.max_active = max_active
+        self.per_user_active = per_user_active
+        self.max_queued = max_queued
+        self.user_rate = user_rate_per_min / 60.0
+        self.user_burst = user_burst
+        self._queues = OrderedDict()  # {user_id: deque[Job]} به ترتیب round-robin
+        self._active = {}  # {user_id: تعداد کارهای در حال اجرا}
+        self._buckets = {}  # {user_id: TokenBucket}
+        self._changed = None  # asyncio.Event (با اولین استفاده در event loop ساخته می‌شود)
+        self._avg_duration = 30.0  # میانگین متحرک مدت اجرای هر کار (ثانیه)
+        self._throughput = 2.0 * MB  # میانگین متحرک سرعت پردازش (بایت در ثانیه)
+        self.aging = aging  # امتیاز هر ثانیه انتظار (ثانیه) تا کارهای بزرگ گرسنه نمانند
+        self.costs = CostEstimator()
+        self.memory = memory
+        self._completion = {name: [0, 0.0] for name, _ in SIZE_CLASSES}  # {class: [count, total_seconds]}
+        self.rejected = 0
+        self.completed = 0
+
+    def _event(self) -> asyncio.Event:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
+
+    @property
+    def queued_count(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def active_count(self) -> int:
+        return sum(self._active.values())
+
+    def admit(self, job, queued: int = None):
+        """
+        بررسی محدودیت صف و نرخ کاربر بدون افزودن به صف (رد با AdmissionRejected)
+
+        queued: تعداد کارهای در صف وقتی صف در پروسه‌های دیگر است (حالت supervisor)
+        """
+        if (self.queued_count if queued is None else queued) >= self.max_queued:
+            self.rejected += 1
+            raise AdmissionRejected(
+                "⚠️ سرور در حال حاضر بسیار شلوغ است.\n"
+                "لطفاً چند دقیقه دیگر دوباره تلاش کنید."
+            )
+
+        bucket = self._buckets.get(job.user_id)
+        if bucket is None:
+            bucket = self._buckets[job.user_id] = TokenBucket(self.user_rate, self.user_burst)
+        if not bucket.try_consume():
+            self.rejected += 1
+            wait = math.ceil(bucket.time_until())
+            raise AdmissionRejected(
+                f"⚠️ تعداد درخواست‌های شما زیاد است.\n"
+                f"لطفاً {wait} ثانیه دیگر دوباره تلاش کنید."
+            )
+
+    def submit(self, job, admitted: bool = False):
+        """
+        افزودن کار به صف یا رد آن با AdmissionRejected
+
+        admitted: کار قبلاً پذیرفته شده (ادامه پس از restart یا ارسال از پروسه اصلی)؛ محدودیت‌ها دوباره بررسی نمی‌شوند
+        """
+        if not admitted:
+            self.admit(job)
+        self._queues.setdefault(job.user_id, deque()).append(job)
+        self._event().set()
+
+    def estimated_seconds(self, job) -> float:
+        """مدت تخمینی اجرای یک کار بر اساس حجم تخمینی آن"""
+        if job.cost:
+            return self.JOB_OVERHEAD + job.cost / self._throughput
+        return self._avg_duration
+
+    def _score(self, job, now: float) -> float:
+        """امتیاز کوتاه‌ترین کار اول با aging (کمتر = زودتر)"""
+        return self.estimated_seconds(job) - self.aging * (now - job.submitted)
+
+    def _candidates(self, queues, active, now: float):
+        """انتخاب بهترین کار: از هر کاربر واجد شرایط کوتاه‌ترین کار، سپس کمترین امتیاز بین آن‌ها"""
+        best = None
+        for user_id, queue in queues.items():
+            if not queue or active.get(user_id, 0) >= self.per_user_active:
+                continue
+            job = min(queue, key=lambda j: self._score(j, now))
+            score = self._score(job, now)
+            # در امتیاز برابر، ترتیب round-robin حفظ می‌شود
+            if best is None or score < best[0]:
+                best = (score, user_id, job)
+        return best
+
+    def _pick(self):
+        """انتخاب و برداشتن کار بعدی از صف (None اگر سقف کارهای همزمان پر باشد)"""
+        if self.active_count >= self.max_active:
+            return None
+        best = self._candidates(self._queues, self._active, time.monotonic())
+        if best is None:
+            return None
+        _, user_id, job = best
+        if self.memory is not None:
+            job.memory = self.memory.try_acquire(job.kind, key=job.job_id)
+            if job.memory is None:
+                return None
+        queue = self._queues[user_id]
+        queue.remove(job)
+        # انتقال کاربر به انتهای نوبت
+        self._queues.move_to_end(user_id)
+        if not queue:
+            del self._queues[user_id]
+        return job
+
+    def update_cost(self, job, cost: int, source: str = ''):
+        """به‌روزرسانی حجم تخمینی یک کار (مثلاً پس از رسیدن نتیجه probe)"""
+        if cost and cost > 0:
+            job.cost = cost
+            job.cost_source = source
+            self._event().set()
+
+    async def next_job(self):
+        """انتظار تا رسیدن نوبت یک کار (برای worker ها)"""
+        event = self._event()
+        while True:
+            job = self._pick()
+            if job is not None:
+                self._active[job.user_id] = self._active.get(job.user_id, 0) + 1
+                job.started = time.monotonic()
+                return job
+            event.clear()
+            if self.memory is not None and self.memory.enabled and self.queued_count:
+                # حافظه بدون رویداد صف هم آزاد می‌شود (مثلاً پایان آپلود)، پس دوره‌ای دوباره بررسی کن
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=self.memory.interval)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await event.wait()
+
+    def finish(self, job):
+        """اعلام پایان مرحله دانلود یک کار و آزاد شدن جایگاه کاربر"""
+        count = self._active.get(job.user_id, 0) - 1
+        if count > 0:
+            self._active[job.user_id] = count
+        else:
+            self._active.pop(job.user_id, None)
+        if self.memory is not None:
+            self.memory.release(job.memory)
+            job.memory = None
+        if job.started:
+            duration = time.monotonic() - job.started
+            self._avg_duration = self._avg_duration * 0.8 + duration * 0.2
+            if job.size and duration > 1:
+                self._throughput = self._throughput * 0.8 + (job.size / duration) * 0.2
+        self.completed += 1
+        self._prune_buckets()
+        self._event().set()
+
+    def complete(self, job):
+        """ثبت تحویل کار به کاربر: میانگین زمان تکمیل (از ورود به صف تا تحویل) برای هر کلاس حجمی"""
+        record = self._completion[size_class(job.size or job.cost)]
+        record[0] += 1
+        record[1] += time.monotonic() - job.submitted
+
+    def cancel(self, job) -> bool:
+        """حذف کار از صف (اگر هنوز شروع نشده باشد)"""
+        queue = self._queues.get(job.user_id)
+        if queue and job in queue:
+            queue.remove(job)
+            if not queue:
+                del self._queues[job.user_id]
+            if self.memory is not None:
+                self.memory.forget(job.job_id)
+            self._event().set()
+            return True
+        return False
+
+    def _prune_buckets(self):
+        """حذف سطل‌های پر کاربران غیرفعال تا دیکشنری بی‌نهایت رشد نکند"""
+        if len(self._buckets) < 1000:
+            return
+        for user_id in [u for u, b in self._buckets.items()
+                        if b.is_full() and u not in self._queues and u not in self._active]:
+            del self._buckets[user_id]
+
+    def positions(self) -> dict:
+        """جایگاه تقریبی و زمان انتظار تخمینی هر کار در صف: {job_id: (position, eta_seconds)}"""
+        result = {}
+        now = time.monotonic()
+        queues = OrderedDict((u, list(q)) for u, q in self._queues.items())
+        free_slots = max(0, self.max_active - self.active_count)
+        # شبیه‌سازی ترتیب انتخاب زمان‌بند (بدون در نظر گرفتن سقف هر کاربر)
+        ahead_seconds = 0.0
+        position = 0
+        while True:
+            best = self._candidates(queues, {}, now)
+            if best is None:
+                break
+            _, user_id, job = best
+            queues[user_id].remove(job)
+            queues.move_to_end(user_id)
+            position += 1
+            if position <= free_slots:
+                eta = 0.0
+            else:
+                # کارهای جلوتر در صف به علاوه نیمه باقی‌مانده کارهای در حال اجرا
+                running = self.active_count * self._avg_duration / 2
+                eta = (ahead_seconds + running) / self.max_active
+            result[job.job_id] = (position, eta)
+            ahead_seconds += self.estimated_seconds(job)
+        return result
+
+    def completion_stats(self) -> dict:
+        """میانگین زمان تکمیل هر کلاس حجمی: {class: (count, mean_seconds)}"""
+        return {name: (count, total / count) for name, (count, total) in self._completion.items() if count}
+
+    def queued_jobs(self) -> list:
+        return [job for queue in self._queues.values() for job in queue]
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active_count,
+            'queued': self.queued_count,
+            'rejected': self.rejected,
+            'completed': self.completed,
+            'avg_duration': self._avg_duration,
+            'throughput': self._throughput,
+        }
@@ -0,0 +1,194 @@
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# جهت‌های ترافیک
+INGRESS = 'in'
+EGRESS = 'out'
+
+
+class TransferCancelled(Exception):
+    """انتقال توسط طرف async لغو شد (timeout یا cancel)"""
+
+
+class Stream:
+    """یک انتقال فعال (دانلود یا آپلود) که سهم پهنای باند دریافت می‌کند"""
+
+    def __init__(self, manager, stream_id: int, job_id, host: str, direction: str, cancel=None):
+        self.manager = manager
+        self.cancel = cancel  # threading.Event برای لغو همکارانه thread انتقال
+        self.stream_id = stream_id
+        self.job_id = job_id
+        self.host = host
+        self.direction = direction
+        self.allocation = 0.0  # سهم فعلی (بایت در ثانیه)، صفر = بدون محدودیت
+        self.bytes = 0
+        self.rate = 0.0  # سرعت اندازه‌گیری شده (میانگین متحرک)
+        self.started = time.monotonic()
+        self._next_time = self.started
+        self._window_start = self.started
+        self._window_bytes = 0
+
+    def _account(self, nbytes: int) -> float:
+        """ثبت بایت‌های منتقل‌شده و محاسبه مدت لازم برای توقف تا رعایت سهم"""
+        now = time.monotonic()
+        self.bytes += nbytes
+        self._window_bytes += nbytes
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            current = self._window_bytes / elapsed
+            self.rate = current if not self.rate else self.rate * 0.6 + current * 0.4
+            self._window_start = now
+            self._window_bytes = 0
+            self.manager._maybe_reallocate(now)
+
+        allocation = self.allocation
+        if allocation <= 0:
+            return 0.0
+        # اجازه انفجار کوتاه (حداکثر 1 ثانیه اعتبار ذخیره‌شده)
+        self._next_time = max(self._next_time, now - 1.0) + nbytes / allocation
+        return max(0.0, self._next_time - now)
+
+    def consume(self, nbytes: int):
+        """ثبت بایت‌ها و توقف (در thread) تا رعایت سهم پهنای باند؛ نقطه لغو انتقال"""
+        delay = self._account(nbytes)
+        if self.cancel is None:
+            if delay > 0:
+                time.sleep(delay)
+            return
+        if self.cancel.is_set() or (delay > 0 and self.cancel.wait(delay)):
+            raise TransferCancelled(f"انتقال کار {self.job_id} لغو شد")
+
+    async def consume_async(self, nbytes: int):
+        """نسخه async برای callback های پیشرفت (مثل آپلود Pyrogram)"""
+        delay = self._account(nbytes)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class BandwidthManager:
+    """
+    تقسیم پهنای باند ورودی/خروجی بین انتقال‌های همزمان
+
+    - بودجه کل برای هر جهت (صفر = بدون محدودیت)
+    - تقسیم max-min منصفانه بین انتقال‌های فعال (انتقال‌هایی که کمتر از سهم خود
+      مصرف می‌کنند، باقی‌مانده را به بقیه می‌دهند)
+    - سقف تعداد اتصال و سرعت برای هر هاست
+    """
+
+    def __init__(self, ingress_limit: float = 0, egress_limit: float = 0,
+                 host_connections: int = 4, host_rate_limit: float = 0,
+                 reallocate_interval: float = 1.0):
+        self.limits = {INGRESS: ingress_limit, EGRESS: egress_limit}
+        self.host_connections = host_connections
+        self.host_rate_limit = host_rate_limit
+        self.reallocate_interval = reallocate_interval
+        self._streams = {}  # {stream_id: Stream}
+        self._host_slots = {}  # {host: threading.BoundedSemaphore}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._last_allocation = 0.0
+        self.connection_waits = 0
+
+    def _slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.host_connections)
+            return slot
+
+    @contextmanager
+    def stream(self, job_id, host: str, direction: str = INGRESS, limit_connections: bool = True, cancel=None):
+        """
+        ثبت یک انتقال فعال؛ برای دانلودها ابتدا منتظر جای خالی در سقف اتصال هاست می‌ماند
+
+        cancel: threading.Event اختیاری؛ با set شدن، انتظار و consume با TransferCancelled قطع می‌شوند
+        """
+        slot = None
+        if limit_connections and host and self.host_connections > 0:
+            slot = self._slot(host)
+            if not slot.acquire(blocking=False):
+                self.connection_waits += 1
+                while not slot.acquire(timeout=1.0):
+                    if cancel is not None and cancel.is_set():
+                        raise TransferCancelled(f"انتقال کار {job_id} پیش از شروع لغو شد")
+        stream = Stream(self, next(self._ids), job_id, host, direction, cancel)
+        with self._lock:
+            self._streams[stream.stream_id] = stream
+            self._reallocate_locked(direction)
+        try:
+            yield stream
+        finally:
+            with self._lock:
+                self._streams.pop(stream.stream_id, None)
+                self._reallocate_locked(direction)
+            if slot is not None:
+                slot.release()
+
+    def _maybe_reallocate(self, now: float):
+        if now - self._last_allocation < self.reallocate_interval:
+            return
+        with self._lock:
+            self._last_allocation = now
+            for direction in (INGRESS, EGRESS):
+                self._reallocate_locked(direction)
+
+    def _reallocate_locked(self, direction: str):
+        """محاسبه سهم max-min منصفانه هر انتقال با در نظر گرفتن سقف هاست و تقاضای واقعی"""
+        streams = [s for s in self._streams.values() if s.direction == direction]
+        if not streams:
+            return
+        per_host = {}
+        for stream in streams:
+            per_host[stream.host] = per_host.get(stream.host, 0) + 1
+
+        caps = {}
+        for stream in streams:
+            cap = float('inf')
+            if self.host_rate_limit > 0 and direction == INGRESS:
+                cap = self.host_rate_limit / per_host[stream.host]
+            # انتقالی که مدتی است کمتر از سهمش مصرف می‌کند، فقط کمی بیشتر از مصرف فعلی سهم می‌گیرد
+            if stream.rate and stream.allocation and stream.rate < stream.allocation * 0.8:
+                cap = min(cap, stream.rate * 1.2)
+            caps[stream.stream_id] = cap
+
+        budget = self.limits.get(direction) or 0
+        if budget <= 0:
+            for stream in streams:
+                cap = caps[stream.stream_id]
+                stream.allocation = 0.0 if cap == float('inf') else cap
+            return
+
+        # water-filling: کمترین سقف‌ها ابتدا کامل داده می‌شوند و باقی‌مانده مساوی تقسیم می‌شود
+        remaining = budget
+        ordered = sorted(streams, key=lambda s: caps[s.stream_id])
+        for index, stream in enumerate(ordered):
+            fair = remaining / (len(ordered) - index)
+            allocation = min(caps[stream.stream_id], fair)
+            stream.allocation = allocation
+            remaining -= allocation
+
+    def snapshot(self) -> list:
+        """وضعیت زنده انتقال‌های فعال برای نمایش به ادمین"""
+        with self._lock:
+            streams = list(self._streams.values())
+        return [{
+            'job_id': s.job_id,
+            'host': s.host,
+            'direction': s.direction,
+            'rate': s.rate,
+            'allocation': s.allocation,
+            'bytes': s.bytes,
+            'elapsed': time.monotonic() - s.started,
+        } for s in streams]
+
+    def total_rate(self, direction: str) -> float:
+        with self._lock:
+            return sum(s.rate for s in self._streams.values() if s.direction == direction)
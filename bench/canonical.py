@@ -0,0 +1,200 @@
+"""
+بنچمارک canonicalize روی مجموعه بزرگی از شکل‌های واقعی لینک‌ها
+
+    python -m bench.canonical --ids 300
+    python -m bench.canonical --output bench/results/canonical-new.json --compare bench/results/canonical-old.json
+
+برای هر محتوا (سایت + شناسه) شکل‌هایی که کاربران واقعاً می‌فرستند ساخته می‌شود (youtu.be، m.،
+پارامترهای si/feature/utm، twitter.com و x.com با ?s=20 و ...). گزارش:
+- latency هر URL: cold (قبل از warm، فقط شکل یکتا)، اولین بار (memo خالی) و تکراری
+- درستی: تعداد کلیدهای یکتای خام، پس از canonicalize و تعداد واقعی محتواها؛
+  ادغام اشتباه (دو محتوای مختلف با یک کلید) و جدا ماندن (یک محتوا با چند کلید)
+"""
+import argparse
+import os
+import random
+import string
+import time
+
+from bench.common import compare_results, latency_summary, metadata, save_results
+
+TRACKING = [
+    '', 'utm_source=telegram', 'utm_source=share&utm_medium=ios_app&utm_campaign=x', 'fbclid=IwAR{r}',
+    'igshid={r}', 'ref=share', 'gclid={r}',
+]
+
+
+def _token(rng, length=11, alphabet=string.ascii_letters + string.digits + '-_'):
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+def _youtube(rng, vid):
+    si = _token(rng, 16)
+    return [
+        f'https://www.youtube.com/watch?v={vid}',
+        f'https://youtu.be/{vid}',
+        f'https://youtu.be/{vid}?si={si}',
+        f'https://m.youtube.com/watch?v={vid}&si={si}',
+        f'https://youtube.com/watch?v={vid}&feature=share',
+        f'https://www.youtube.com/watch?feature=youtu.be&v={vid}',
+        f'https://www.youtube.com/shorts/{vid}?feature=share',
+        f'http://www.youtube.com/watch?v={vid}&pp=ygU{si}',
+        f'https://music.youtube.com/watch?v={vid}&si={si}',
+        f'https://www.youtube.com/embed/{vid}',
+    ]
+
+
+def _twitter(rng, vid):
+    user = _token(rng, 8, string.ascii_lowercase)
+    return [
+        f'https://twitter.com/{user}/status/{vid}',
+        f'https://x.com/{user}/status/{vid}',
+        f'https://x.com/{user}/status/{vid}?s=20',
+        f'https://twitter.com/{user}/status/{vid}?s=46&t={_token(rng, 22)}',
+        f'https://mobile.twitter.com/{user}/status/{vid}',
+        f'https://x.com/{user}/status/{vid}/video/1',
+        f'https://fxtwitter.com/{user}/status/{vid}',
+    ]
+
+
+def _reddit(rng, vid):
+    slug = _token(rng, 12, string.ascii_lowercase + '_')
+    return [
+        f'https://www.reddit.com/r/videos/comments/{vid}/{slug}/',
+        f'https://old.reddit.com/r/videos/comments/{vid}/{slug}/',
+        f'https://reddit.com/r/videos/comments/{vid}/{slug}/?utm_source=share&utm_medium=android_app',
+        f'https://www.reddit.com/r/videos/comments/{vid}/{slug}/?share_id={_token(rng, 20)}',
+    ]
+
+
+def _xvideos(rng, vid):
+    slug = _token(rng, 14, string.ascii_lowercase + '_')
+    return [
+        f'https://www.xvideos.com/video{vid}/{slug}',
+        f'https://xvideos.com/video{vid}/{slug}#comments',
+        f'http://www.xvideos.com/video{vid}/{slug}?utm_source=telegram',
+    ]
+
+
+def _vimeo(rng, vid):
+    return [
+        f'https://vimeo.com/{vid}',
+        f'https://www.vimeo.com/{vid}?share=copy',
+        f'https://vimeo.com/{vid}/',
+    ]
+
+
+def _direct(rng, vid):
+    # لینک‌های مستقیم فایل: فقط شکل یکتای URL (پارامترهای غیرردیابی باید بمانند)
+    return [
+        f'https://cdn.example.com/files/{vid}.mp4',
+        f'https://CDN.example.com:443/files/{vid}.mp4?utm_source=telegram',
+        f'http://cdn.example.com/files/{vid}.mp4#t=10',
+    ]
+
+
+SITES = {
+    'youtube': (_youtube, lambda rng: _token(rng)),
+    'twitter': (_twitter, lambda rng: str(rng.randrange(10 ** 18, 2 * 10 ** 18))),
+    'reddit': (_reddit, lambda rng: _token(rng, 6, string.ascii_lowercase + string.digits)),
+    'xvideos': (_xvideos, lambda rng: str(rng.randrange(10 ** 6, 10 ** 8))),
+    'vimeo': (_vimeo, lambda rng: str(rng.randrange(10 ** 7, 10 ** 9))),
+    'direct': (_direct, lambda rng: _token(rng, 12)),
+}
+
+
+def build_corpus(ids: int, seed: int = 1):
+    """[(url, شناسه واقعی محتوا)]؛ هر شکل با پارامتر ردیابی تصادفی اضافه"""
+    rng = random.Random(seed)
+    corpus = []
+    for site, (variants, make_id) in SITES.items():
+        for _ in range(ids):
+            vid = make_id(rng)
+            for url in variants(rng, vid):
+                extra = rng.choice(TRACKING).format(r=_token(rng, 20))
+                if extra and '#' not in url:
+                    url += ('&' if '?' in url else '?') + extra
+                corpus.append((url, f'{site}:{vid}'))
+    rng.shuffle(corpus)
+    return corpus
+
+
+def time_pass(canonicalize, corpus, resolve=True):
+    latencies, keys = [], []
+    for url, _ in corpus:
+        started = time.perf_counter()
+        canonical = canonicalize(url, resolve=resolve)
+        latencies.append(time.perf_counter() - started)
+        keys.append(canonical.key)
+    return latencies, keys
+
+
+def correctness(corpus, keys) -> dict:
+    by_key, by_truth = {}, {}
+    for (_, truth), key in zip(corpus, keys):
+        by_key.setdefault(key, set()).add(truth)
+        by_truth.setdefault(truth, set()).add(key)
+    return {
+        'raw_distinct': len({url for url, _ in corpus}),
+        'canonical_distinct': len(by_key),
+        'true_distinct': len(by_truth),
+        'wrong_merges': sum(1 for truths in by_key.values() if len(truths) > 1),
+        'split_contents': sum(1 for found in by_truth.values() if len(found) > 1),
+    }
+
+
+def _us(summary: dict) -> dict:
+    return {name: value * 1e6 for name, value in summary.items()}
+
+
+def run(args) -> dict:
+    import canonical
+
+    corpus = build_corpus(args.ids, args.seed)
+    print(f"مجموعه: {len(corpus)} لینک از {len(SITES) * args.ids} محتوا")
+
+    cold, _ = time_pass(canonical.canonicalize, corpus, resolve=False)
+    started = time.perf_counter()
+    canonical.resolver.warm()
+    warm_seconds = time.perf_counter() - started
+    first, keys = time_pass(canonical.canonicalize, corpus)
+    repeat, _ = time_pass(canonical.canonicalize, corpus)
+
+    results = {
+        'meta': dict(metadata(), args=vars(args)),
+        'warm_seconds': warm_seconds,
+        'full_scans': canonical.resolver.scans,
+        'scenarios': {
+            'normalize_only': {'latency': latency_summary(cold)},
+            'resolve_first': {'latency': latency_summary(first)},
+            'resolve_repeat': {'latency': latency_summary(repeat)},
+        },
+        'correctness': correctness(corpus, keys),
+    }
+    for name, scenario in results['scenarios'].items():
+        latency = _us(scenario['latency'])
+        print(f"{name:16} p50 {latency['p50']:7.1f}us  p99 {latency['p99']:8.1f}us  max {latency['max']:9.1f}us")
+    print(f"warm: {warm_seconds:.2f}s، پیمایش کامل استخراج‌کننده‌ها: {canonical.resolver.scans}")
+    for name, value in results['correctness'].items():
+        print(f"{name:20} {value}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='URL canonicalization latency and dedup benchmark')
+    parser.add_argument('--ids', type=int, default=300, help='distinct contents per site')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=os.path.join('bench', 'results', 'canonical-' + time.strftime('%Y%m%d-%H%M%S') + '.json'))
+    parser.add_argument('--compare', help='previous canonical results JSON to compare against')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    results = run(args)
+    save_results(results, output)
+    print(f"\nنتایج در {output} ذخیره شد")
+    if args.compare:
+        compare_results(results, os.path.abspath(args.compare), keys=('p50', 'p99'))
+
+
+if __name__ == '__main__':
+    main()
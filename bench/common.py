@@ -0,0 +1,146 @@
+"""ابزارهای مشترک بنچمارک و تست بار"""
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+# مقادیر پیش‌فرض محیط برای اجرای main بدون اتصال به تلگرام واقعی
+BENCH_ENV = {
+    'BOT_TOKEN': '123456:bench-token',
+    'API_ID': '1',
+    'API_HASH': 'bench',
+    'BOT_MODE': 'polling',
+    'PORT': '0',
+}
+
+
+def load_main(workdir: str = None, **env):
+    """
+    import کردن main در یک پوشه کاری موقت (downloads و data آنجا ساخته می‌شوند)
+
+    متغیرهای محیطی قبل از import تنظیم می‌شوند چون main تنظیماتش را هنگام import می‌خواند.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='bot-bench-')
+    for key, value in {**BENCH_ENV, **env}.items():
+        os.environ[key] = str(value)
+    os.chdir(workdir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.makedirs('downloads', exist_ok=True)
+    return importlib.import_module('main')
+
+
+def percentile(values: list, fraction: float) -> float:
+    from loopmon import percentile as sorted_percentile
+    return sorted_percentile(sorted(values), fraction)
+
+
+def latency_summary(latencies: list) -> dict:
+    return {
+        'p50': percentile(latencies, 0.5),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': max(latencies) if latencies else 0.0,
+    }
+
+
+def bucket_quantile(bounds, counts: list, fraction: float) -> float:
+    """صدک تقریبی از شمارش bucket ها (مرز بالای bucket ای که صدک در آن است)"""
+    total = sum(counts)
+    if not total:
+        return 0.0
+    target = fraction * total
+    cumulative = 0
+    for bound, count in zip(tuple(bounds) + (float('inf'),), counts):
+        cumulative += count
+        if cumulative >= target:
+            return bound if bound != float('inf') else float(bounds[-1])
+    return float(bounds[-1])
+
+
+def current_rss() -> int:
+    """RSS فعلی پروسه (بایت)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def peak_rss() -> int:
+    """بیشینه RSS از شروع پروسه (بایت)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Measurement:
+    """اندازه‌گیری زمان دیواری، زمان CPU و حافظه یک سناریو"""
+
+    def __enter__(self):
+        self.wall_started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.rss_started = current_rss()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.wall_started
+        self.cpu = time.process_time() - self.cpu_started
+        self.rss_delta = current_rss() - self.rss_started
+        return False
+
+    def result(self) -> dict:
+        return {
+            'wall_seconds': self.wall,
+            'cpu_seconds': self.cpu,
+            'rss_delta_mb': self.rss_delta / MB,
+            'peak_rss_mb': peak_rss() / MB,
+        }
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+    except Exception:
+        commit = ''
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def save_results(results: dict, path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+def compare_results(current: dict, baseline_path: str, keys=('throughput_mb_s', 'p95', 'cpu_seconds')):
+    """چاپ تغییر معیارهای اصلی هر سناریو نسبت به یک اجرای قبلی"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nمقایسه با {baseline_path} ({baseline.get('meta', {}).get('commit', '?')}):")
+    old_scenarios = baseline.get('scenarios', {})
+    for name, result in current.get('scenarios', {}).items():
+        old = old_scenarios.get(name)
+        if not old:
+            continue
+        parts = []
+        for key in keys:
+            new_value = result.get(key, result.get('latency', {}).get(key))
+            old_value = old.get(key, old.get('latency', {}).get(key))
+            if new_value is None or not old_value:
+                continue
+            parts.append(f"{key} {(new_value - old_value) * 100 / old_value:+.1f}%")
+        print(f"  {name}: {', '.join(parts)}")
@@ -0,0 +1,176 @@
+"""
+بنچمارک تبدیل GIF به mp4 روی مجموعه‌ای از GIF های واقعی
+
+    python -m bench.gif --corpus ~/gifs
+    python -m bench.gif --corpus ~/gifs --upload-rates 1M,4M,16M --output bench/results/gif-new.json
+    python -m bench.gif --generate 20
+
+هر GIF با همان تابع ربات (media.gif_to_mp4) تبدیل می‌شود و برای هر سرعت آپلود زمان کل این سیاست‌ها
+مقایسه می‌شود: همیشه GIF خام، همیشه mp4، انتخاب ربات (AnimationCost که به ترتیب مجموعه یاد می‌گیرد)
+و بهترین انتخاب ممکن با دانستن نتیجه (oracle). --generate بدون مجموعه واقعی GIF های ساختگی با
+ffmpeg می‌سازد؛ نسبت حجم آن‌ها نماینده محتوای واقعی نیست.
+"""
+import argparse
+import asyncio
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.common import MB, ROOT, compare_results, metadata, save_results
+from bench.origin import parse_size
+
+sys.path.insert(0, ROOT)
+import media  # noqa: E402
+
+# حداکثر حجم آپلود با Bot API؛ بزرگ‌تر از آن باید با Pyrogram ارسال شود
+BOT_API_LIMIT = 50 * MB
+
+
+def generate_corpus(count: int, folder: str) -> list:
+    """GIF های ساختگی با ابعاد و مدت متفاوت از منابع تست ffmpeg"""
+    sources = ('testsrc2', 'mandelbrot', 'life=s=320x240:mold=10:ratio=0.1', 'cellauto=rule=110')
+    paths = []
+    for index in range(count):
+        source = sources[index % len(sources)]
+        width = (160, 320, 480)[index % 3]
+        seconds = 2 + index % 5
+        path = os.path.join(folder, f'generated-{index}.gif')
+        subprocess.run(
+            ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', source, '-t', str(seconds),
+             '-vf', f'fps=15,scale={width}:-2', path],
+            check=True,
+        )
+        paths.append(path)
+    return paths
+
+
+def convert_corpus(paths: list, workdir: str, timeout: float) -> list:
+    samples = []
+    for path in paths:
+        # کپی تا خروجی کنار فایل اصلی مجموعه نوشته نشود
+        source = os.path.join(workdir, os.path.basename(path))
+        shutil.copyfile(path, source)
+        result = asyncio.run(media.gif_to_mp4(source, timeout))
+        gif_size = os.path.getsize(source)
+        os.remove(source)
+        if result['output']:
+            os.remove(result['output'])
+        samples.append({
+            'name': os.path.basename(path),
+            'gif_bytes': gif_size,
+            'mp4_bytes': result['size'],
+            'seconds': result['seconds'],
+            'error': result['error'],
+        })
+        ratio = f"{result['size'] / gif_size:.2f}" if result['output'] else 'خطا'
+        print(f"{samples[-1]['name'][:40]:40} {gif_size / MB:7.2f} MB → {result['size'] / MB:7.2f} MB  "
+              f"نسبت {ratio:>5}  {result['seconds']:.2f}s")
+    return samples
+
+
+def simulate(samples: list, upload_rate: float) -> dict:
+    """زمان کل هر سیاست برای یک سرعت آپلود (تبدیل‌های ناموفق همیشه GIF خام ارسال می‌کنند)"""
+    advisor = media.AnimationCost()
+    totals = {'gif': 0.0, 'mp4': 0.0, 'advisor': 0.0, 'oracle': 0.0}
+    uploaded = {'gif': 0, 'advisor': 0}
+    converted = 0
+    for sample in samples:
+        gif_size = sample['gif_bytes']
+        keep = gif_size / upload_rate
+        if sample['error']:
+            for name in totals:
+                totals[name] += keep
+            uploaded['gif'] += gif_size
+            uploaded['advisor'] += gif_size
+            continue
+        # مثل ربات: پس از تبدیل فایل کوچک‌تر ارسال می‌شود
+        best_size = min(gif_size, sample['mp4_bytes'])
+        convert = sample['seconds'] + best_size / upload_rate
+        totals['gif'] += keep
+        totals['mp4'] += sample['seconds'] + sample['mp4_bytes'] / upload_rate
+        totals['oracle'] += min(keep, convert)
+        uploaded['gif'] += gif_size
+        decision, _ = advisor.decide(gif_size, upload_rate)
+        if decision:
+            converted += 1
+            totals['advisor'] += convert
+            uploaded['advisor'] += best_size
+            advisor.record(gif_size, sample['mp4_bytes'], sample['seconds'])
+        else:
+            totals['advisor'] += keep
+            uploaded['advisor'] += gif_size
+    return {
+        'upload_rate': upload_rate,
+        'seconds': totals,
+        'advisor_regret': totals['advisor'] / totals['oracle'] - 1 if totals['oracle'] else 0.0,
+        'speedup_vs_gif': totals['gif'] / totals['advisor'] if totals['advisor'] else 0.0,
+        'converted': converted,
+        'uploaded_bytes': uploaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='GIF to mp4 conversion benchmark')
+    parser.add_argument('--corpus', help='folder of GIF files (searched recursively)')
+    parser.add_argument('--generate', type=int, default=0, help='synthetic GIFs to generate when there is no corpus')
+    parser.add_argument('--upload-rates', default='1M,4M,16M', help='upload speeds to evaluate (bytes/s)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='conversion timeout per GIF (s)')
+    parser.add_argument('--output', default=os.path.join('bench', 'results', 'gif-' + time.strftime('%Y%m%d-%H%M%S') + '.json'))
+    parser.add_argument('--compare', help='previous gif results JSON to compare against')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    if not media.ffmpeg_available():
+        parser.error('ffmpeg نصب نیست')
+    workdir = tempfile.mkdtemp(prefix='bot-gif-')
+    if args.corpus:
+        paths = sorted(glob.glob(os.path.join(os.path.expanduser(args.corpus), '**', '*.gif'), recursive=True))
+    elif args.generate:
+        paths = generate_corpus(args.generate, tempfile.mkdtemp(prefix='bot-gif-corpus-'))
+    else:
+        parser.error('--corpus یا --generate لازم است')
+    if not paths:
+        parser.error('هیچ GIF پیدا نشد')
+
+    samples = convert_corpus(paths, workdir, args.timeout)
+    ok = [sample for sample in samples if not sample['error']]
+    gif_bytes = sum(sample['gif_bytes'] for sample in ok)
+    mp4_bytes = sum(sample['mp4_bytes'] for sample in ok)
+    convert_seconds = sum(sample['seconds'] for sample in ok)
+    summary = {
+        'files': len(samples),
+        'failed': len(samples) - len(ok),
+        'size_ratio': mp4_bytes / gif_bytes if gif_bytes else 0.0,
+        'encode_mb_s': gif_bytes / convert_seconds / MB if convert_seconds else 0.0,
+        'over_bot_api_limit_gif': sum(1 for sample in samples if sample['gif_bytes'] > BOT_API_LIMIT),
+        'over_bot_api_limit_mp4': sum(
+            1 for sample in samples
+            if (sample['mp4_bytes'] if not sample['error'] else sample['gif_bytes']) > BOT_API_LIMIT
+        ),
+    }
+    print(f"\n{summary['files']} GIF، {summary['failed']} ناموفق، حجم mp4 {summary['size_ratio'] * 100:.0f}% GIF، "
+          f"تبدیل {summary['encode_mb_s']:.1f} MB/s از GIF، بالای 50MB: "
+          f"{summary['over_bot_api_limit_gif']} GIF → {summary['over_bot_api_limit_mp4']} پس از تبدیل")
+
+    scenarios = {}
+    for rate in args.upload_rates.split(','):
+        result = simulate(samples, parse_size(rate))
+        scenarios[f'upload_{rate}'] = result
+        seconds = result['seconds']
+        print(f"آپلود {rate + '/s':>7}: GIF {seconds['gif']:7.1f}s  mp4 {seconds['mp4']:7.1f}s  "
+              f"ربات {seconds['advisor']:7.1f}s ({result['converted']} تبدیل)  oracle {seconds['oracle']:7.1f}s  "
+              f"فاصله از oracle {result['advisor_regret'] * 100:.1f}%")
+
+    results = {'meta': dict(metadata(), args=vars(args)), 'summary': summary, 'scenarios': scenarios, 'samples': samples}
+    save_results(results, output)
+    print(f"\nنتایج در {output} ذخیره شد")
+    if args.compare:
+        compare_results(results, os.path.abspath(args.compare), keys=('speedup_vs_gif', 'advisor_regret'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""
+تست بار: Application واقعی ربات (build_application) در برابر Bot API جعلی
+
+    python -m bench.loadtest --users 300 --stages 5,10,20,40 --stage-seconds 30
+    python -m bench.loadtest --mix direct:60,video:30,fail:10 --sizes 1M:60,10M:30,60M:10 --repeat-ratio 0.3
+
+آپدیت‌ها از طریق getUpdates سرور جعلی به polling واقعی ربات می‌رسند. در هر مرحله،
+تعداد مشخصی «جایگاه» همزمان هر کدام از طرف یک کاربر تصادفی لینک می‌فرستند، منتظر
+نتیجه می‌مانند و پس از مکث دوباره می‌فرستند. برای هر مرحله تاخیر کامل، انتظار در صف،
+تاخیر event loop، برخورد با flood control و نرخ خطا ثبت می‌شود و نقطه اشباع
+(knee) منحنی توان عملیاتی گزارش می‌شود.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import time
+
+from bench.common import (
+    MB, Measurement, bucket_quantile, latency_summary, load_main, metadata, save_results,
+)
+from bench.mock_telegram import FakePyrogramClient, MockTelegram
+from bench.origin import start_origin
+
+FILE_METHODS = ('sendDocument', 'sendVideo', 'sendAnimation', 'sendPhoto')
+# متن پیام‌های نهایی غیرموفق (رد در صف یا خطا)
+REJECT_MARKERS = ('شلوغ', 'تعداد درخواست')
+# is_video_site روی کل URL جستجو می‌کند؛ این پارامتر صفحه محلی را به مسیر yt-dlp می‌فرستد
+VIDEO_SITE_MARKER = 'ref=vimeo.com'
+
+
+def parse_weights(text: str) -> list:
+    """'a:60,b:40' → [('a', 60.0), ('b', 40.0)]"""
+    weights = []
+    for item in text.split(','):
+        name, _, weight = item.partition(':')
+        weights.append((name.strip(), float(weight or 1)))
+    return weights
+
+
+def choose(weights: list) -> str:
+    names, values = zip(*weights)
+    return random.choices(names, values)[0]
+
+
+class LinkMix:
+    """تولید لینک‌های مصنوعی با نسبت تکرار، توزیع حجم و نوع لینک"""
+
+    def __init__(self, origin_url: str, mix: list, sizes: list, repeat_ratio: float):
+        self.origin_url = origin_url
+        self.mix = mix
+        self.sizes = sizes
+        self.repeat_ratio = repeat_ratio
+        self.history = []
+        self._ids = itertools.count(1)
+
+    def next(self) -> str:
+        if self.history and random.random() < self.repeat_ratio:
+            return random.choice(self.history)
+        kind = choose(self.mix)
+        size = choose(self.sizes)
+        number = next(self._ids)
+        if kind == 'video':
+            url = f'{self.origin_url}/page/{size}.html?{VIDEO_SITE_MARKER}&n={number}'
+        elif kind == 'fail':
+            url = f'{self.origin_url}/file/{size}.bin?fail=1&n={number}'
+        else:
+            ext = random.choice(('bin', 'mp4', 'zip'))
+            url = f'{self.origin_url}/file/{size}.{ext}?n={number}'
+        self.history.append(url)
+        return url
+
+
+class LoadGenerator:
+    def __init__(self, main, mock: MockTelegram, links: LinkMix, users: int, think: float, timeout: float):
+        self.main = main
+        self.mock = mock
+        self.links = links
+        self.users = list(range(500_000, 500_000 + users))
+        self.think = think
+        self.timeout = timeout
+        self.busy_users = set()
+        self.waiting = {}  # {user_id: Future}
+        mock.listeners.append(self._on_message)
+
+    def _on_message(self, now, chat_id, method, fields):
+        future = self.waiting.get(chat_id)
+        if future is None or future.done():
+            return
+        if method in FILE_METHODS:
+            future.set_result('ok')
+            return
+        text = fields.get('text', '')
+        if any(marker in text for marker in REJECT_MARKERS):
+            future.set_result('rejected')
+        elif text.startswith('❌'):
+            future.set_result('error')
+
+    async def _request(self, stage: dict):
+        user_id = random.choice([u for u in self.users if u not in self.busy_users] or self.users)
+        self.busy_users.add(user_id)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[user_id] = future
+        started = time.monotonic()
+        self.mock.push_message(user_id, self.links.next())
+        try:
+            outcome = await asyncio.wait_for(future, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+        finally:
+            self.waiting.pop(user_id, None)
+            self.busy_users.discard(user_id)
+        stage['outcomes'][outcome] = stage['outcomes'].get(outcome, 0) + 1
+        if outcome == 'ok':
+            stage['latencies'].append(time.monotonic() - started)
+
+    async def _slot(self, stage: dict, deadline: float):
+        while time.monotonic() < deadline:
+            await self._request(stage)
+            if self.think:
+                await asyncio.sleep(random.expovariate(1 / self.think))
+
+    async def run_stage(self, concurrency: int, seconds: float) -> dict:
+        main = self.main
+        stage = {'outcomes': {}, 'latencies': []}
+        queue_before = main.STAGE_SECONDS.counts(stage='queue')
+        bytes_before = sum(self.mock.upload_bytes.values())
+        flood_before = self.mock.flood_hits
+        errors_before = main.ERRORS.total()
+        main.loop_monitor.samples.clear()
+        with Measurement() as measurement:
+            deadline = time.monotonic() + seconds
+            await asyncio.gather(*(self._slot(stage, deadline) for _ in range(concurrency)))
+        queue_counts = [after - before for after, before in zip(main.STAGE_SECONDS.counts(stage='queue'), queue_before)]
+        buckets = main.STAGE_SECONDS.buckets
+        completed = stage['outcomes'].get('ok', 0)
+        total = sum(stage['outcomes'].values())
+        result = measurement.result()
+        result.update({
+            'concurrency': concurrency,
+            'requests': total,
+            'outcomes': stage['outcomes'],
+            'jobs_per_s': completed / result['wall_seconds'],
+            'throughput_mb_s': (sum(self.mock.upload_bytes.values()) - bytes_before) / MB / result['wall_seconds'],
+            'error_rate': (total - completed) / total if total else 0.0,
+            'latency': latency_summary(stage['latencies']),
+            'queue_wait': {f'p{int(q * 100)}': bucket_quantile(buckets, queue_counts, q) for q in (0.5, 0.95, 0.99)},
+            'loop_lag': main.loop_monitor.percentiles(),
+            'flood_hits': self.mock.flood_hits - flood_before,
+            'pipeline_errors': main.ERRORS.total() - errors_before,
+        })
+        latency = result['latency']
+        print(
+            f"c={concurrency:<4} {total:5} req  ok {completed:5}  err {result['error_rate'] * 100:5.1f}%  "
+            f"{result['jobs_per_s']:6.2f} job/s {result['throughput_mb_s']:7.1f} MB/s  "
+            f"e2e p50 {latency['p50']:.2f}s p95 {latency['p95']:.2f}s  "
+            f"queue p95 ≤{result['queue_wait']['p95']}s  "
+            f"lag p99 {result['loop_lag']['0.99'] * 1000:.0f}ms  flood {result['flood_hits']}"
+        )
+        return result
+
+
+def find_knee(stages: list, gain: float = 0.1) -> dict:
+    """اولین مرحله‌ای که افزایش همزمانی توان عملیاتی را کمتر از gain بالا می‌برد"""
+    for previous, current in zip(stages, stages[1:]):
+        if previous['jobs_per_s'] <= 0:
+            continue
+        improvement = current['jobs_per_s'] / previous['jobs_per_s'] - 1
+        if improvement < gain:
+            return {
+                'concurrency': previous['concurrency'],
+                'jobs_per_s': previous['jobs_per_s'],
+                'next_improvement': improvement,
+                'p95_growth': (current['latency']['p95'] / previous['latency']['p95'] - 1)
+                if previous['latency']['p95'] else None,
+            }
+    return {}
+
+
+async def run(args) -> dict:
+    origin_runner, origin_url = await start_origin()
+    mock = MockTelegram(latency=args.api_latency, flood_per_chat=args.flood_per_chat, flood_global=args.flood_global)
+    mock_runner, api_url = await mock.start()
+
+    main = load_main(BOT_API_URL=api_url)
+    logging.getLogger().setLevel(logging.WARNING)
+    application = main.build_application()
+    main.pyrogram_client = FakePyrogramClient(mock)
+
+    # همان ترتیب راه‌اندازی run_polling
+    await application.initialize()
+    await application.post_init(application)
+    await application.updater.start_polling(poll_interval=0.0, timeout=1, drop_pending_updates=True)
+    await application.start()
+
+    generator = LoadGenerator(
+        main, mock,
+        LinkMix(origin_url, parse_weights(args.mix), parse_weights(args.sizes), args.repeat_ratio),
+        users=args.users, think=args.think, timeout=args.request_timeout,
+    )
+    results = {'meta': metadata(), 'stages': []}
+    results['meta']['args'] = vars(args)
+    try:
+        for concurrency in (int(c) for c in args.stages.split(',')):
+            results['stages'].append(await generator.run_stage(concurrency, args.stage_seconds))
+            # تخلیه کارهای باقی‌مانده قبل از مرحله بعد
+            for _ in range(int(args.request_timeout)):
+                if not main.admission.queued_count and not main.admission.active_count:
+                    break
+                await asyncio.sleep(1)
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+        await mock_runner.cleanup()
+        await origin_runner.cleanup()
+
+    results['knee'] = find_knee(results['stages'])
+    results['telegram'] = mock.summary()
+    if results['knee']:
+        knee = results['knee']
+        print(f"\n📈 نقطه اشباع: همزمانی {knee['concurrency']} ({knee['jobs_per_s']:.2f} job/s)")
+    else:
+        print("\n📈 در محدوده مراحل اجرا شده نقطه اشباع دیده نشد")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the bot Application against a fake Bot API')
+    parser.add_argument('--users', type=int, default=300, help='simulated user pool size')
+    parser.add_argument('--stages', default='2,5,10,20,40', help='comma separated concurrency ramp')
+    parser.add_argument('--stage-seconds', type=float, default=30)
+    parser.add_argument('--mix', default='direct:70,video:20,fail:10', help='link kinds: direct, video, fail')
+    parser.add_argument('--sizes', default='1M:50,5M:30,20M:15,60M:5', help='size distribution')
+    parser.add_argument('--repeat-ratio', type=float, default=0.2, help='probability of resending a previous link')
+    parser.add_argument('--think', type=float, default=1.0, help='mean pause between requests of a slot (s)')
+    parser.add_argument('--request-timeout', type=float, default=300)
+    parser.add_argument('--api-latency', type=float, default=0.02, help='added latency per Bot API call (s)')
+    parser.add_argument('--flood-per-chat', type=int, default=5, help='Bot API messages per second per chat')
+    parser.add_argument('--flood-global', type=int, default=30, help='Bot API messages per second overall')
+    parser.add_argument('--output', default=os.path.join('bench', 'results', 'load-' + time.strftime('%Y%m%d-%H%M%S') + '.json'))
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    results = asyncio.run(run(args))
+    save_results(results, output)
+    print(f"نتایج در {output} ذخیره شد")
+
+
+if __name__ == '__main__':
+    main()
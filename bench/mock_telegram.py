@@ -0,0 +1,367 @@
+"""
+سرور جعلی Bot API و مقصد آپلود MTProto برای بنچمارک و تست بار
+
+- /bot{token}/{method}: پاسخ‌های معتبر Bot API برای متدهایی که ربات استفاده می‌کند
+  (فایل‌های multipart به صورت جریانی خوانده و دور ریخته می‌شوند)
+- getUpdates: آپدیت‌هایی که با push_update اضافه شده‌اند (long polling واقعی)؛ مثل تلگرام هر آپدیت تا
+  تایید با offset بزرگ‌تر دوباره تحویل داده می‌شود و long poll قبلی با درخواست جدید 409 Conflict می‌گیرد
+- ارسال با URL: مثل تلگرام فایل را از مبدأ دریافت می‌کند (سقف 20MB)
+- سقف آپلود multipart مثل api.telegram.org 50MB است (413)؛ با local_mode مثل `telegram-bot-api --local`
+  سقف 2000MB است و فایل با مسیر محلی (file://) هم پذیرفته و مستقیم از دیسک خوانده می‌شود
+- flood control: بیش از flood_per_chat پیام در ثانیه به یک چت یا flood_global در کل → 429 با retry_after
+- FakePyrogramClient: جایگزین Pyrogram که فایل را می‌خواند و progress را صدا می‌زند
+"""
+import asyncio
+import inspect
+import itertools
+import time
+from collections import Counter, defaultdict, deque
+from types import SimpleNamespace
+from urllib.parse import unquote, urlparse
+
+import aiohttp
+from aiohttp import web
+
+URL_FETCH_LIMIT = 20 * 1024 * 1024
+CLOUD_UPLOAD_LIMIT = 50 * 1024 * 1024
+LOCAL_UPLOAD_LIMIT = 2000 * 1024 * 1024
+_FILE_FIELDS = ('document', 'video', 'animation', 'photo', 'audio')
+
+
+class MockTelegram:
+    """وضعیت سرور جعلی: آمار، صف آپدیت‌ها و رویدادهای تحویل"""
+
+    def __init__(self, latency: float = 0.0, flood_per_chat: int = 0, flood_global: int = 0, upload_rate: float = 0,
+                 local_mode: bool = False):
+        self.latency = latency
+        self.local_mode = local_mode
+        self.upload_limit = LOCAL_UPLOAD_LIMIT if local_mode else CLOUD_UPLOAD_LIMIT
+        self.flood_per_chat = flood_per_chat
+        self.flood_global = flood_global
+        self.upload_rate = upload_rate
+        self.calls = Counter()
+        self.upload_bytes = Counter()  # {'bot_api' | 'url' | 'mtproto' | 'local': bytes}
+        self.flood_hits = 0
+        self.deliveries = []  # [(time, chat_id, method, caption)]
+        self.listeners = []  # function(time, chat_id, method, fields) برای هر ارسال یا ویرایش پیام
+        self.updates = deque()  # آپدیت‌های تایید نشده به ترتیب update_id
+        self._pushed = asyncio.Event()
+        self._polls = 0
+        self._message_ids = itertools.count(1000)
+        self._update_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._chat_sends = defaultdict(deque)
+        self._global_sends = deque()
+
+    # --- آپدیت‌ها ---
+
+    def push_update(self, update: dict):
+        update.setdefault('update_id', next(self._update_ids))
+        self.updates.append(update)
+        self._pushed.set()
+
+    def push_message(self, user_id: int, text: str, username: str = None) -> int:
+        """ساخت آپدیت پیام متنی از یک کاربر جعلی؛ message_id را برمی‌گرداند"""
+        message_id = next(self._message_ids)
+        user = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': username or f'user{user_id}'}
+        entities = []
+        if text.startswith('/'):
+            entities.append({'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])})
+        self.push_update({'message': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': user['first_name']},
+            'from': user,
+            'text': text,
+            'entities': entities,
+        }})
+        return message_id
+
+    # --- ابزارهای داخلی ---
+
+    def _message(self, chat_id, **extra) -> dict:
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id or 0), 'type': 'private'},
+        }
+        message.update(extra)
+        return message
+
+    def _file(self, field: str, size: int) -> dict:
+        number = next(self._file_ids)
+        data = {'file_id': f'bench-{field}-{number}', 'file_unique_id': f'u{number}', 'file_size': size}
+        if field == 'photo':
+            return [dict(data, width=1280, height=720)]
+        if field in ('video', 'animation'):
+            data.update(width=1280, height=720, duration=10)
+        return data
+
+    def _flooded(self, chat_id) -> int:
+        """بررسی flood control؛ retry_after یا صفر"""
+        now = time.monotonic()
+        windows = []
+        if self.flood_per_chat and chat_id is not None:
+            windows.append((self._chat_sends[chat_id], self.flood_per_chat))
+        if self.flood_global:
+            windows.append((self._global_sends, self.flood_global))
+        for sends, limit in windows:
+            while sends and now - sends[0] > 1.0:
+                sends.popleft()
+            if len(sends) >= limit:
+                self.flood_hits += 1
+                return 1
+        for sends, _ in windows:
+            sends.append(now)
+        return 0
+
+    async def _read_fields(self, request) -> tuple:
+        """خواندن پارامترها؛ فایل‌ها جریانی خوانده و فقط شمارش می‌شوند"""
+        fields = {}
+        uploaded = 0
+        if request.content_type.startswith('multipart/'):
+            reader = await request.multipart()
+            started = time.monotonic()
+            async for part in reader:
+                if part.filename:
+                    while True:
+                        chunk = await part.read_chunk(256 * 1024)
+                        if not chunk:
+                            break
+                        uploaded += len(chunk)
+                        if self.upload_rate:
+                            ahead = uploaded / self.upload_rate - (time.monotonic() - started)
+                            if ahead > 0:
+                                await asyncio.sleep(ahead)
+                    fields[part.name] = f'attach://{part.name}'
+                else:
+                    fields[part.name] = await part.text()
+        elif request.content_type == 'application/json':
+            fields = await request.json()
+        else:
+            fields = dict(await request.post())
+        return fields, uploaded
+
+    async def _read_local(self, uri: str) -> int:
+        """خواندن فایل محلی مثل سرور --local (با سرعت upload_rate)؛ حجم یا -1 اگر خوانا نباشد"""
+        path = unquote(urlparse(uri).path)
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        size = 0
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = await loop.run_in_executor(None, f.read, 1024 * 1024)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if self.upload_rate:
+                        ahead = size / self.upload_rate - (time.monotonic() - started)
+                        if ahead > 0:
+                            await asyncio.sleep(ahead)
+        except OSError:
+            return -1
+        return size
+
+    async def _fetch_url(self, url: str) -> int:
+        """دریافت فایل از URL مثل سرور تلگرام؛ حجم یا -1 در صورت خطا"""
+        size = 0
+        try:
+            timeout = aiohttp.ClientTimeout(total=120)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.get(url) as response:
+                    if response.status != 200:
+                        return -1
+                    async for chunk in response.content.iter_chunked(256 * 1024):
+                        size += len(chunk)
+                        if size > URL_FETCH_LIMIT:
+                            return -1
+        except Exception:
+            return -1
+        return size
+
+    def _deliver(self, chat_id, method: str, fields: dict, record: bool = True):
+        now = time.monotonic()
+        chat = int(chat_id) if chat_id not in (None, '') else None
+        if record:
+            self.deliveries.append((now, chat, method, fields.get('caption') or fields.get('text', '')))
+        for listener in self.listeners:
+            listener(now, chat, method, fields)
+
+    # --- endpoint ---
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        fields, uploaded = await self._read_fields(request)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = fields.get('chat_id')
+        if method in ('sendMessage', 'editMessageText', 'sendDocument', 'sendVideo', 'sendAnimation', 'sendPhoto',
+                      'forwardMessage'):
+            retry_after = self._flooded(chat_id)
+            if retry_after:
+                return web.json_response({
+                    'ok': False, 'error_code': 429,
+                    'description': f'Too Many Requests: retry after {retry_after}',
+                    'parameters': {'retry_after': retry_after},
+                }, status=429)
+
+        if method == 'getMe':
+            return self._ok({'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+                             'can_join_groups': False, 'can_read_all_group_messages': False,
+                             'supports_inline_queries': False})
+        if method == 'getUpdates':
+            return await self._get_updates(fields)
+        if method in ('deleteWebhook', 'setWebhook', 'deleteMessage', 'answerCallbackQuery',
+                      'setMyCommands', 'sendChatAction', 'close', 'logOut'):
+            return self._ok(True)
+        if method == 'getWebhookInfo':
+            return self._ok({'url': '', 'has_custom_certificate': False, 'pending_update_count': 0})
+        if method == 'sendMessage':
+            self._deliver(chat_id, method, fields)
+            return self._ok(self._message(chat_id, text=fields.get('text', '')))
+        if method == 'editMessageText':
+            self._deliver(chat_id, method, fields, record=False)
+            return self._ok(self._message(chat_id, text=fields.get('text', '')))
+        if method == 'forwardMessage':
+            return self._ok(self._message(chat_id, text='forwarded'))
+        if method.startswith('send'):
+            field = method[4:].lower()
+            if field not in _FILE_FIELDS:
+                return self._ok(self._message(chat_id))
+            value = fields.get(field, '')
+            size = uploaded
+            if uploaded > self.upload_limit:
+                return self._error(413, 'Request Entity Too Large')
+            if uploaded:
+                self.upload_bytes['bot_api'] += uploaded
+            elif isinstance(value, str) and value.startswith('file://'):
+                if not self.local_mode:
+                    return self._error(400, 'Bad Request: wrong HTTP URL specified')
+                size = await self._read_local(value)
+                if size < 0:
+                    return self._error(400, 'Bad Request: file not found')
+                if size > self.upload_limit:
+                    return self._error(400, 'Bad Request: file is too big')
+                self.upload_bytes['local'] += size
+            elif isinstance(value, str) and value.startswith(('http://', 'https://')):
+                size = await self._fetch_url(value)
+                if size < 0:
+                    return self._error(400, 'Bad Request: failed to get HTTP URL content')
+                self.upload_bytes['url'] += size
+            elif value:
+                # ارسال دوباره با file_id یک فایل قبلی
+                self.calls[f'{method}.file_id'] += 1
+            self._deliver(chat_id, method, fields)
+            return self._ok(self._message(chat_id, caption=fields.get('caption', ''), **{field: self._file(field, size)}))
+        return self._error(404, 'Not Found: method not found')
+
+    async def _get_updates(self, fields: dict):
+        timeout = float(fields.get('timeout') or 0)
+        limit = int(fields.get('limit') or 100)
+        offset = int(fields.get('offset') or 0)
+        # آپدیت‌های قبل از offset تایید شده‌اند
+        while offset and self.updates and self.updates[0]['update_id'] < offset:
+            self.updates.popleft()
+        self._polls += 1
+        poll = self._polls
+        # long poll قبلی (پروسه دیگر یا درخواست رها شده) کنار گذاشته می‌شود
+        self._pushed.set()
+        await asyncio.sleep(0)
+        deadline = time.monotonic() + max(timeout, 0.01)
+        while not self.updates and poll == self._polls:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._pushed.clear()
+            try:
+                await asyncio.wait_for(self._pushed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+        if poll != self._polls:
+            return self._error(409, 'Conflict: terminated by other getUpdates request')
+        return self._ok(list(itertools.islice(self.updates, limit)))
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({'ok': True, 'result': result})
+
+    @staticmethod
+    def _error(code: int, description: str):
+        return web.json_response({'ok': False, 'error_code': code, 'description': description}, status=code)
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/bot{token}/{method}', self.handle)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+        """اجرای سرور روی event loop فعلی؛ (runner, base_url برای Bot API)"""
+        runner = web.AppRunner(self.create_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return runner, f'http://{host}:{port}/bot'
+
+    def summary(self) -> dict:
+        return {
+            'calls': dict(self.calls),
+            'upload_bytes': dict(self.upload_bytes),
+            'flood_hits': self.flood_hits,
+            'deliveries': len(self.deliveries),
+        }
+
+
+class FakePyrogramClient:
+    """جایگزین Pyrogram Client برای آپلودهای بزرگ (خواندن فایل با سرعت upload_rate)"""
+
+    def __init__(self, mock: MockTelegram, chunk_size: int = 512 * 1024):
+        self.mock = mock
+        self.chunk_size = chunk_size
+        self.is_connected = False
+
+    async def start(self):
+        self.is_connected = True
+
+    async def stop(self):
+        self.is_connected = False
+
+    async def _upload(self, method: str, chat_id, path: str, caption: str = '', progress=None, **kwargs):
+        self.mock.calls[f'mtproto.{method}'] += 1
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        sent = 0
+        with open(path, 'rb') as f:
+            total = f.seek(0, 2)
+            f.seek(0)
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, self.chunk_size)
+                if not chunk:
+                    break
+                sent += len(chunk)
+                if self.mock.upload_rate:
+                    ahead = sent / self.mock.upload_rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+                if progress is not None:
+                    result = progress(sent, total)
+                    if inspect.isawaitable(result):
+                        await result
+        self.mock.upload_bytes['mtproto'] += sent
+        self.mock._deliver(chat_id, method, {'caption': caption})
+        # مثل pyrogram.types.Message: فایل ارسال شده با file_id قابل استفاده در Bot API
+        field = method[4:].lower()
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id), **{field: SimpleNamespace(**self.mock._file(field, sent))})
+
+    async def send_document(self, chat_id, document, caption='', progress=None, **kwargs):
+        return await self._upload('sendDocument', chat_id, document, caption, progress)
+
+    async def send_video(self, chat_id, video, caption='', progress=None, **kwargs):
+        return await self._upload('sendVideo', chat_id, video, caption, progress)
+
+    async def send_animation(self, chat_id, animation, caption='', progress=None, **kwargs):
+        return await self._upload('sendAnimation', chat_id, animation, caption, progress)
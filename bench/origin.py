@@ -0,0 +1,182 @@
+"""
+سرور مبدأ محلی برای بنچمارک
+
+مسیرها:
+- /file/{size}.{ext}     فایل با حجم دلخواه (مثال: /file/10M.mp4 یا /file/4096.bin)
+    ?range=0             غیرفعال کردن پشتیبانی Range
+    ?rate=2M             محدودیت سرعت ارسال (بایت در ثانیه)
+    ?fail=0.3            احتمال قطع اتصال در میانه پاسخ (حالت ناپایدار)
+    ?ttfb=0.5            تاخیر قبل از اولین بایت (ثانیه)
+    ?v=2                 نسخه محتوا (ETag متفاوت؛ برای آزمودن If-Range روی فایلی که عوض شده)
+- /hls/{segments}x{size}/index.m3u8   پلی‌لیست HLS با segment های .ts
+- /page/{size}.html      صفحه HTML با تگ <video> برای extractor عمومی yt-dlp
+"""
+import asyncio
+import random
+import re
+
+from aiohttp import web
+
+CHUNK = 64 * 1024
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+_CONTENT_TYPES = {
+    'mp4': 'video/mp4',
+    'ts': 'video/mp2t',
+    'gif': 'image/gif',
+    'jpg': 'image/jpeg',
+    'zip': 'application/zip',
+    'pdf': 'application/pdf',
+}
+# الگوی ثابت برای محتوای قطعی (هر اجرا همان بایت‌ها را می‌سازد)
+_PATTERN = bytes(range(256)) * (CHUNK // 256)
+
+
+def parse_size(value: str) -> int:
+    """'10M' یا '512K' یا '4096' → بایت"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([KMG]?)', value.upper())
+    if not match:
+        raise ValueError(f"invalid size: {value}")
+    return int(float(match.group(1)) * _UNITS[match.group(2)])
+
+
+def _body_range(request, size: int, allow_range: bool, etag: str = ''):
+    """(status, start, end) با توجه به هدر Range و If-Range"""
+    header = request.headers.get('Range', '')
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+    if not allow_range or not match or size == 0:
+        return 200, 0, size
+    if_range = request.headers.get('If-Range')
+    if if_range is not None and if_range != etag:
+        # محتوا از زمان دانلود قبلی عوض شده: کل فایل
+        return 200, 0, size
+    first, last = match.groups()
+    if first == '':
+        start = max(0, size - int(last))
+        end = size
+    else:
+        start = int(first)
+        end = min(size, int(last) + 1) if last else size
+    if start >= size:
+        return 416, 0, 0
+    return 206, start, end
+
+
+async def serve_bytes(request, size: int, content_type: str):
+    query = request.query
+    allow_range = query.get('range', '1') != '0'
+    rate = parse_size(query['rate']) if 'rate' in query else 0
+    fail = float(query.get('fail', 0))
+    ttfb = float(query.get('ttfb', 0))
+
+    etag = f'"{size:x}-{query.get("v", "1")}"'
+    status, start, end = _body_range(request, size, allow_range, etag)
+    headers = {'Content-Type': content_type, 'ETag': etag}
+    if allow_range:
+        headers['Accept-Ranges'] = 'bytes'
+    if status == 416:
+        headers['Content-Range'] = f'bytes */{size}'
+        return web.Response(status=416, headers=headers)
+    if status == 206:
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+    headers['Content-Length'] = str(end - start)
+
+    if ttfb:
+        await asyncio.sleep(ttfb)
+    response = web.StreamResponse(status=status, headers=headers)
+    await response.prepare(request)
+    if request.method == 'HEAD':
+        return response
+
+    request.app['stats']['requests'] += 1
+    # نقطه قطع اتصال در حالت ناپایدار
+    cut_at = start + (end - start) // 2 if fail and random.random() < fail else None
+    position = start
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    while position < end:
+        length = min(CHUNK, end - position)
+        if cut_at is not None and position + length > cut_at:
+            request.app['stats']['cut'] += 1
+            request.transport.close()
+            return response
+        offset = position % CHUNK
+        chunk = (_PATTERN[offset:] + _PATTERN[:offset])[:length]
+        try:
+            await response.write(chunk)
+        except ConnectionError:
+            # کلاینت زودتر اتصال را بست (مثلاً لغو دانلود یا عبور از سقف حجم)
+            return response
+        position += length
+        request.app['stats']['bytes'] += length
+        if rate:
+            ahead = (position - start) / rate - (loop.time() - started)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+    await response.write_eof()
+    return response
+
+
+async def file_handler(request):
+    name = request.match_info['name']
+    size_text, _, ext = name.partition('.')
+    try:
+        size = parse_size(size_text)
+    except ValueError:
+        raise web.HTTPNotFound()
+    return await serve_bytes(request, size, _CONTENT_TYPES.get(ext, 'application/octet-stream'))
+
+
+async def hls_playlist(request):
+    segments, _, segment_size = request.match_info['spec'].partition('x')
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+    for index in range(int(segments)):
+        lines.append('#EXTINF:4.0,')
+        lines.append(f'seg{index}.ts?{request.query_string}' if request.query_string else f'seg{index}.ts')
+    lines.append('#EXT-X-ENDLIST')
+    return web.Response(text='\n'.join(lines) + '\n', content_type='application/vnd.apple.mpegurl')
+
+
+async def hls_segment(request):
+    _, _, segment_size = request.match_info['spec'].partition('x')
+    return await serve_bytes(request, parse_size(segment_size or '256K'), 'video/mp2t')
+
+
+async def page_handler(request):
+    size = request.match_info['size']
+    query = f'?{request.query_string}' if request.query_string else ''
+    html = (
+        '<!DOCTYPE html><html><head><title>Benchmark video</title></head><body>'
+        f'<video controls><source src="/file/{size}.mp4{query}" type="video/mp4"></video>'
+        '</body></html>'
+    )
+    return web.Response(text=html, content_type='text/html')
+
+
+def create_origin_app() -> web.Application:
+    app = web.Application()
+    app['stats'] = {'requests': 0, 'bytes': 0, 'cut': 0}
+    app.router.add_get('/file/{name}', file_handler)
+    app.router.add_get('/hls/{spec}/index.m3u8', hls_playlist)
+    app.router.add_get('/hls/{spec}/seg{index}.ts', hls_segment)
+    app.router.add_get('/page/{size}.html', page_handler)
+    return app
+
+
+async def start_origin(host: str = '127.0.0.1', port: int = 0):
+    """اجرای سرور مبدأ روی event loop فعلی؛ (runner, base_url)"""
+    app = create_origin_app()
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://{host}:{port}'
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local benchmark origin server')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+    web.run_app(create_origin_app(), host='127.0.0.1', port=args.port)
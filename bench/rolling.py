@@ -0,0 +1,217 @@
+"""
+تست جایگزینی نسخه (rolling restart) با تخلیه آرام
+
+    python -m bench.rolling --jobs 20 --drain-timeout 10
+    python -m bench.rolling --processes 2 --rate 1M --size 30M --drain-timeout 5
+
+نمونه A روی یک پوشه داده مشترک اجرا و کارها (بخشی سریع، بخشی کند با ?rate=) فرستاده می‌شوند. سپس
+مثل یک deploy به A سیگنال SIGTERM داده می‌شود، بعد از 503 شدن /ready آن نمونه B اجرا می‌شود و در
+تمام مدت جایگزینی پیام تازه فرستاده می‌شود. گزارش:
+- کارهای تحویل شده، از دست رفته و تکراری (یک کاربر بیش از یک فایل)
+- کارهای سپرده شده از A به B و پیشرفت تخلیه از /health
+- بیشترین فاصله بدون پاسخ به پیام تازه (زمان مرده برای کاربران)
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench.common import ROOT, metadata, save_results
+from bench.loadtest import FILE_METHODS
+from bench.mock_telegram import MockTelegram
+from bench.origin import start_origin
+from bench.startup import child_env
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def get_json(session, url: str):
+    try:
+        async with session.get(url) as response:
+            return response.status, await response.json()
+    except (aiohttp.ClientError, ValueError):
+        return None, None
+
+
+class Instance:
+    """یک نمونه ربات (python main.py) روی پوشه کاری مشترک"""
+
+    def __init__(self, name: str, workdir: str, env: dict):
+        self.name = name
+        self.port = free_port()
+        self.workdir = workdir
+        self.env = dict(env, PORT=str(self.port))
+        self.process = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    async def start(self):
+        self.log = open(os.path.join(self.workdir, f'{self.name}.log'), 'wb')
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, 'main.py'), cwd=self.workdir, env=self.env,
+            stdout=self.log, stderr=asyncio.subprocess.STDOUT,
+        )
+
+    async def wait_ready(self, session, timeout: float):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status, _ = await get_json(session, self.base_url + '/ready')
+            if status == 200:
+                return
+            await asyncio.sleep(0.2)
+        raise TimeoutError(f'{self.name} آماده نشد')
+
+    async def stop(self, timeout: float):
+        if self.process.returncode is None:
+            self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+        self.log.close()
+
+
+async def run(args) -> dict:
+    origin_runner, origin_url = await start_origin()
+    mock = MockTelegram()
+    mock_runner, api_url = await mock.start()
+    workdir = tempfile.mkdtemp(prefix='bot-rolling-')
+    env = child_env(
+        BOT_API_URL=api_url, WORKER_PROCESSES=args.processes, DRAIN_TIMEOUT=args.drain_timeout,
+        USER_RATE_PER_MIN=100000, USER_BURST=100000, MAX_QUEUED_JOBS=1000, WARMUP_IMPORTS='false',
+        MAX_CONCURRENT_JOBS=args.concurrency,
+    )
+    files = {}  # {chat_id: تعداد فایل‌های دریافتی}
+    sent = {}  # {chat_id: زمان ارسال}
+    replied = {}  # {chat_id: زمان اولین پاسخ}
+
+    def on_message(now, chat, method, fields):
+        if chat not in sent:
+            return
+        replied.setdefault(chat, now)
+        if method in FILE_METHODS:
+            files[chat] = files.get(chat, 0) + 1
+
+    mock.listeners.append(on_message)
+    users = iter(range(900_000, 1_000_000))
+
+    def send(slow: bool):
+        user_id = next(users)
+        query = f'?rate={args.rate}&n={user_id}' if slow else f'?n={user_id}'
+        size = args.size if slow else '1M'
+        mock.push_message(user_id, f'{origin_url}/file/{size}.bin{query}')
+        sent[user_id] = time.monotonic()
+
+    a, b = Instance('a', workdir, env), Instance('b', workdir, env)
+    health = []
+    async with aiohttp.ClientSession() as session:
+        try:
+            await a.start()
+            await a.wait_ready(session, args.timeout)
+            for index in range(args.jobs):
+                send(slow=index % 2 == 0)
+            # کارهای کند شروع شوند
+            await asyncio.sleep(args.warmup)
+
+            swap_started = time.monotonic()
+            a.process.send_signal(signal.SIGTERM)
+            ticker_stop = asyncio.Event()
+
+            async def ticker():
+                # پیام تازه در طول جایگزینی: زمان مرده از دید کاربران
+                while not ticker_stop.is_set():
+                    send(slow=False)
+                    await asyncio.sleep(args.tick)
+
+            async def watch_a():
+                while a.process.returncode is None:
+                    status, body = await get_json(session, a.base_url + '/health')
+                    if body:
+                        health.append(dict(body, t=round(time.monotonic() - swap_started, 2)))
+                    await asyncio.sleep(0.5)
+
+            tick_task = asyncio.create_task(ticker())
+            watch_task = asyncio.create_task(watch_a())
+            while (await get_json(session, a.base_url + '/ready'))[0] == 200:
+                await asyncio.sleep(0.1)
+            await b.start()
+            await b.wait_ready(session, args.timeout)
+            b_ready = time.monotonic() - swap_started
+            await asyncio.wait_for(a.process.wait(), timeout=args.drain_timeout + 60)
+            a_exit = time.monotonic() - swap_started
+            await asyncio.sleep(args.tick * 5)
+            ticker_stop.set()
+            await tick_task
+            await watch_task
+
+            deadline = time.monotonic() + args.timeout
+            while time.monotonic() < deadline and any(files.get(chat, 0) == 0 for chat in sent):
+                await asyncio.sleep(0.5)
+        finally:
+            for instance in (a, b):
+                if instance.process is not None:
+                    await instance.stop(timeout=args.drain_timeout + 30)
+            await mock_runner.cleanup()
+            await origin_runner.cleanup()
+
+    # بیشترین فاصله بین ارسال پیام و اولین پاسخ ربات در طول جایگزینی
+    first_reply = [replied[chat] - sent[chat] for chat in sent if chat in replied]
+    last_health = health[-1] if health else {}
+    results = {
+        'meta': dict(metadata(), args=vars(args)),
+        'sent': len(sent),
+        'delivered': sum(1 for chat in sent if files.get(chat)),
+        'lost': sum(1 for chat in sent if not files.get(chat)),
+        'duplicates': sum(1 for count in files.values() if count > 1),
+        'handed_over': max((entry.get('handed_over', 0) for entry in health), default=0),
+        'max_first_reply_s': max(first_reply, default=0.0),
+        'b_ready_s': b_ready,
+        'a_exit_s': a_exit,
+        'drain_health': health,
+    }
+    print(f"ارسال {results['sent']}  تحویل {results['delivered']}  از دست رفته {results['lost']}  "
+          f"تکراری {results['duplicates']}  سپرده شده {results['handed_over']}")
+    print(f"B آماده پس از {b_ready:.1f}s، خروج A پس از {a_exit:.1f}s، "
+          f"بیشترین انتظار اولین پاسخ {results['max_first_reply_s']:.2f}s")
+    if last_health:
+        print(f"آخرین وضعیت /health نمونه A: {json.dumps(last_health, ensure_ascii=False)}")
+    print(f"لاگ نمونه‌ها: {workdir}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rolling restart / graceful drain test')
+    parser.add_argument('--jobs', type=int, default=20, help='jobs sent before the swap (half slow)')
+    parser.add_argument('--size', default='20M', help='size of the slow jobs')
+    parser.add_argument('--rate', default='2M', help='origin rate for the slow jobs (bytes/s)')
+    parser.add_argument('--drain-timeout', type=float, default=10.0)
+    parser.add_argument('--processes', type=int, default=0, help='WORKER_PROCESSES of both instances')
+    parser.add_argument('--concurrency', type=int, default=5, help='MAX_CONCURRENT_JOBS per process')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds between the jobs and SIGTERM')
+    parser.add_argument('--tick', type=float, default=0.5, help='interval of new messages during the swap (s)')
+    parser.add_argument('--timeout', type=float, default=180)
+    parser.add_argument('--output', default=os.path.join('bench', 'results', 'rolling-' + time.strftime('%Y%m%d-%H%M%S') + '.json'))
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    results = asyncio.run(run(args))
+    save_results(results, output)
+    print(f"\nنتایج در {output} ذخیره شد")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+اجرای بنچمارک مسیرهای انتقال ربات در برابر سرور مبدأ محلی و Bot API جعلی
+
+    python -m bench.run                      # همه سناریوها
+    python -m bench.run --only download      # فقط سناریوهایی که نامشان شامل download است
+    python -m bench.run --output bench/results/new.json --compare bench/results/old.json
+    python -m bench.run --only flow --local-api --compare bench/results/old.json
+
+برای هر سناریو: توان عملیاتی، تاخیر p50/p95/p99، زمان CPU و RSS گزارش می‌شود.
+با --local-api سرور جعلی مثل `telegram-bot-api --local` رفتار می‌کند: فایل‌ها تا 2000MB با مسیر محلی
+ارسال می‌شوند و Pyrogram جعلی نصب نمی‌شود (هر تلاش برای MTProto خطا می‌شود).
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import time
+from types import SimpleNamespace
+
+from bench.common import (
+    MB, Measurement, compare_results, latency_summary, load_main, metadata, save_results,
+)
+from bench.origin import parse_size, start_origin
+from bench.mock_telegram import FakePyrogramClient, MockTelegram
+
+# (نام، مسیر روی مبدأ، تعداد تکرار)
+DOWNLOAD_SCENARIOS = [
+    ('download_1M', '/file/1M.bin', 20),
+    ('download_20M', '/file/20M.bin', 5),
+    ('download_20M_no_range', '/file/20M.bin?range=0', 5),
+    ('download_20M_throttled_8M', '/file/20M.bin?rate=8M', 3),
+    ('download_5M_flaky', '/file/5M.bin?fail=0.3', 10),
+]
+YTDLP_SCENARIOS = [
+    ('ytdlp_generic_page_10M', '/page/10M.html', 3),
+    ('ytdlp_hls_20x512K', '/hls/20x512K/index.m3u8', 3),
+]
+# (نام، مسیرها، تعداد کاربران همزمان)
+# مسیرهای /page روی 127.0.0.1 سایت ویدیویی شناخته نمی‌شوند، پس در جریان کامل از فایل مستقیم استفاده می‌شود
+FLOW_SCENARIOS = [
+    ('flow_direct_small', ['/file/2M.zip'], 20),
+    ('flow_mixed', ['/file/5M.bin', '/file/30M.mp4', '/file/4M.gif', '/file/60M.bin'], 12),
+]
+
+_user_ids = itertools.count(100_000)
+
+
+def _result(name: str, measurement: Measurement, latencies: list, nbytes: int, ops: int, errors: int, **extra) -> dict:
+    result = measurement.result()
+    result.update({
+        'ops': ops,
+        'errors': errors,
+        'bytes': nbytes,
+        'throughput_mb_s': nbytes / MB / result['wall_seconds'] if result['wall_seconds'] else 0.0,
+        'latency': latency_summary(latencies),
+    })
+    result.update(extra)
+    latency = result['latency']
+    print(
+        f"{name:32} {ops:4} ops {errors:3} err  {result['throughput_mb_s']:8.1f} MB/s  "
+        f"p50 {latency['p50']:.3f}s p95 {latency['p95']:.3f}s p99 {latency['p99']:.3f}s  "
+        f"cpu {result['cpu_seconds']:.2f}s  rss {result['peak_rss_mb']:.0f} MB"
+    )
+    return result
+
+
+def _remove(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+async def bench_download_file(main, origin_url: str, name: str, path: str, repeat: int) -> dict:
+    latencies, nbytes, errors = [], 0, 0
+    with Measurement() as measurement:
+        for index in range(repeat):
+            started = time.perf_counter()
+            filepath, content_type, _ = await main.download_file(f'{origin_url}{path}', f'bench_{name}_{index}')
+            if filepath:
+                latencies.append(time.perf_counter() - started)
+                nbytes += os.path.getsize(filepath)
+                _remove(filepath)
+            else:
+                errors += 1
+    return _result(name, measurement, latencies, nbytes, repeat, errors)
+
+
+async def bench_ytdlp(main, origin_url: str, name: str, path: str, repeat: int) -> dict:
+    latencies, nbytes, errors = [], 0, 0
+    with Measurement() as measurement:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            filepath, _, _ = await main.download_video_ytdlp(f'{origin_url}{path}')
+            if filepath:
+                latencies.append(time.perf_counter() - started)
+                nbytes += os.path.getsize(filepath)
+                _remove(filepath)
+            else:
+                errors += 1
+    return _result(name, measurement, latencies, nbytes, repeat, errors)
+
+
+async def bench_flow(main, mock: MockTelegram, bot, origin_url: str, name: str, paths: list, users: int) -> dict:
+    """مسیر کامل handle_message → صف → دانلود → آپلود با کاربران همزمان"""
+    from telegram import Update
+
+    pending = {}
+    latencies = []
+    done = asyncio.Event()
+    file_methods = ('sendDocument', 'sendVideo', 'sendAnimation', 'sendPhoto')
+
+    def on_delivery(now, chat_id, method, fields):
+        if method in file_methods and chat_id in pending:
+            latencies.append(now - pending.pop(chat_id))
+            if not pending:
+                done.set()
+
+    mock.listeners.append(on_delivery)
+    uploaded_before = sum(mock.upload_bytes.values())
+    try:
+        with Measurement() as measurement:
+            for index in range(users):
+                user_id = next(_user_ids)
+                path = paths[index % len(paths)]
+                message_id = index + 1
+                update = Update.de_json({
+                    'update_id': message_id,
+                    'message': {
+                        'message_id': message_id,
+                        'date': int(time.time()),
+                        'chat': {'id': user_id, 'type': 'private'},
+                        'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+                        'text': f'{origin_url}{path}',
+                    },
+                }, bot)
+                pending[user_id] = time.monotonic()
+                await main.handle_message(update, SimpleNamespace(bot=bot, args=[]))
+            try:
+                await asyncio.wait_for(done.wait(), timeout=300)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        mock.listeners.remove(on_delivery)
+    nbytes = sum(mock.upload_bytes.values()) - uploaded_before
+    return _result(name, measurement, latencies, nbytes, users, len(pending), flood_hits=mock.flood_hits)
+
+
+async def run(args) -> dict:
+    env = {'MAX_CONCURRENT_JOBS': args.workers} if args.workers else {}
+    if args.local_api:
+        env['BOT_API_LOCAL'] = 'true'
+    main = load_main(**env)
+    logging.getLogger().setLevel(logging.WARNING)
+    origin_runner, origin_url = await start_origin()
+    mock = MockTelegram(
+        latency=args.api_latency, upload_rate=parse_size(args.upload_rate) if args.upload_rate else 0,
+        local_mode=args.local_api,
+    )
+    mock_runner, api_url = await mock.start()
+
+    from telegram import Bot
+    bot = Bot(main.BOT_TOKEN, base_url=api_url, local_mode=args.local_api)
+    await bot.initialize()
+
+    # worker ها و Pyrogram جعلی مثل on_startup ربات (سرور محلی بدون Pyrogram)
+    main.job_journal.open()
+    main.upload_queue = asyncio.Queue(maxsize=main.UPLOAD_QUEUE_SIZE)
+    if not args.local_api:
+        main.pyrogram_client = FakePyrogramClient(mock)
+    workers = [asyncio.create_task(main.download_worker(i)) for i in range(main.MAX_CONCURRENT_JOBS)]
+    workers += [asyncio.create_task(main.upload_worker(i)) for i in range(main.UPLOAD_WORKERS)]
+
+    results = {'meta': metadata(), 'scenarios': {}}
+    results['meta']['args'] = vars(args)
+    try:
+        for name, path, repeat in DOWNLOAD_SCENARIOS:
+            if args.only in name:
+                results['scenarios'][name] = await bench_download_file(main, origin_url, name, path, repeat)
+        for name, path, repeat in YTDLP_SCENARIOS:
+            if args.only in name:
+                results['scenarios'][name] = await bench_ytdlp(main, origin_url, name, path, repeat)
+        for name, paths, users in FLOW_SCENARIOS:
+            if args.only in name:
+                results['scenarios'][name] = await bench_flow(main, mock, bot, origin_url, name, paths, users)
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await bot.shutdown()
+        await mock_runner.cleanup()
+        await origin_runner.cleanup()
+    results['telegram'] = mock.summary()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transfer path benchmarks')
+    parser.add_argument('--only', default='', help='run only scenarios whose name contains this text')
+    parser.add_argument('--output', default=os.path.join('bench', 'results', time.strftime('%Y%m%d-%H%M%S') + '.json'))
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    parser.add_argument('--workers', type=int, default=0, help='override MAX_CONCURRENT_JOBS')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='added latency per Bot API call (seconds)')
+    parser.add_argument('--upload-rate', default='', help='upload sink speed, e.g. 20M (bytes/s)')
+    parser.add_argument('--local-api', action='store_true', help='mock a local telegram-bot-api server (file paths, 2GB)')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    compare = os.path.abspath(args.compare) if args.compare else None
+
+    results = asyncio.run(run(args))
+    save_results(results, output)
+    print(f"\nنتایج در {output} ذخیره شد")
+    if compare:
+        compare_results(results, compare)
+
+
+if __name__ == '__main__':
+    main()
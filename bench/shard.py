@@ -0,0 +1,157 @@
+"""
+بنچمارک مقیاس‌پذیری حالت چند پروسه‌ای (WORKER_PROCESSES) روی یک میزبان
+
+    python -m bench.shard --processes 0,1,2,4 --jobs 60
+    python -m bench.shard --processes 0,4 --mix direct:50,video:50 --output bench/results/shard-new.json
+
+برای هر مقدار WORKER_PROCESSES یک `python main.py` تازه در برابر Bot API جعلی و سرور مبدا
+محلی اجرا می‌شود و همه کارها یکجا از طرف کاربران متفاوت فرستاده می‌شوند (صفر = تک پروسه‌ای).
+گزارش: کار در ثانیه، speedup نسبت به تک پروسه‌ای و بهره‌وری نسبت به تعداد هسته‌ها.
+مسیر yt-dlp (صفحه‌های ویدیو) بیشترین CPU را روی event loop و GIL مصرف می‌کند و بیشترین سود را می‌برد.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from bench.common import ROOT, compare_results, latency_summary, metadata, save_results
+from bench.loadtest import FILE_METHODS, VIDEO_SITE_MARKER, choose, parse_weights
+from bench.mock_telegram import MockTelegram
+from bench.origin import start_origin
+from bench.startup import child_env
+
+
+async def wait_for_polling(mock: MockTelegram, chat_id: int, timeout: float):
+    """انتظار تا ربات آپدیت‌ها را دریافت کند (پاسخ /start)"""
+    replied = asyncio.get_running_loop().create_future()
+
+    def on_message(now, chat, method, fields):
+        if chat == chat_id and not replied.done():
+            replied.set_result(now)
+
+    mock.listeners.append(on_message)
+    mock.push_message(chat_id, '/start')
+    try:
+        await asyncio.wait_for(replied, timeout=timeout)
+    finally:
+        mock.listeners.remove(on_message)
+
+
+async def run_level(mock: MockTelegram, api_url: str, origin_url: str, processes: int, args, first_user: int) -> dict:
+    env = child_env(
+        BOT_API_URL=api_url, WORKER_PROCESSES=processes, SHARD_BY=args.shard_by,
+        USER_RATE_PER_MIN=100000, USER_BURST=100000, MAX_QUEUED_JOBS=args.jobs * 2,
+        MAX_CONCURRENT_JOBS=args.concurrency, WARMUP_IMPORTS='false',
+    )
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, 'main.py'), cwd=tempfile.mkdtemp(prefix='bot-shard-'), env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    users = list(range(first_user, first_user + args.jobs))
+    pending = set(users)
+    finished = {}
+    done = asyncio.Event()
+
+    def on_message(now, chat, method, fields):
+        if chat in pending and (method in FILE_METHODS or fields.get('text', '').startswith('❌')):
+            pending.discard(chat)
+            finished[chat] = (now, method in FILE_METHODS)
+            if not pending:
+                done.set()
+
+    try:
+        await wait_for_polling(mock, first_user - 1, args.timeout)
+        # فرصت برای بالا آمدن پروسه‌های worker
+        await asyncio.sleep(args.settle)
+        mix = parse_weights(args.mix)
+        mock.listeners.append(on_message)
+        started = time.monotonic()
+        for index, user_id in enumerate(users):
+            if choose(mix) == 'video':
+                url = f'{origin_url}/page/{args.size}.html?{VIDEO_SITE_MARKER}&n={processes}-{index}'
+            else:
+                url = f'{origin_url}/file/{args.size}.bin?n={processes}-{index}'
+            mock.push_message(user_id, url)
+        try:
+            await asyncio.wait_for(done.wait(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        wall = time.monotonic() - started
+        mock.listeners.remove(on_message)
+    finally:
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=45)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+    delivered = [now - started for now, ok in finished.values() if ok]
+    result = {
+        'processes': processes,
+        'jobs': args.jobs,
+        'delivered': len(delivered),
+        'failed': len(finished) - len(delivered),
+        'timeouts': len(pending),
+        'wall_seconds': wall,
+        'jobs_per_s': len(delivered) / wall if wall else 0.0,
+        'completion': latency_summary(delivered),
+    }
+    print(f"WORKER_PROCESSES={processes:<2}  {result['jobs_per_s']:6.2f} jobs/s  "
+          f"تحویل {len(delivered)}/{args.jobs}  خطا {result['failed']}  timeout {len(pending)}  "
+          f"p50 {result['completion']['p50']:.2f}s")
+    return result
+
+
+async def run(args) -> dict:
+    levels = [int(value) for value in args.processes.split(',')]
+    origin_runner, origin_url = await start_origin()
+    mock = MockTelegram()
+    mock_runner, api_url = await mock.start()
+    scenarios = {}
+    try:
+        for number, processes in enumerate(levels):
+            result = await run_level(mock, api_url, origin_url, processes, args, 800_000 + number * 10_000)
+            scenarios[f'processes_{processes}'] = result
+    finally:
+        await mock_runner.cleanup()
+        await origin_runner.cleanup()
+
+    cores = os.cpu_count() or 1
+    baseline = scenarios.get('processes_0') or next(iter(scenarios.values()))
+    for result in scenarios.values():
+        speedup = result['jobs_per_s'] / baseline['jobs_per_s'] if baseline['jobs_per_s'] else 0.0
+        result['speedup'] = speedup
+        result['efficiency'] = speedup / min(max(result['processes'], 1), cores)
+    print(f"\nهسته‌ها: {cores}")
+    for name, result in scenarios.items():
+        print(f"{name:14} speedup {result['speedup']:.2f}x  بهره‌وری {result['efficiency'] * 100:.0f}%")
+    return {'meta': dict(metadata(), args=vars(args), cpu_count=cores), 'scenarios': scenarios}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-process worker scaling benchmark')
+    parser.add_argument('--processes', default='0,1,2,4', help='WORKER_PROCESSES values (0 = single process)')
+    parser.add_argument('--jobs', type=int, default=60, help='jobs per level, each from a distinct user')
+    parser.add_argument('--mix', default='video:70,direct:30', help='link kinds: video (yt-dlp page) / direct')
+    parser.add_argument('--size', default='4M', help='media size served by the local origin')
+    parser.add_argument('--shard-by', default='user', choices=('user', 'media'))
+    parser.add_argument('--concurrency', type=int, default=5, help='MAX_CONCURRENT_JOBS per process')
+    parser.add_argument('--settle', type=float, default=5.0, help='wait after the first reply for workers (s)')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--output', default=os.path.join('bench', 'results', 'shard-' + time.strftime('%Y%m%d-%H%M%S') + '.json'))
+    parser.add_argument('--compare', help='previous shard results JSON to compare against')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    results = asyncio.run(run(args))
+    save_results(results, output)
+    print(f"\nنتایج در {output} ذخیره شد")
+    if args.compare:
+        compare_results(results, os.path.abspath(args.compare), keys=('jobs_per_s',))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""
+تست طولانی (soak) برای پیدا کردن نشت منابع
+
+    python -m bench.soak --jobs 20000 --concurrency 20
+    python -m bench.soak --jobs 2000 --sample-interval 2 --output bench/results/soak.json
+
+هزاران کار ترکیبی (موفق، کند با timeout، قطع‌شده، 404، لغو شده در میانه دانلود و yt-dlp)
+از مسیر handle_message در برابر سرور مبدأ محلی و Bot API جعلی اجرا می‌شود. در طول اجرا
+تعداد file descriptor ها، socket ها، thread ها، RSS، فایل‌های پوشه دانلود و اندازه
+active_users نمونه‌برداری می‌شود و اگر هر کدام پس از گرم شدن مدام رشد کند، تست شکست می‌خورد.
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from bench.common import MB, current_rss, load_main, metadata, save_results
+from bench.mock_telegram import FakePyrogramClient, MockTelegram
+from bench.origin import start_origin
+
+FILE_METHODS = ('sendDocument', 'sendVideo', 'sendAnimation', 'sendPhoto')
+# (نوع، وزن)
+JOB_MIX = [('ok', 70), ('slow', 8), ('flaky', 8), ('missing', 4), ('cancel', 6), ('video', 4)]
+# حداکثر رشد مجاز پس از گرم شدن: (نسبی، مطلق)
+TOLERANCE = {
+    'fds': (0.2, 20),
+    'sockets': (0.2, 20),
+    'threads': (0.2, 8),
+    'rss_mb': (0.25, 64),
+    'download_files': (0.5, 10),
+    'active_users': (0.1, 5),
+}
+
+
+def sample_resources(main) -> dict:
+    gc.collect()
+    fds = sockets = 0
+    for fd in os.listdir('/proc/self/fd'):
+        fds += 1
+        try:
+            if os.readlink(f'/proc/self/fd/{fd}').startswith('socket:'):
+                sockets += 1
+        except OSError:
+            pass
+    try:
+        # user_links.txt فایل ماندگار ربات است و در همین پوشه نگه داشته می‌شود
+        download_files = len([name for name in os.listdir(main.DOWNLOAD_FOLDER) if name != 'user_links.txt'])
+    except OSError:
+        download_files = 0
+    return {
+        'fds': fds,
+        'sockets': sockets,
+        'threads': threading.active_count(),
+        'rss_mb': current_rss() / MB,
+        'download_files': download_files,
+        'active_users': len(main.active_users),
+    }
+
+
+def _median(values: list) -> float:
+    values = sorted(values)
+    return values[len(values) // 2] if values else 0.0
+
+
+def detect_growth(samples: list, warmup: float = 0.2) -> dict:
+    """مقایسه میانه یک‌سوم اول و آخر نمونه‌های پس از گرم شدن؛ {metric: (first, last)} برای رشدهای غیرمجاز"""
+    steady = samples[int(len(samples) * warmup):]
+    if len(steady) < 6:
+        return {}
+    third = len(steady) // 3
+    failures = {}
+    for metric, (relative, absolute) in TOLERANCE.items():
+        first = _median([s[metric] for s in steady[:third]])
+        last = _median([s[metric] for s in steady[-third:]])
+        if last > first * (1 + relative) and last - first > absolute:
+            failures[metric] = (first, last)
+    return failures
+
+
+class SoakRunner:
+    def __init__(self, main, mock: MockTelegram, bot, origin_url: str, outcome_timeout: float):
+        self.main = main
+        self.mock = mock
+        self.bot = bot
+        self.origin_url = origin_url
+        self.outcome_timeout = outcome_timeout
+        self.outcomes = {}
+        self.done = 0
+        self._user_ids = itertools.count(1_000_000)
+        self._message_ids = itertools.count(1)
+        self.waiting = {}
+        self.last_text = {}  # آخرین وضعیت هر کاربر منتظر
+        self.stuck = []  # [(url, آخرین وضعیت)] برای کارهایی که نتیجه نهایی ندادند
+        mock.listeners.append(self._on_message)
+
+    def _on_message(self, now, chat_id, method, fields):
+        future = self.waiting.get(chat_id)
+        if future is None or future.done():
+            return
+        text = fields.get('text', '')
+        self.last_text[chat_id] = text
+        if method in FILE_METHODS:
+            future.set_result('ok')
+        elif text.startswith(('❌', '⚠️ سرور', '⚠️ تعداد')):
+            future.set_result('error')
+
+    def _count(self, outcome: str):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        self.done += 1
+
+    def _url(self, kind: str) -> str:
+        size = random.choice(('64K', '256K', '1M', '2M'))
+        number = next(self._message_ids)
+        if kind == 'slow':
+            # کندتر از DOWNLOAD_TIMEOUT → مسیر timeout و لغو thread دانلود
+            return f'{self.origin_url}/file/4M.bin?rate=64K&n={number}'
+        if kind == 'flaky':
+            return f'{self.origin_url}/file/{size}.bin?fail=1&n={number}'
+        if kind == 'missing':
+            return f'{self.origin_url}/missing/{number}'
+        if kind == 'video':
+            return f'{self.origin_url}/page/{size}.html?ref=vimeo.com&n={number}'
+        return f'{self.origin_url}/file/{size}.{random.choice(("bin", "mp4", "zip"))}?n={number}'
+
+    async def _cancelled_download(self):
+        """دانلودی که در میانه لغو می‌شود (مثل خاموش شدن یا لغو کار)"""
+        url = f'{self.origin_url}/file/8M.bin?rate=1M&n={next(self._message_ids)}'
+        try:
+            await asyncio.wait_for(
+                self.main.download_file(url, f'soak_cancel_{next(self._message_ids)}'),
+                timeout=random.uniform(0.05, 1.0),
+            )
+            self._count('cancel_finished')
+        except asyncio.TimeoutError:
+            self._count('cancelled')
+
+    async def _job(self, kind: str):
+        from telegram import Update
+
+        if kind == 'cancel':
+            await self._cancelled_download()
+            return
+        user_id = next(self._user_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[user_id] = future
+        message_id = next(self._message_ids)
+        update = Update.de_json({
+            'update_id': message_id,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'soak{user_id}'},
+                'text': self._url(kind),
+            },
+        }, self.bot)
+        url = update.message.text
+        error = ''
+        try:
+            await self.main.handle_message(update, SimpleNamespace(bot=self.bot, args=[]))
+            outcome = await asyncio.wait_for(future, timeout=self.outcome_timeout)
+        except asyncio.TimeoutError:
+            outcome = 'no_outcome'
+        except Exception as e:
+            outcome, error = 'handler_error', f'{type(e).__name__}: {e}'
+        finally:
+            self.waiting.pop(user_id, None)
+            last_text = self.last_text.pop(user_id, '')
+        if outcome in ('no_outcome', 'handler_error') and len(self.stuck) < 50:
+            self.stuck.append((url, error or last_text))
+        self._count(f'{kind}_{outcome}')
+
+    async def run(self, jobs: int, concurrency: int):
+        kinds, weights = zip(*JOB_MIX)
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = set()
+        for _ in range(jobs):
+            await semaphore.acquire()
+            task = asyncio.create_task(self._job(random.choices(kinds, weights)[0]))
+            task.add_done_callback(lambda _: semaphore.release())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def sampler(main, runner: SoakRunner, samples: list, interval: float, stop: asyncio.Event):
+    started = time.monotonic()
+    while not stop.is_set():
+        sample = await asyncio.get_running_loop().run_in_executor(None, sample_resources, main)
+        sample.update(t=round(time.monotonic() - started, 1), jobs=runner.done)
+        samples.append(sample)
+        print(
+            f"t={sample['t']:7.1f}s jobs={sample['jobs']:6}  fds={sample['fds']:4} sockets={sample['sockets']:4} "
+            f"threads={sample['threads']:3} rss={sample['rss_mb']:6.1f}MB files={sample['download_files']:3} "
+            f"users={sample['active_users']}"
+        )
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run(args) -> dict:
+    origin_runner, origin_url = await start_origin()
+    mock = MockTelegram()
+    mock_runner, api_url = await mock.start()
+    main = load_main(
+        DOWNLOAD_TIMEOUT=args.download_timeout,
+        MAX_TRACKED_USERS=args.max_tracked_users,
+        MAX_QUEUED_JOBS=max(50, args.concurrency * 2),
+    )
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+    # همان pool اتصال build_application؛ pool پیش‌فرض Bot (یک اتصال) زیر بار ویرایش‌های وضعیت را گم می‌کند
+    bot = Bot(main.BOT_TOKEN, base_url=api_url, request=HTTPXRequest(
+        connection_pool_size=main.TELEGRAM_POOL_SIZE, read_timeout=300.0, write_timeout=300.0, pool_timeout=30.0))
+    await bot.initialize()
+    main.upload_queue = asyncio.Queue(maxsize=main.UPLOAD_QUEUE_SIZE)
+    main.pyrogram_client = FakePyrogramClient(mock)
+    workers = [asyncio.create_task(main.download_worker(i)) for i in range(main.MAX_CONCURRENT_JOBS)]
+    workers += [asyncio.create_task(main.upload_worker(i)) for i in range(main.UPLOAD_WORKERS)]
+    workers.append(asyncio.create_task(main.queue_feedback_loop()))
+
+    runner = SoakRunner(main, mock, bot, origin_url, outcome_timeout=args.outcome_timeout)
+    samples = []
+    stop = asyncio.Event()
+    sampling = asyncio.create_task(sampler(main, runner, samples, args.sample_interval, stop))
+    started = time.monotonic()
+    try:
+        await runner.run(args.jobs, args.concurrency)
+        # تخلیه کامل صف‌ها و فرصت برای پایان thread های لغو شده
+        while main.admission.queued_count or main.admission.active_count or main.upload_queue.qsize() \
+                or main.upload_stage.busy:
+            await asyncio.sleep(1)
+        await asyncio.sleep(args.download_timeout + 2)
+    finally:
+        stop.set()
+        await sampling
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await bot.shutdown()
+        await mock_runner.cleanup()
+        await origin_runner.cleanup()
+
+    failures = detect_growth(samples)
+    # بعد از تخلیه کامل نباید فایلی در پوشه دانلود باقی بماند
+    orphans = sample_resources(main)['download_files']
+    return {
+        'meta': dict(metadata(), args=vars(args)),
+        'seconds': time.monotonic() - started,
+        'outcomes': runner.outcomes,
+        'stuck': runner.stuck,
+        'samples': samples,
+        'growth': {metric: {'first': first, 'last': last} for metric, (first, last) in failures.items()},
+        'orphan_files': orphans,
+        'passed': not failures and orphans == 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak test for resource leaks')
+    parser.add_argument('--jobs', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--sample-interval', type=float, default=10)
+    parser.add_argument('--download-timeout', type=int, default=3, help='DOWNLOAD_TIMEOUT for the bot (s)')
+    parser.add_argument('--outcome-timeout', type=float, default=300, help='max wait for a job result (s)')
+    parser.add_argument('--max-tracked-users', type=int, default=500)
+    parser.add_argument('--output', default=os.path.join('bench', 'results', 'soak-' + time.strftime('%Y%m%d-%H%M%S') + '.json'))
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    results = asyncio.run(run(args))
+    save_results(results, output)
+    print(f"\nنتایج: {results['outcomes']}")
+    for metric, values in results['growth'].items():
+        print(f"❌ رشد مداوم {metric}: {values['first']:.1f} → {values['last']:.1f}")
+    if results['orphan_files']:
+        print(f"❌ {results['orphan_files']} فایل یتیم در پوشه دانلود باقی ماند")
+    print(("✅ بدون نشت منابع" if results['passed'] else "❌ نشت منابع شناسایی شد") + f" - نتایج در {output}")
+    raise SystemExit(0 if results['passed'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+بنچمارک زمان راه‌اندازی ربات
+
+    python -m bench.startup --runs 5
+    python -m bench.startup --output bench/results/startup-new.json --compare bench/results/startup-old.json
+
+هر اندازه‌گیری در یک پروسه تازه انجام می‌شود (مثل deploy یا cold start):
+- import: زمان import کردن main و ماژول‌های سنگینی که همان موقع بارگذاری شده‌اند
+- first_reply: از اجرای `python main.py` تا رسیدن پاسخ /start به Bot API جعلی
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.common import BENCH_ENV, ROOT, compare_results, latency_summary, metadata, save_results
+from bench.mock_telegram import MockTelegram
+
+HEAVY_MODULES = ('yt_dlp', 'pyrogram', 'requests', 'urllib3', 'flask')
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+sys.path.insert(0, {ROOT!r})
+started = time.perf_counter()
+import main
+seconds = time.perf_counter() - started
+print(json.dumps({{'seconds': seconds, 'modules': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def child_env(**extra) -> dict:
+    env = dict(os.environ)
+    env.update(BENCH_ENV)
+    env.update({key: str(value) for key, value in extra.items()})
+    return env
+
+
+def measure_import() -> dict:
+    workdir = tempfile.mkdtemp(prefix='bot-startup-')
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT], cwd=workdir, env=child_env(),
+        capture_output=True, text=True, timeout=120, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+async def measure_first_reply(mock: MockTelegram, api_url: str, chat_id: int, timeout: float) -> float:
+    """اجرای main.py و انتظار برای اولین پاسخ به /start"""
+    replied = asyncio.get_running_loop().create_future()
+
+    def on_message(now, chat, method, fields):
+        if chat == chat_id and method == 'sendMessage' and not replied.done():
+            replied.set_result(now)
+
+    mock.listeners.append(on_message)
+    mock.push_message(chat_id, '/start')
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, 'main.py'),
+        cwd=tempfile.mkdtemp(prefix='bot-startup-'),
+        env=child_env(BOT_API_URL=api_url),
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        return await asyncio.wait_for(replied, timeout=timeout) - started
+    finally:
+        mock.listeners.remove(on_message)
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=15)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+
+async def run(args) -> dict:
+    imports, modules = [], set()
+    for _ in range(args.runs):
+        result = measure_import()
+        imports.append(result['seconds'])
+        modules.update(result['modules'])
+
+    mock = MockTelegram()
+    mock_runner, api_url = await mock.start()
+    replies = []
+    try:
+        for index in range(args.runs):
+            replies.append(await measure_first_reply(mock, api_url, 700_000 + index, args.timeout))
+    finally:
+        await mock_runner.cleanup()
+
+    results = {
+        'meta': dict(metadata(), args=vars(args)),
+        'scenarios': {
+            'import': {'latency': latency_summary(imports), 'heavy_modules': sorted(modules)},
+            'first_reply': {'latency': latency_summary(replies)},
+        },
+    }
+    for name, scenario in results['scenarios'].items():
+        latency = scenario['latency']
+        print(f"{name:12} p50 {latency['p50']:.3f}s  max {latency['max']:.3f}s")
+    print(f"ماژول‌های سنگین بارگذاری شده هنگام import: {', '.join(sorted(modules)) or 'هیچ'}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time and time-to-first-reply benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60, help='max wait for the first reply (s)')
+    parser.add_argument('--output', default=os.path.join('bench', 'results', 'startup-' + time.strftime('%Y%m%d-%H%M%S') + '.json'))
+    parser.add_argument('--compare', help='previous startup results JSON to compare against')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    results = asyncio.run(run(args))
+    save_results(results, output)
+    print(f"\nنتایج در {output} ذخیره شد")
+    if args.compare:
+        compare_results(results, os.path.abspath(args.compare), keys=('p50', 'max'))
+
+
+if __name__ == '__main__':
+    main()
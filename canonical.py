@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from lazyimport import LazyModule
+
+logger = logging.getLogger(__name__)
+
+extractors = LazyModule('yt_dlp.extractor')
+
+# پارامترهایی که فقط برای ردیابی/اشتراک‌گذاری هستند و محتوای لینک را تغییر نمی‌دهند
+TRACKING_PARAMS = frozenset({
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'twclid', 'ttclid', 'igshid', 'igsh',
+    'ref', 'ref_src', 'ref_url', 'share_id', 'is_from_webapp', 'sender_device', 'web_id',
+    'rdt', 'mibextid', '_ga', '_gl', 'mc_cid', 'mc_eid', 'spm', 'share_source', 'share_medium',
+})
+TRACKING_PREFIXES = ('utm_', 'pk_', 'hsa_', 'mtm_')
+# پارامترهای ردیابی که فقط روی هاست‌های خاص بی‌معنی‌اند (روی سایت‌های دیگر ممکن است مهم باشند)
+HOST_TRACKING_PARAMS = {
+    'youtube.com': frozenset({'si', 'feature', 'pp', 'ab_channel', 'embeds_referring_euri',
+                              'embeds_referring_origin', 'source_ve_path'}),
+    'youtu.be': frozenset({'si', 'feature'}),
+    'x.com': frozenset({'s', 't', 'src', 'cn'}),
+    'reddit.com': frozenset({'share_id', 'utm_name'}),
+    'tiktok.com': frozenset({'is_copy_url', 'lang', '_r', '_t', 'checksum', 'u_code', 'preview_pb'}),
+    'instagram.com': frozenset({'img_index', 'hl'}),
+}
+# پیشوندهای هاست که همان سایت را نشان می‌دهند
+HOST_PREFIXES = ('www.', 'm.', 'mobile.', 'mbasic.', 'web.')
+HOST_ALIASES = {
+    'twitter.com': 'x.com',
+    'fxtwitter.com': 'x.com',
+    'vxtwitter.com': 'x.com',
+    'fixupx.com': 'x.com',
+    'youtube-nocookie.com': 'youtube.com',
+    'old.reddit.com': 'reddit.com',
+    'new.reddit.com': 'reddit.com',
+}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_host(host: str) -> str:
+    host = host.lower().rstrip('.')
+    if host in HOST_ALIASES:
+        return HOST_ALIASES[host]
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix) and host.count('.') > 1:
+            host = host[len(prefix):]
+            break
+    return HOST_ALIASES.get(host, host)
+
+
+def is_tracking_param(name: str, host: str) -> bool:
+    lowered = name.lower()
+    return (
+        lowered in TRACKING_PARAMS
+        or lowered.startswith(TRACKING_PREFIXES)
+        or lowered in HOST_TRACKING_PARAMS.get(host, ())
+    )
+
+
+def normalize_url(url: str) -> str:
+    """
+    شکل یکتای لینک بدون هیچ درخواست شبکه
+
+    scheme همیشه https، هاست با حروف کوچک و بدون www./m. و نام‌های مستعار (twitter.com → x.com)،
+    بدون پورت پیش‌فرض، fragment و پارامترهای ردیابی؛ پارامترهای باقی‌مانده مرتب می‌شوند.
+    youtu.be/<id> و /shorts/<id> به youtube.com/watch?v=<id> تبدیل می‌شوند.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in ('http', 'https'):
+        return url.strip()
+    host = normalize_host(parts.hostname or '')
+    path = parts.path or '/'
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not is_tracking_param(k, host)]
+
+    if host == 'youtu.be' and len(path) > 1:
+        query.append(('v', path[1:].split('/')[0]))
+        host, path = 'youtube.com', '/watch'
+    elif host == 'youtube.com' and path.startswith(('/shorts/', '/live/', '/embed/', '/v/')):
+        video_id = path.split('/')[2]
+        if video_id:
+            query.append(('v', video_id))
+            path = '/watch'
+    if len(path) > 1:
+        path = path.rstrip('/')
+
+    netloc = host
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{host}:{parts.port}'
+    return urlunsplit(('https', netloc, path, urlencode(sorted(query)), ''))
+
+
+class Canonical(NamedTuple):
+    """هویت یک لینک: شکل یکتای URL و در صورت امکان (extractor_key, id) از yt-dlp"""
+    url: str
+    extractor: str = None
+    media_id: str = None
+
+    @property
+    def key(self) -> str:
+        """کلید یکتای محتوا برای لاگ، cache و تشخیص درخواست تکراری"""
+        if self.media_id:
+            return f'{self.extractor}:{self.media_id}'
+        return self.url
+
+    @property
+    def identity(self):
+        """(extractor_key, id) یا None"""
+        return (self.extractor, self.media_id) if self.media_id else None
+
+
+class MediaResolver:
+    """
+    تبدیل URL به (extractor_key, id) با تطبیق آفلاین _VALID_URL استخراج‌کننده‌های yt-dlp
+
+    پیمایش همه ~1800 استخراج‌کننده (بدون Generic) چند میلی‌ثانیه طول می‌کشد و اولین بار به خاطر
+    compile شدن regex ها چند صد میلی‌ثانیه؛ پس:
+    - برای هر هاست استخراج‌کننده‌هایی که قبلاً روی آن تطبیق خورده‌اند اول امتحان می‌شوند
+    - نتیجه هر URL در یک LRU نگه داشته می‌شود
+    - هاستی که چند پیمایش کامل پشت سر هم هیچ استخراج‌کننده‌ای نداشته (لینک مستقیم فایل) دیگر
+      پیمایش نمی‌شود
+    - پیمایش کامل فقط پس از warm() (در پس‌زمینه) انجام می‌شود؛ قبل از آن URL های هاست‌های
+      ناشناخته بدون هویت (فقط شکل یکتای URL) برمی‌گردند
+    - resolve(scan=False) به جای پیمایش کامل SCAN_NEEDED برمی‌گرداند تا canonicalize_async آن را
+      در thread انجام دهد و event loop مسدود نشود
+    """
+
+    MAX_UNMATCHED_SCANS = 3
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.ready = False
+        self._classes = None
+        self._order = {}
+        self._by_host = {}  # {host: [IE class]} به ترتیب اولویت yt-dlp
+        self._memo = OrderedDict()  # {normalized url: (extractor_key, id) یا None}
+        self._unmatched = {}  # {host: تعداد پیمایش کامل بی‌نتیجه} برای هاست‌های بدون استخراج‌کننده
+        self._lock = threading.Lock()
+        self.scans = 0
+
+    def _load(self):
+        if self._classes is None:
+            classes = [ie for ie in extractors.gen_extractor_classes() if ie.ie_key() != 'Generic']
+            self._order = {ie: index for index, ie in enumerate(classes)}
+            self._classes = classes
+        return self._classes
+
+    def warm(self):
+        """بارگذاری استخراج‌کننده‌ها و compile کردن regex ها (برای اجرا در executor)"""
+        for ie in self._load():
+            ie.suitable('https://warm.invalid/')
+        self.ready = True
+
+    def resolve(self, url: str, host: str, scan: bool = True):
+        """(extractor_key, id) برای url شکل یکتا شده، یا None (یا SCAN_NEEDED اگر scan=False و پیمایش کامل لازم باشد)"""
+        with self._lock:
+            if url in self._memo:
+                self._memo.move_to_end(url)
+                return self._memo[url]
+        result = found = None
+        for ie in self._by_host.get(host, ()):
+            if ie.suitable(url):
+                found = ie
+                break
+        if found is None and self.ready and self._unmatched.get(host, 0) < self.MAX_UNMATCHED_SCANS:
+            if not scan:
+                return SCAN_NEEDED
+            self.scans += 1
+            found = next((ie for ie in self._classes if ie.suitable(url)), None)
+            if found is None and host not in self._by_host:
+                with self._lock:
+                    if len(self._unmatched) >= self.max_entries:
+                        self._unmatched.clear()
+                    self._unmatched[host] = self._unmatched.get(host, 0) + 1
+            if found is not None:
+                with self._lock:
+                    candidates = self._by_host.get(host, [])
+                    if found not in candidates:
+                        # لیست جدید به جای تغییر درجا؛ thread های دیگر ممکن است در حال پیمایش آن باشند
+                        self._by_host[host] = sorted(candidates + [found], key=self._order.get)
+        elif found is None and not self.ready:
+            # هنوز warm نشده: این نتیجه نباید در memo بماند
+            return None
+        if found is not None:
+            media_id = found.get_temp_id(url)
+            if media_id:
+                result = (found.ie_key(), str(media_id))
+        with self._lock:
+            self._memo[url] = result
+            if len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return result
+
+
+resolver = MediaResolver()
+SCAN_NEEDED = object()
+
+
+def canonicalize(url: str, resolve: bool = True, scan: bool = True):
+    """
+    هویت یکتای یک لینک (بدون درخواست شبکه)
+
+    resolve: تطبیق با استخراج‌کننده‌های yt-dlp برای گرفتن (extractor_key, id)؛ فقط برای سایت‌های ویدیویی
+    scan: اگر False باشد و پیمایش کامل استخراج‌کننده‌ها لازم شود به جای Canonical مقدار SCAN_NEEDED برمی‌گردد
+    """
+    normalized = normalize_url(url)
+    if not resolve or not normalized.startswith('https://'):
+        return Canonical(normalized)
+    host = urlsplit(normalized).hostname or ''
+    try:
+        identity = resolver.resolve(normalized, host, scan)
+        # regex بعضی استخراج‌کننده‌ها www. یا پارامتری را که حذف کردیم لازم دارد
+        if identity is None and url.strip() != normalized:
+            identity = resolver.resolve(url.strip(), host, scan)
+        if identity is SCAN_NEEDED:
+            return SCAN_NEEDED
+    except Exception as e:
+        logger.debug(f"خطا در تشخیص هویت {url[:80]}: {e}")
+        identity = None
+    if identity is None:
+        return Canonical(normalized)
+    return Canonical(normalized, *identity)
+
+
+async def canonicalize_async(url: str, resolve: bool = True) -> Canonical:
+    """canonicalize برای coroutine ها: مسیر سریع (memo و استخراج‌کننده‌های شناخته هاست) همین‌جا،
+    پیمایش کامل استخراج‌کننده‌ها برای هاست ناشناخته در thread"""
+    canonical = canonicalize(url, resolve, scan=False)
+    if canonical is SCAN_NEEDED:
+        canonical = await asyncio.to_thread(canonicalize, url, resolve)
+    return canonical
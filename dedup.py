@@ -0,0 +1,217 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# نوع پیام تلگرام که file_id با آن ارسال شده؛ همان متد برای ارسال دوباره لازم است
+MEDIA_KINDS = ('animation', 'video', 'document')
+
+
+def new_hasher():
+    """hash جریانی محتوا؛ BLAKE2b کتابخانه استاندارد (چند صد MB/s، بسیار سریع‌تر از شبکه)"""
+    return hashlib.blake2b(digest_size=20)
+
+
+def hash_file(path: str) -> str:
+    """hash فایلی که دانلودش خارج از حلقه نوشتن ما انجام شده (yt-dlp)"""
+    hasher = new_hasher()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class TailHasher:
+    """
+    hash فایلی که yt-dlp در حال نوشتن آن است، همزمان با دانلود (از progress hook در thread دانلود)
+
+    بایت‌های تازه هر بار از انتهای فایل (معمولاً page cache) خوانده می‌شوند تا پس از دانلود خواندن
+    دوباره کل فایل لازم نباشد. اگر بیش از یک فایل دانلود شود (merge صدا و تصویر)، فایل از اول
+    نوشته شود یا post-processor خروجی را بازنویسی کند، digest مقدار None می‌دهد و hash_file لازم است.
+    """
+
+    def __init__(self):
+        self._hasher = new_hasher()
+        self._path = None
+        self._file = None
+        self.offset = 0
+        self.valid = True
+
+    def _invalidate(self):
+        self.valid = False
+        self.close()
+
+    def _read(self):
+        try:
+            if os.fstat(self._file.fileno()).st_size < self.offset:
+                # دانلود از اول شروع شده (سرور Range را نپذیرفت)
+                self._invalidate()
+                return
+            for chunk in iter(lambda: self._file.read(HASH_CHUNK_SIZE), b''):
+                self._hasher.update(chunk)
+                self.offset += len(chunk)
+        except OSError as e:
+            logger.debug(f"خطا در hash همزمان {self._path}: {e}")
+            self._invalidate()
+
+    def update(self, path: str):
+        """خواندن بایت‌های تازه path (وضعیت downloading)"""
+        if not self.valid or not path:
+            return
+        if self._path is None:
+            try:
+                self._file = open(path, 'rb')
+            except OSError:
+                # فایل .part هنوز ساخته نشده
+                return
+            self._path = path
+        elif path != self._path:
+            self._invalidate()
+            return
+        self._read()
+
+    def finish(self):
+        """خواندن باقی فایل پس از پایان دانلود (فایل باز پس از تغییر نام .part همان فایل است)"""
+        if self.valid and self._file is not None:
+            self._read()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def digest(self, size: int):
+        """hex digest اگر دقیقاً size بایت خروجی نهایی خوانده شده باشد، وگرنه None"""
+        self.close()
+        if not self.valid or not self.offset or self.offset != size:
+            return None
+        return self._hasher.hexdigest()
+
+
+def content_key(digest: str, size: int) -> str:
+    return f'{digest}:{size}'
+
+
+def sent_media(message):
+    """(kind, file_id) فایل یک پیام ارسال شده (Bot API یا Pyrogram) یا None"""
+    for kind in MEDIA_KINDS:
+        media = getattr(message, kind, None)
+        if media is not None and getattr(media, 'file_id', None):
+            return kind, media.file_id
+    return None
+
+
+class ContentIndex:
+    """
+    نگاشت hash محتوای فایل‌های ارسال شده به file_id تلگرام
+
+    فایلی با همان بایت‌ها (mirror های CDN، بازنشر، لینک‌های مختلف به یک mp4) به جای آپلود دوباره
+    با file_id قبلی ارسال می‌شود. روی دیسک مثل آمار ارسال مستقیم ذخیره می‌شود؛ با رسیدن به
+    max_entries قدیمی‌ترین استفاده‌ها حذف می‌شوند.
+    """
+
+    def __init__(self, path: str, max_entries: int = 50000, save_interval: float = 30.0):
+        self.path = path
+        self.max_entries = max_entries  # صفر = غیرفعال
+        self.save_interval = save_interval
+        self._entries = {}  # {content_key: {'kind', 'file_id', 'size', 'used'}}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.saved_bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def load(self):
+        """بارگذاری نگاشت ذخیره‌شده از دیسک"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                with self._lock:
+                    self._entries = {
+                        key: entry for key, entry in data.items()
+                        if isinstance(entry, dict) and entry.get('kind') in MEDIA_KINDS and entry.get('file_id')
+                    }
+                logger.info(f"نگاشت محتوا برای {len(self._entries)} فایل بارگذاری شد")
+        except Exception as e:
+            logger.error(f"خطا در بارگذاری نگاشت محتوا: {e}")
+
+    def save(self, force: bool = False):
+        """ذخیره روی دیسک (حداکثر هر save_interval ثانیه یکبار، مگر force)"""
+        now = time.time()
+        with self._lock:
+            if not self._dirty or (not force and now - self._last_save < self.save_interval):
+                return
+            snapshot = json.dumps(self._entries)
+            self._dirty = False
+            self._last_save = now
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(snapshot)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"خطا در ذخیره نگاشت محتوا: {e}")
+
+    def lookup(self, key: str):
+        """ورودی (kind, file_id) برای محتوای تکراری یا None"""
+        if not self.enabled or not key:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry['used'] = time.time()
+            self._dirty = True
+            return entry['kind'], entry['file_id']
+
+    def contains(self, key: str) -> bool:
+        """file_id برای این محتوا موجود است (بدون ثبت در آمار hit/miss)"""
+        return self.enabled and bool(key) and key in self._entries
+
+    def delivered(self, size: int):
+        """ارسال موفق با file_id قبلی (آپلودی به این حجم حذف شد)"""
+        with self._lock:
+            self.saved_bytes += size
+
+    def record(self, key: str, kind: str, file_id: str, size: int):
+        """ثبت file_id فایلی که تازه آپلود شد"""
+        if not self.enabled or not key or kind not in MEDIA_KINDS:
+            return
+        with self._lock:
+            self._entries[key] = {'kind': kind, 'file_id': file_id, 'size': size, 'used': time.time()}
+            if len(self._entries) > self.max_entries:
+                # حذف ۱۰٪ قدیمی‌ترین‌ها یکجا تا مرتب‌سازی در هر ثبت تکرار نشود
+                oldest = sorted(self._entries, key=lambda k: self._entries[k].get('used', 0))
+                for stale in oldest[:max(1, self.max_entries // 10)]:
+                    del self._entries[stale]
+            self._dirty = True
+
+    def forget(self, key: str):
+        """file_id دیگر معتبر نیست (ارسال با آن رد شد)"""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._dirty = True
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'saved_bytes': self.saved_bytes,
+        }
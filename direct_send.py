@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+from lazyimport import LazyModule
+
+requests = LazyModule('requests')
+
+logger = logging.getLogger(__name__)
+
+# تلگرام فایل‌هایی که با URL ارسال می‌شوند را فقط تا 20MB دریافت می‌کند
+TELEGRAM_URL_FETCH_LIMIT = 20 * 1024 * 1024
+
+# sendDocument با URL فقط برای GIF، PDF و ZIP کار می‌کند
+DIRECT_DOCUMENT_TYPES = ('image/gif', 'application/pdf', 'application/zip', 'application/x-zip-compressed')
+
+
+def host_of(url: str) -> str:
+    """استخراج نام هاست (بدون www) از URL"""
+    host = (urlparse(url).hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+
+class DirectSendAdvisor:
+    """نگهداری آمار ارسال مستقیم هر هاست و تصمیم‌گیری بین ارسال مستقیم و دانلود محلی"""
+
+    def __init__(self, path: str, min_samples: int = 3, good_ratio: float = 0.8,
+                 bad_ratio: float = 0.2, half_life_hours: float = 72.0,
+                 explore_ratio: float = 0.05, save_interval: float = 30.0):
+        self.path = path
+        self.min_samples = min_samples
+        self.good_ratio = good_ratio
+        self.bad_ratio = bad_ratio
+        self.half_life = half_life_hours * 3600
+        self.explore_ratio = explore_ratio
+        self.save_interval = save_interval
+        self._hosts = {}  # {host: {'success', 'failure', 'latency', 'fail_latency', 'updated'}}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+
+    def load(self):
+        """بارگذاری آمار ذخیره‌شده از دیسک"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                with self._lock:
+                    self._hosts = {h: s for h, s in data.items() if isinstance(s, dict)}
+                logger.info(f"آمار ارسال مستقیم برای {len(self._hosts)} هاست بارگذاری شد")
+        except Exception as e:
+            logger.error(f"خطا در بارگذاری آمار ارسال مستقیم: {e}")
+
+    def save(self, force: bool = False):
+        """ذخیره آمار روی دیسک (حداکثر هر save_interval ثانیه یکبار، مگر force)"""
+        now = time.time()
+        with self._lock:
+            if not self._dirty or (not force and now - self._last_save < self.save_interval):
+                return
+            snapshot = json.dumps(self._hosts, ensure_ascii=False)
+            self._dirty = False
+            self._last_save = now
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(snapshot)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"خطا در ذخیره آمار ارسال مستقیم: {e}")
+
+    def _decayed(self, stats: dict, now: float) -> dict:
+        """کاهش وزن آمار قدیمی تا هاست‌ها بتوانند از سابقه بد خارج شوند"""
+        age = now - stats.get('updated', now)
+        if age > 0 and self.half_life > 0:
+            factor = 0.5 ** (age / self.half_life)
+            stats['success'] = stats.get('success', 0.0) * factor
+            stats['failure'] = stats.get('failure', 0.0) * factor
+        stats['updated'] = now
+        return stats
+
+    def host_stats(self, url: str) -> dict:
+        """آمار فعلی یک هاست (کپی)"""
+        with self._lock:
+            stats = self._hosts.get(host_of(url))
+            return dict(stats) if stats else {}
+
+    def probe(self, url: str) -> dict:
+        """درخواست HEAD ارزان برای بررسی نوع و حجم فایل (برای اجرا در executor)"""
+        result = {'ok': False, 'status': 0, 'content_type': '', 'size': 0}
+        try:
+            with requests.Session() as session:
+                session.trust_env = False
+                response = session.head(url, allow_redirects=True, timeout=10)
+                result['status'] = response.status_code
+                result['ok'] = response.status_code < 400
+                result['content_type'] = (response.headers.get('content-type', '') or '').split(';')[0].strip().lower()
+                try:
+                    result['size'] = int(response.headers.get('content-length', 0) or 0)
+                except ValueError:
+                    result['size'] = 0
+        except Exception as e:
+            result['error'] = str(e)
+        return result
+
+    def decide(self, url: str, as_video: bool, probe: dict = None):
+        """
+        تصمیم‌گیری برای ارسال مستقیم
+
+        خروجی: (True/False, دلیل) یا (None, دلیل) اگر برای تصمیم به probe نیاز باشد
+        """
+        host = host_of(url)
+        with self._lock:
+            stats = self._hosts.get(host)
+            if stats:
+                stats = self._decayed(dict(stats), time.time())
+
+        samples = (stats['success'] + stats['failure']) if stats else 0.0
+        ratio = stats['success'] / samples if samples else 0.0
+
+        # هاست با سابقه خوب: بدون probe مستقیم ارسال کن
+        if samples >= self.min_samples and ratio >= self.good_ratio:
+            return True, f"سابقه خوب هاست ({ratio:.0%})"
+
+        # هاست با سابقه بد: بدون probe دانلود محلی، به جز درصد کمی برای کاوش دوباره
+        known_bad = samples >= self.min_samples and ratio <= self.bad_ratio
+        if known_bad and probe is None:
+            if random.random() >= self.explore_ratio:
+                return False, f"سابقه ضعیف هاست ({ratio:.0%})"
+            return None, "نیاز به probe برای کاوش دوباره هاست با سابقه ضعیف"
+
+        if probe is None:
+            return None, "نیاز به probe"
+
+        if probe.get('ok'):
+            size = probe.get('size', 0)
+            content_type = probe.get('content_type', '')
+            if size > TELEGRAM_URL_FETCH_LIMIT:
+                return False, f"حجم {size / (1024 * 1024):.1f} MB بیشتر از محدودیت 20MB تلگرام"
+            if content_type.startswith('text/'):
+                return False, f"نوع محتوا {content_type} قابل ارسال مستقیم نیست"
+            if not as_video and content_type and content_type not in DIRECT_DOCUMENT_TYPES:
+                return False, f"sendDocument با URL از {content_type} پشتیبانی نمی‌کند"
+        elif probe.get('status'):
+            return False, f"HEAD با کد {probe['status']} ناموفق بود"
+
+        if known_bad:
+            return True, "کاوش دوباره هاست با سابقه ضعیف"
+
+        return True, "پیش‌بینی موفقیت با probe"
+
+    def record(self, url: str, success: bool, latency: float):
+        """ثبت نتیجه یک تلاش ارسال مستقیم"""
+        host = host_of(url)
+        if not host:
+            return
+        now = time.time()
+        with self._lock:
+            stats = self._decayed(self._hosts.setdefault(host, {}), now)
+            key = 'latency' if success else 'fail_latency'
+            if success:
+                stats['success'] = stats.get('success', 0.0) + 1
+            else:
+                stats['failure'] = stats.get('failure', 0.0) + 1
+            previous = stats.get(key)
+            stats[key] = latency if previous is None else previous * 0.7 + latency * 0.3
+            self._dirty = True
+
+    def summary(self, limit: int = 10) -> list:
+        """پرتکرارترین هاست‌ها برای نمایش در پنل ادمین"""
+        with self._lock:
+            items = [(h, dict(s)) for h, s in self._hosts.items()]
+        items.sort(key=lambda item: item[1].get('success', 0) + item[1].get('failure', 0), reverse=True)
+        return items[:limit]
@@ -0,0 +1,201 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlparse
+
+logger = logging.getLogger(__name__)
+
+# پارامترهای رایج زمان انقضا در لینک‌های امضاشده (googlevideo، CloudFront، Akamai، CDN های دیگر)
+EXPIRY_PARAMS = ('expire', 'expires', 'expiry', 'exp', 'e', 'validto', 'valid_to', 'x-expires', 'ttl_expire')
+# توکن‌های Akamai (hdnts=exp=...~acl=...) و مسیرهای /expire/<ts>/ در manifest ها
+EXPIRY_PATTERN = re.compile(r'(?:^|[/~;&])(?:exp|expire|expires)[=/](\d{10})(?=$|[/~;&])', re.IGNORECASE)
+# مقدار عددی فقط وقتی زمان انقضا حساب می‌شود که در این بازه از اکنون باشد (نه شناسه یا عدد دیگر)
+MAX_EXPIRY_AHEAD = 7 * 24 * 3600
+URL_FIELDS = ('url', 'manifest_url', 'fragment_base_url')
+
+
+def url_expiry(url: str, now: float = None):
+    """زمان انقضای جاسازی‌شده در یک لینک امضاشده (unix) یا None"""
+    if not url:
+        return None
+    now = time.time() if now is None else now
+    parsed = urlparse(url)
+    candidates = [value for key, value in parse_qsl(parsed.query) if key.lower() in EXPIRY_PARAMS]
+    candidates += EXPIRY_PATTERN.findall(parsed.path)
+    candidates += [m for _, value in parse_qsl(parsed.query) for m in EXPIRY_PATTERN.findall(value)]
+    expiries = []
+    for value in candidates:
+        try:
+            expiry = float(value)
+        except ValueError:
+            continue
+        if now < expiry < now + MAX_EXPIRY_AHEAD:
+            expiries.append(expiry)
+    return min(expiries) if expiries else None
+
+
+def info_expiry(info: dict, now: float = None):
+    """نزدیک‌ترین زمان انقضای لینک‌های رسانه در info (همه فرمت‌ها) یا None"""
+    expiries = []
+    for item in [info] + list(info.get('formats') or []):
+        for field in URL_FIELDS:
+            expiry = url_expiry(item.get(field), now)
+            if expiry is not None:
+                expiries.append(expiry)
+    return min(expiries) if expiries else None
+
+
+class _Entry:
+    __slots__ = ('info', 'size', 'expires_at', 'aliases')
+
+    def __init__(self, info: dict, size: int, expires_at: float):
+        self.info = info
+        self.size = size
+        self.expires_at = expires_at
+        self.aliases = set()
+
+
+class InfoCache:
+    """
+    cache مشترک خروجی استخراج yt-dlp بین درخواست‌ها
+
+    - کلید: (extractor_key, id)؛ هر URL که به آن رسیده نیز به همان ورودی اشاره می‌کند
+    - TTL از زمان انقضای لینک‌های امضاشده فرمت‌ها (منهای margin) و در نبود آن default_ttl
+    - محدود به max_bytes (حجم JSON اطلاعات) با حذف LRU
+    - اعتبار لینک‌ها فقط با خطای 403 هنگام دانلود رد می‌شود (invalidate) نه با درخواست اضافه
+    """
+
+    def __init__(self, max_bytes: int, default_ttl: float = 300, max_ttl: float = 6 * 3600,
+                 margin: float = 60, on_lookup=None):
+        self.max_bytes = max_bytes  # صفر = غیرفعال
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self.margin = margin  # زودتر از انقضای واقعی منقضی شود تا دانلود وسط کار 403 نگیرد
+        self.on_lookup = on_lookup  # function(result) با 'hit'، 'miss' یا 'expired'
+        self._entries = OrderedDict()  # {(extractor_key, id): _Entry}
+        self._aliases = {}  # {url: (extractor_key, id)}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key_of(info: dict):
+        extractor = info.get('extractor_key') or info.get('extractor')
+        video_id = info.get('id')
+        if not extractor or not video_id:
+            return None
+        return (extractor, str(video_id))
+
+    def _lookup(self, url: str, identity=None, *aliases):
+        key = identity if identity in self._entries else None
+        for alias in (url,) + aliases:
+            if key is None:
+                key = self._aliases.get(alias)
+        entry = self._entries.get(key) if key is not None else None
+        if entry is None:
+            return 'miss', None
+        if entry.expires_at <= time.time():
+            self._remove(key)
+            return 'expired', None
+        self._entries.move_to_end(key)
+        return 'hit', entry
+
+    def get(self, url: str, identity=None, *aliases):
+        """
+        اطلاعات cache شده برای url (کپی قابل تغییر) یا None
+
+        identity: (extractor_key, id) از تطبیق آفلاین URL؛ aliases: شکل‌های دیگر همان لینک
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            result, entry = self._lookup(url, identity, *aliases)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if self.on_lookup is not None:
+            self.on_lookup(result)
+        # process_ie_result اطلاعات را تغییر می‌دهد؛ نسخه cache دست‌نخورده بماند
+        return json.loads(entry.info) if entry is not None else None
+
+    def put(self, info: dict, *urls) -> bool:
+        """
+        ذخیره اطلاعات استخراج شده (باید با YoutubeDL.sanitize_info قابل JSON شده باشد)
+
+        urls: آدرس‌هایی که به این اطلاعات رسیده‌اند (لینک کاربر، webpage_url)
+        """
+        if not self.enabled or info.get('_type', 'video') != 'video':
+            return False
+        key = self.key_of(info)
+        if key is None:
+            return False
+        now = time.time()
+        expiry = info_expiry(info, now)
+        ttl = self.default_ttl if expiry is None else min(expiry - now - self.margin, self.max_ttl)
+        if ttl <= 0:
+            return False
+        payload = json.dumps(info, ensure_ascii=False)
+        # یک ورودی بزرگ نباید کل cache را خالی کند
+        if len(payload) > self.max_bytes // 4:
+            return False
+        entry = _Entry(payload, len(payload), now + ttl)
+        aliases = {url for url in urls + (info.get('webpage_url'),) if url}
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None:
+                aliases |= previous.aliases
+                self._remove(key)
+            entry.aliases = aliases
+            self._entries[key] = entry
+            self.bytes += entry.size
+            for url in aliases:
+                self._aliases[url] = key
+            while self.bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        logger.debug(f"اطلاعات {key[0]}:{key[1]} برای {ttl:.0f}s در cache ذخیره شد")
+        return True
+
+    def invalidate(self, url: str):
+        """حذف اطلاعات url (مثلاً پس از 403 روی لینک‌های رسانه)"""
+        with self._lock:
+            key = self._aliases.get(url)
+            if key is not None and key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+        for url in entry.aliases:
+            if self._aliases.get(url) == key:
+                del self._aliases[url]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._aliases.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
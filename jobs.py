@@ -0,0 +1,36 @@
+import itertools
+import time
+from dataclasses import dataclass, field
+
+_job_ids = itertools.count(1)
+
+
+@dataclass
+class Job:
+    """یک درخواست دانلود که در صف پردازش قرار می‌گیرد"""
+    user_id: int
+    chat_id: int
+    message_id: int
+    url: str
+    canonical: object = None  # Canonical: هویت یکتای محتوای لینک (canonical.py)
+    bot: object = None
+    status_message: object = None
+    current_time: str = ''
+    kind: str = 'direct'  # direct یا video (برای تخمین هزینه حافظه)
+    job_id: int = field(default_factory=lambda: next(_job_ids))
+    submitted: float = field(default_factory=time.monotonic)
+    started: float = 0.0
+    queue_position: int = 0
+    cost: int = 0  # حجم تخمینی (بایت) برای زمان‌بندی کوتاه‌ترین کار اول
+    cost_source: str = ''
+    probe: dict = None  # نتیجه HEAD برای لینک‌های مستقیم
+    size: int = 0  # حجم واقعی پس از دانلود
+    delivered: bool = False
+    memory: object = None  # Reservation حافظه در طول مرحله دانلود
+    journal_id: int = 0  # ردیف این کار در ژورنال (journal.py)
+    resume: dict = None  # ردیف ژورنال کاری که پس از restart ادامه داده می‌شود
+
+    def wait_time(self) -> float:
+        """مدت انتظار در صف (ثانیه)"""
+        end = self.started or time.monotonic()
+        return end - self.submitted
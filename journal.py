@@ -0,0 +1,467 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# مراحل یک کار به ترتیب؛ delivered و failed پایانی هستند
+STATES = ('queued', 'probing', 'downloading', 'uploading', 'delivered', 'failed')
+ACTIVE_STATES = STATES[:4]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    status_message_id INTEGER,
+    url TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    requested_at TEXT NOT NULL DEFAULT '',
+    state TEXT NOT NULL,
+    filepath TEXT,
+    downloaded INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    validator TEXT NOT NULL DEFAULT '',
+    content_type TEXT NOT NULL DEFAULT '',
+    digest TEXT NOT NULL DEFAULT '',
+    resumes INTEGER NOT NULL DEFAULT 0,
+    shard INTEGER NOT NULL DEFAULT 0,
+    claimed INTEGER NOT NULL DEFAULT 1,
+    owner TEXT NOT NULL DEFAULT '',
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS instances (
+    id TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    heartbeat REAL NOT NULL,
+    started REAL NOT NULL
+);
+"""
+INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, updated);
+CREATE INDEX IF NOT EXISTS jobs_dispatch ON jobs (claimed, shard, id);
+"""
+# ستون‌هایی که بعد از ساخت اولیه جدول اضافه شده‌اند (برای پایگاه داده‌های قدیمی‌تر)
+MIGRATIONS = {
+    'shard': 'ALTER TABLE jobs ADD COLUMN shard INTEGER NOT NULL DEFAULT 0',
+    'claimed': 'ALTER TABLE jobs ADD COLUMN claimed INTEGER NOT NULL DEFAULT 1',
+    'owner': "ALTER TABLE jobs ADD COLUMN owner TEXT NOT NULL DEFAULT ''",
+}
+FIELDS = ('status_message_id', 'filepath', 'downloaded', 'size', 'validator', 'content_type', 'digest', 'resumes')
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobJournal:
+    """
+    ثبت ماندگار مراحل هر کار در SQLite برای ادامه کارهای ناتمام پس از restart یا crash
+
+    - هر تغییر مرحله (queued ← probing ← downloading ← uploading ← delivered/failed) یک UPDATE است
+    - پیشرفت دانلود (مسیر فایل، offset و ETag/Last-Modified پاسخ) حداکثر هر PROGRESS_INTERVAL ثانیه
+      یا PROGRESS_BYTES بایت ثبت می‌شود
+    - WAL با synchronous=NORMAL: هر commit بدون fsync است (چند ده میکروثانیه) و با کشته شدن پروسه
+      (OOM، redeploy) از دست نمی‌رود؛ فقط crash خود سیستم‌عامل ممکن است آخرین تغییرات را ببرد. با این
+      حال قفل نوشتن بین پروسه‌ها مشترک است و ممکن است تا timeout اتصال منتظر بماند؛ پس روی event loop
+      اجرا نمی‌شود (main.journal_call)
+    - خطاهای پایگاه داده فقط لاگ می‌شوند؛ ژورنال هرگز نباید باعث شکست یک کار شود
+    - در حالت چند پروسه‌ای صف مشترک هم هست: پروسه اصلی کار را با shard و claimed=0 ثبت می‌کند و
+      پروسه worker همان shard آن را با claim برمی‌دارد
+    - هر ردیف مالک (owner = شناسه نمونه ربات) دارد؛ هنگام جایگزینی نسخه‌ها نمونه جدید فقط کارهایی را
+      برمی‌دارد (adopt) که سپرده شده‌اند (owner خالی) یا مالکشان دیگر زنده نیست (روی همین میزبان:
+      پروسه‌ای که وجود ندارد؛ میزبان دیگر: heartbeat قدیمی)
+    - heartbeat اتصال و قفل جداگانه دارد تا پشت نوشتن‌های طولانی (claim یا انتظار قفل پروسه‌های
+      دیگر) نماند
+    """
+
+    PROGRESS_INTERVAL = 5.0
+    PROGRESS_BYTES = 8 * 1024 * 1024
+    # هر چند کار پایان‌یافته یکبار ردیف‌های قدیمی حذف می‌شوند
+    PRUNE_EVERY = 500
+    # نمونه‌ای که این مدت heartbeat نداشته مرده حساب می‌شود (ثانیه)
+    INSTANCE_TTL = 30.0
+    # نمونه‌ای روی همین میزبان که پروسه‌اش هنوز وجود دارد تا این مدت بدون heartbeat هم زنده حساب
+    # می‌شود (پروسه مشغول یا قفل نوشتن طولانی)؛ سقف آن در برابر استفاده دوباره pid ها
+    INSTANCE_GRACE = 300.0
+    # حداکثر کارهایی که با هر claim برداشته می‌شوند
+    CLAIM_BATCH = 100
+
+    def __init__(self, path: str, retention: float = 24 * 3600):
+        self.path = path  # خالی = غیرفعال
+        self.retention = retention  # نگه‌داری ردیف کارهای پایان‌یافته (ثانیه)
+        self._conn = None
+        self._lock = threading.Lock()
+        self._beat_conn = None
+        self._beat_lock = threading.Lock()
+        self._progress_lock = threading.Lock()
+        self._progress = {}  # {journal_id: (زمان، offset) آخرین ثبت پیشرفت}
+        self._finished = 0
+        self._deferred_at = None  # مقدار _finished هنگام claim ای که کاری را به خاطر سقف کاربر جا گذاشت
+        self._data_version = None
+        self.resumed = 0
+        self.instance = ''  # شناسه نمونه ربات (مالک کارهای ثبت یا برداشته شده)
+
+    @property
+    def enabled(self) -> bool:
+        return self._conn is not None
+
+    def open(self):
+        """باز کردن (یا ساختن) پایگاه داده"""
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # timeout: انتظار برای قفل نوشتن پروسه‌های دیگر
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(statement)
+            conn.executescript(INDEXES)
+            self._conn = conn
+            self._beat_conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        except Exception as e:
+            logger.error(f"خطا در باز کردن ژورنال کارها: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        with self._beat_lock:
+            if self._beat_conn is not None:
+                self._beat_conn.close()
+                self._beat_conn = None
+
+    def _execute(self, sql: str, params=()):
+        if self._conn is None:
+            return None
+        try:
+            with self._lock:
+                return self._conn.execute(sql, params)
+        except Exception as e:
+            logger.error(f"خطا در ژورنال کارها: {e}")
+            return None
+
+    def _query(self, sql: str, params=()) -> list:
+        if self._conn is None:
+            return []
+        try:
+            with self._lock:
+                return self._conn.execute(sql, params).fetchall()
+        except Exception as e:
+            logger.error(f"خطا در ژورنال کارها: {e}")
+            return []
+
+    def add(self, job, shard: int = 0, claimed: bool = True):
+        """
+        ثبت کار تازه در صف (شناسه ردیف در job.journal_id)
+
+        claimed=False: کار برای پروسه worker شماره shard ثبت می‌شود تا آن را با claim بردارد
+        """
+        now = time.time()
+        status_message_id = getattr(job.status_message, 'message_id', None)
+        cursor = self._execute(
+            'INSERT INTO jobs (user_id, chat_id, message_id, status_message_id, url, kind, requested_at, state, '
+            'shard, claimed, owner, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job.user_id, job.chat_id, job.message_id, status_message_id, job.url, job.kind, job.current_time,
+             'queued', shard, int(claimed), self.instance, now, now),
+        )
+        if cursor is not None:
+            job.journal_id = cursor.lastrowid
+
+    def update(self, job, state: str, **fields):
+        """ثبت مرحله جدید کار؛ fields: ستون‌های دیگر (filepath، size، digest و ...)"""
+        if not job.journal_id:
+            return
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f'unknown journal fields: {unknown}')
+        columns = ''.join(f', {name} = ?' for name in fields)
+        self._execute(
+            f'UPDATE jobs SET state = ?, updated = ?{columns} WHERE id = ?',
+            (state, time.time(), *fields.values(), job.journal_id),
+        )
+
+    def checkpoint_due(self, journal_id: int, offset: int, validator: str = '') -> bool:
+        """
+        checkpoint دانلود (از thread دانلود) ثبت شود؟ فقط هر PROGRESS_INTERVAL ثانیه یا PROGRESS_BYTES بایت
+
+        قفل جدا از اتصال پایگاه داده: thread دانلود پشت claim یا adopt (منتظر قفل نوشتن SQLite) نمی‌ماند.
+        """
+        if not journal_id or self._conn is None:
+            return False
+        now = time.monotonic()
+        # thread های دانلود همزمان و finish
+        with self._progress_lock:
+            last = self._progress.get(journal_id)
+            if last is not None and not validator and now - last[0] < self.PROGRESS_INTERVAL \
+                    and offset - last[1] < self.PROGRESS_BYTES:
+                return False
+            self._progress[journal_id] = (now, offset)
+        return True
+
+    def progress(self, journal_id: int, filepath: str, offset: int, validator: str = ''):
+        """
+        ثبت checkpoint دانلود که checkpoint_due آن را لازم دانسته
+
+        validator: ETag یا Last-Modified پاسخ سرور برای If-Range هنگام ادامه
+        """
+        if not journal_id:
+            return
+        if validator:
+            self._execute(
+                'UPDATE jobs SET state = ?, updated = ?, filepath = ?, downloaded = ?, validator = ? WHERE id = ?',
+                ('downloading', time.time(), filepath, offset, validator, journal_id),
+            )
+        else:
+            self._execute(
+                'UPDATE jobs SET state = ?, updated = ?, filepath = ?, downloaded = ? WHERE id = ?',
+                ('downloading', time.time(), filepath, offset, journal_id),
+            )
+
+    def finish(self, job, state: str):
+        """پایان کار (delivered یا failed)"""
+        if not job.journal_id:
+            return
+        with self._progress_lock:
+            self._progress.pop(job.journal_id, None)
+        self.update(job, state)
+        self._finished += 1
+        if self._finished % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def changed(self) -> bool:
+        """
+        آیا از فراخوانی قبلی اتصال دیگری (پروسه دیگر) در پایگاه داده نوشته است (PRAGMA data_version)
+
+        بدون قفل نوشتن؛ پروسه worker فقط وقتی claim (BEGIN IMMEDIATE) می‌کند که چیزی تغییر کرده باشد.
+        کارهایی که claim به خاطر سقف کاربر جا گذاشته با پایان کاری در همین پروسه هم دوباره بررسی می‌شوند
+        (نوشتن همین اتصال data_version را تغییر نمی‌دهد).
+        """
+        rows = self._query('PRAGMA data_version')
+        version = rows[0][0] if rows else None
+        changed = version != self._data_version
+        self._data_version = version
+        if self._deferred_at is not None and self._finished != self._deferred_at:
+            self._deferred_at = None
+            changed = True
+        return changed
+
+    def claim(self, shard: int, limit: int = CLAIM_BATCH, per_user: int = 0) -> list:
+        """
+        برداشتن کارهای تازه ثبت‌شده برای یک shard (هر shard فقط یک پروسه worker دارد)
+
+        per_user: سقف کارهای برداشته و ناتمام هر کاربر در همه shard ها (صفر = بدون سقف)؛ وقتی کارهای
+        یک کاربر در چند پروسه پخش می‌شوند (SHARD_BY=media) سقف هر پروسه به تنهایی کافی نیست.
+        """
+        if self._conn is None:
+            return []
+        try:
+            with self._lock:
+                self._conn.execute('BEGIN IMMEDIATE')
+                try:
+                    rows = self._conn.execute(
+                        'SELECT * FROM jobs WHERE claimed = 0 AND shard = ? AND state = ? ORDER BY id LIMIT ?',
+                        (shard, 'queued', limit),
+                    ).fetchall()
+                    deferred = False
+                    if rows and per_user > 0:
+                        users = sorted({row['user_id'] for row in rows})
+                        active = dict(self._conn.execute(
+                            f"SELECT user_id, COUNT(*) FROM jobs WHERE claimed = 1 "
+                            f"AND state IN ({', '.join('?' * len(ACTIVE_STATES))}) "
+                            f"AND user_id IN ({', '.join('?' * len(users))}) GROUP BY user_id",
+                            (*ACTIVE_STATES, *users),
+                        ).fetchall())
+                        allowed = []
+                        for row in rows:
+                            if active.get(row['user_id'], 0) < per_user:
+                                active[row['user_id']] = active.get(row['user_id'], 0) + 1
+                                allowed.append(row)
+                        deferred = len(allowed) < len(rows)
+                        rows = allowed
+                    if rows:
+                        self._conn.executemany(
+                            'UPDATE jobs SET claimed = 1, owner = ? WHERE id = ?',
+                            [(self.instance, row['id']) for row in rows],
+                        )
+                    self._conn.execute('COMMIT')
+                except BaseException:
+                    self._conn.execute('ROLLBACK')
+                    raise
+            self._deferred_at = self._finished if deferred else None
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"خطا در ژورنال کارها: {e}")
+            return []
+
+    def register(self, instance: str, state: str = 'starting'):
+        """ثبت این نمونه ربات (پروسه اصلی) برای تشخیص زنده بودن مالک کارها"""
+        self.instance = instance
+        now = time.time()
+        self._execute(
+            'INSERT OR REPLACE INTO instances (id, host, pid, state, heartbeat, started) VALUES (?, ?, ?, ?, ?, ?)',
+            (instance, socket.gethostname(), os.getpid(), state, now, now),
+        )
+
+    def heartbeat(self, state: str):
+        """اعلام زنده بودن و وضعیت (serving، draining یا stopped) این نمونه (با اتصال جداگانه)"""
+        if not self.instance or self._beat_conn is None:
+            return
+        try:
+            with self._beat_lock:
+                self._beat_conn.execute(
+                    'UPDATE instances SET state = ?, heartbeat = ? WHERE id = ?', (state, time.time(), self.instance)
+                )
+        except Exception as e:
+            logger.error(f"خطا در heartbeat ژورنال کارها: {e}")
+
+    def _live_instances(self) -> list:
+        """
+        شناسه نمونه‌هایی که هنوز زنده‌اند (کارهایشان نباید برداشته شود)
+
+        روی همین میزبان وجود پروسه ملاک است (heartbeat دیرکرده ممکن است فقط از مشغول بودن باشد)؛
+        pid خود این پروسه برای نمونه دیگر یعنی pid دوباره استفاده شده (مثلاً pid 1 در container).
+        روی میزبان‌های دیگر فقط heartbeat در دسترس است.
+        """
+        host = socket.gethostname()
+        now = time.time()
+        live = []
+        for row in self._query(
+            'SELECT id, host, pid, heartbeat FROM instances WHERE state != ? AND heartbeat > ?',
+            ('stopped', now - self.INSTANCE_GRACE),
+        ):
+            if row['id'] == self.instance:
+                alive = True
+            elif row['host'] == host:
+                alive = row['pid'] != os.getpid() and _pid_alive(row['pid'])
+            else:
+                alive = row['heartbeat'] > now - self.INSTANCE_TTL
+            if alive:
+                live.append(row['id'])
+        return live
+
+    def adopt(self, shard: int = None, include_own: bool = False) -> list:
+        """
+        برداشتن کارهای ناتمامی که مالک زنده ندارند (قدیمی‌ترین اول) و ثبت این نمونه به عنوان مالک
+
+        shard: فقط کارهای برداشته‌شده shard یک پروسه worker؛ None = همه (حالت تک پروسه‌ای)
+        include_own: کارهای خود این نمونه هم (پروسه worker ای که دوباره راه‌اندازی شده)
+        """
+        if self._conn is None:
+            return []
+        live = [instance for instance in self._live_instances() if instance != self.instance]
+        if not include_own:
+            live.append(self.instance)
+        conditions = [f"state IN ({', '.join('?' * len(ACTIVE_STATES))})"]
+        params = list(ACTIVE_STATES)
+        if live:
+            conditions.append(f"owner NOT IN ({', '.join('?' * len(live))})")
+            params += live
+        if shard is not None:
+            conditions.append('claimed = 1 AND shard = ?')
+            params.append(shard)
+        try:
+            with self._lock:
+                self._conn.execute('BEGIN IMMEDIATE')
+                try:
+                    rows = self._conn.execute(
+                        f"SELECT * FROM jobs WHERE {' AND '.join(conditions)} ORDER BY id", params
+                    ).fetchall()
+                    if rows:
+                        self._conn.executemany(
+                            'UPDATE jobs SET owner = ? WHERE id = ?', [(self.instance, row['id']) for row in rows]
+                        )
+                    self._conn.execute('COMMIT')
+                except BaseException:
+                    self._conn.execute('ROLLBACK')
+                    raise
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"خطا در ژورنال کارها: {e}")
+            return []
+
+    def release(self, journal_ids=None) -> int:
+        """
+        سپردن کارهای ناتمام این نمونه به نمونه بعدی (هنگام تخلیه)؛ خروجی تعداد کارها
+
+        journal_ids: فقط این کارها؛ None = همه کارهای ناتمام این نمونه. کارهای شروع‌نشده دوباره
+        claimed=0 می‌شوند تا در حالت چند پروسه‌ای مثل کار تازه برداشته شوند.
+        """
+        placeholders = ', '.join('?' * len(ACTIVE_STATES))
+        sql = (
+            f"UPDATE jobs SET owner = '', claimed = CASE WHEN state = 'queued' THEN 0 ELSE claimed END "
+            f"WHERE owner = ? AND state IN ({placeholders})"
+        )
+        params = [self.instance, *ACTIVE_STATES]
+        if journal_ids is not None:
+            journal_ids = [journal_id for journal_id in journal_ids if journal_id]
+            if not journal_ids:
+                return 0
+            sql += f" AND id IN ({', '.join('?' * len(journal_ids))})"
+            params += journal_ids
+        cursor = self._execute(sql, params)
+        return cursor.rowcount if cursor is not None else 0
+
+    def owned(self) -> int:
+        """تعداد کارهای ناتمام این نمونه (در همه پروسه‌های worker آن)"""
+        placeholders = ', '.join('?' * len(ACTIVE_STATES))
+        rows = self._query(
+            f'SELECT COUNT(*) AS count FROM jobs WHERE owner = ? AND state IN ({placeholders})',
+            (self.instance, *ACTIVE_STATES),
+        )
+        return rows[0]['count'] if rows else 0
+
+    def reshard(self, shards: int):
+        """انتقال کارهای ناتمام shard هایی که دیگر وجود ندارند (کاهش تعداد پروسه‌های worker)"""
+        placeholders = ', '.join('?' * len(ACTIVE_STATES))
+        self._execute(
+            f'UPDATE jobs SET shard = shard % ? WHERE shard >= ? AND state IN ({placeholders})',
+            (shards, shards, *ACTIVE_STATES),
+        )
+
+    def count(self, state: str) -> int:
+        rows = self._query('SELECT COUNT(*) AS count FROM jobs WHERE state = ?', (state,))
+        return rows[0]['count'] if rows else 0
+
+    def active_files(self) -> set:
+        """مسیر فایل‌های کارهای ناتمام (نباید در پاکسازی حذف شوند)"""
+        placeholders = ', '.join('?' * len(ACTIVE_STATES))
+        return {row['filepath'] for row in self._query(
+            f'SELECT filepath FROM jobs WHERE state IN ({placeholders}) AND filepath IS NOT NULL', ACTIVE_STATES
+        )}
+
+    def prune(self):
+        """حذف ردیف کارهای پایان‌یافته و نمونه‌های قدیمی‌تر از retention"""
+        cutoff = time.time() - self.retention
+        self._execute('DELETE FROM jobs WHERE state IN (?, ?) AND updated < ?', ('delivered', 'failed', cutoff))
+        self._execute('DELETE FROM instances WHERE heartbeat < ?', (cutoff,))
+
+    def stats(self) -> dict:
+        counts = {row['state']: row['count'] for row in self._query(
+            'SELECT state, COUNT(*) AS count FROM jobs GROUP BY state'
+        )}
+        return {
+            'states': counts,
+            'unfinished': sum(counts.get(state, 0) for state in ACTIVE_STATES),
+            'resumed': self.resumed,
+        }
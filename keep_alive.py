@@ -1,45 +1,153 @@
-from flask import Flask, jsonify
-from threading import Thread
+import asyncio
+import hmac
+import logging
 import os
 
-app = Flask(__name__)
+from aiohttp import web
+from telegram import Update
 
-@app.route('/')
-def home():
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LIFECYCLE = web.AppKey('lifecycle', object)
+# function() -> {برچسب worker: REGISTRY.snapshot() آن پروسه} در حالت supervisor
+WORKER_METRICS = web.AppKey('worker_metrics', object)
+
+
+async def home(request):
     """صفحه اصلی برای health check"""
-    return jsonify({
+    return web.json_response({
         "status": "alive",
         "message": "Bot is running!",
         "service": "Telegram File Downloader Bot"
     })
 
-@app.route('/health')
-def health():
-    """Endpoint برای سرویس مانیتورینگ"""
-    return jsonify({
-        "status": "healthy",
-        "uptime": "running"
-    }), 200
 
-@app.route('/ping')
-def ping():
+async def health(request):
+    """
+    Endpoint برای سرویس مانیتورینگ (liveness)
+
+    همیشه 200 تا پروسه در حال تخلیه کشته نشود؛ وضعیت و پیشرفت تخلیه در بدنه پاسخ است
+    """
+    lifecycle = request.app.get(LIFECYCLE)
+    if lifecycle is None:
+        return web.json_response({"status": "healthy", "uptime": "running"}, status=200)
+    return web.json_response(lifecycle.snapshot(), status=200)
+
+
+async def ready(request):
+    """readiness: 503 از شروع تخلیه تا orchestrator نمونه جدید را جایگزین کند"""
+    lifecycle = request.app.get(LIFECYCLE)
+    if lifecycle is not None and not lifecycle.accepting:
+        return web.json_response(lifecycle.snapshot(), status=503)
+    return web.json_response({"status": lifecycle.state if lifecycle else "healthy"}, status=200)
+
+
+async def ping(request):
     """Endpoint ساده برای پینگ"""
-    return "pong", 200
+    return web.Response(text="pong", status=200)
+
+
+async def metrics(request):
+    """متریک‌ها در قالب متنی Prometheus (در حالت supervisor همراه متریک‌های پروسه‌های worker)"""
+    workers = request.app.get(WORKER_METRICS)
+    text = REGISTRY.render(workers() if workers is not None else None)
+    return web.Response(text=text, content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+
+class WebhookReceiver:
+    """دریافت آپدیت‌های تلگرام از webhook و پردازش آن‌ها با چند worker روی همان event loop"""
+
+    def __init__(self, application, secret_token: str = '', workers: int = 4, queue_size: int = 1000):
+        self.application = application
+        self.secret_token = secret_token
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.accepting = True
+        self._tasks = []
+
+    async def handle(self, request):
+        """Endpoint webhook: اعتبارسنجی secret token و قرار دادن آپدیت در صف"""
+        if not self.accepting:
+            # در حال تخلیه: تلگرام آپدیت را دوباره (به نمونه جدید) ارسال می‌کند
+            return web.Response(status=503)
+        if self.secret_token:
+            received = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(received, self.secret_token):
+                logger.warning("درخواست webhook با secret token نامعتبر رد شد")
+                return web.Response(status=403)
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.warning(f"آپدیت نامعتبر از webhook: {e}")
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # تلگرام در صورت پاسخ غیر 200 آپدیت را بعداً دوباره ارسال می‌کند
+            return web.Response(status=503)
+        return web.Response(status=200)
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.application.process_update(update)
+            except Exception as e:
+                logger.error(f"خطا در پردازش آپدیت webhook: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def drain(self):
+        """توقف پذیرش آپدیت تازه و انتظار برای پردازش آپدیت‌هایی که پذیرفته شده‌اند"""
+        self.accepting = False
+        await self.queue.join()
+
+    def start(self):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+def create_app(webhook_path: str = None, receiver: WebhookReceiver = None, lifecycle=None,
+               worker_metrics=None) -> web.Application:
+    """ساخت برنامه aiohttp با endpoint های health و (اختیاری) webhook"""
+    app = web.Application()
+    if lifecycle is not None:
+        app[LIFECYCLE] = lifecycle
+    if worker_metrics is not None:
+        app[WORKER_METRICS] = worker_metrics
+    app.router.add_get('/', home)
+    app.router.add_get('/health', health)
+    app.router.add_get('/ready', ready)
+    app.router.add_get('/ping', ping)
+    app.router.add_get('/metrics', metrics)
+    if webhook_path and receiver is not None:
+        app.router.add_post(webhook_path, receiver.handle)
+    return app
+
 
-def run():
-    """اجرای Flask در پورت مشخص شده"""
-    port = int(os.getenv('PORT', 5000))
+async def start_server(app: web.Application, port: int = None, host: str = '0.0.0.0'):
+    """اجرای سرور aiohttp روی event loop فعلی (همان loop ربات)"""
+    port = port or int(os.getenv('PORT', 5000))
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
     try:
-        app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
+        await site.start()
     except OSError as e:
-        if "Address already in use" in str(e):
-            print(f"⚠️ پورت {port} در حال استفاده است - Flask server قبلاً اجرا شده")
-        else:
-            raise
-
-def keep_alive():
-    """اجرای Flask در یک Thread جداگانه"""
-    t = Thread(target=run)
-    t.daemon = True
-    t.start()
-    print(f"✅ Flask server started on port {os.getenv('PORT', 5000)}")
+        await runner.cleanup()
+        if "Address already in use" in str(e) or getattr(e, 'errno', None) == 98:
+            print(f"⚠️ پورت {port} در حال استفاده است - سرور HTTP قبلاً اجرا شده")
+            return None
+        raise
+    print(f"✅ HTTP server started on port {port}")
+    return runner
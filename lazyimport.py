@@ -0,0 +1,47 @@
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LazyModule:
+    """
+    ماژولی که با اولین دسترسی به یکی از attribute هایش import می‌شود
+
+        yt_dlp = LazyModule('yt_dlp')
+        yt_dlp.YoutubeDL(...)  # import واقعی همین‌جا (فقط یک بار، thread-safe)
+
+    برای ماژول‌های سنگینی که فقط در بعضی مسیرها لازم‌اند (yt-dlp، Pyrogram، requests)
+    تا هزینه import آن‌ها از زمان راه‌اندازی ربات حذف شود.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+
+    def load(self):
+        """import ماژول (اگر قبلاً نشده باشد) و برگرداندن آن"""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    self.load_seconds = time.perf_counter() - started
+                    logger.debug(f"ماژول {self._name} در {self.load_seconds:.2f}s بارگذاری شد")
+                    self._module = module
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
+
+    def __repr__(self):
+        state = 'loaded' if self.loaded else 'not loaded'
+        return f'<LazyModule {self._name} ({state})>'
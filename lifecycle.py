@@ -0,0 +1,66 @@
+import time
+
+# starting ← serving ← draining ← stopped
+STATES = ('starting', 'serving', 'draining', 'stopped')
+
+
+class Lifecycle:
+    """
+    وضعیت چرخه عمر پروسه برای health check و هماهنگی جایگزینی با نسخه جدید (rolling restart)
+
+    با SIGTERM وضعیت draining می‌شود: آپدیت تازه پذیرفته نمی‌شود، offset آپدیت‌ها آزاد می‌شود تا
+    نمونه جدید دریافت را شروع کند و کارهای در حال اجرا تا drain_timeout فرصت تمام شدن دارند.
+    /ready در همین لحظه 503 می‌شود تا orchestrator ترافیک و نمونه جدید را جایگزین کند.
+    """
+
+    def __init__(self, drain_timeout: float = 60.0):
+        self.drain_timeout = drain_timeout
+        self.state = 'starting'
+        self.started = time.time()
+        self.drain_started = None  # time.monotonic شروع تخلیه
+        self.updates_released = False  # offset آپدیت‌ها به نمونه بعدی سپرده شد
+        self.handed_over = 0  # کارهای سپرده شده به نمونه بعدی
+        self.progress = None  # function() -> {'in_flight': n, 'queued': n}
+
+    @property
+    def accepting(self) -> bool:
+        """پذیرش آپدیت و کار تازه"""
+        return self.state in ('starting', 'serving')
+
+    def serving(self):
+        if self.state == 'starting':
+            self.state = 'serving'
+
+    def begin_drain(self) -> bool:
+        """شروع تخلیه؛ False اگر قبلاً شروع شده باشد"""
+        if self.state in ('draining', 'stopped'):
+            return False
+        self.state = 'draining'
+        self.drain_started = time.monotonic()
+        return True
+
+    def stopped(self):
+        self.state = 'stopped'
+
+    def remaining(self) -> float:
+        """زمان باقی‌مانده تا پایان مهلت تخلیه (ثانیه)"""
+        if self.drain_started is None:
+            return self.drain_timeout
+        return max(0.0, self.drain_timeout - (time.monotonic() - self.drain_started))
+
+    def snapshot(self) -> dict:
+        data = {
+            'status': self.state,
+            'accepting_updates': self.accepting,
+            'uptime': round(time.time() - self.started, 1),
+        }
+        if self.progress is not None:
+            data.update(self.progress())
+        if self.drain_started is not None:
+            data.update({
+                'drain_elapsed': round(time.monotonic() - self.drain_started, 1),
+                'drain_remaining': round(self.remaining(), 1),
+                'updates_released': self.updates_released,
+                'handed_over': self.handed_over,
+            })
+        return data
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """صدک از لیست مرتب‌شده (بدون درون‌یابی)"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class LoopMonitor:
+    """
+    پایش سلامت event loop
+
+    - یک task با فاصله ثابت می‌خوابد و تاخیر بیدار شدن (lag) را اندازه می‌گیرد
+    - یک thread نگهبان اگر loop بیش از block_threshold پاسخ ندهد، stack همان لحظه
+      thread اصلی را ثبت می‌کند (همان callback ای که loop را مسدود کرده)
+    - اگر p95 تاخیر در پنجره اخیر از alert_threshold بیشتر بماند، on_alert صدا زده می‌شود
+    """
+
+    def __init__(self, interval: float = 0.25, block_threshold: float = 0.5, alert_threshold: float = 0.2,
+                 alert_cooldown: float = 900.0, window: int = 1200, on_alert=None, on_block=None):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.alert_threshold = alert_threshold
+        self.alert_cooldown = alert_cooldown
+        self.on_alert = on_alert  # coroutine function(text)
+        self.on_block = on_block  # function(duration, stack) - از thread نگهبان صدا زده می‌شود
+        self.samples = deque(maxlen=window)
+        self.blocks = deque(maxlen=20)  # [(timestamp, duration, stack)]
+        self.block_count = 0
+        self.max_lag = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._stall_reported = False
+        self._last_alert = 0.0
+        self._stopped = threading.Event()
+        self._task = None
+        self._watchdog = None
+
+    def start(self):
+        """شروع پایش روی event loop فعلی"""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        checks = 0
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self._heartbeat = now
+            self._stall_reported = False
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            checks += 1
+            # بررسی هشدار هر حدود 10 ثانیه
+            if checks % max(1, int(10 / self.interval)) == 0:
+                await self._check_alert(now)
+
+    def _watch(self):
+        """thread نگهبان: ثبت stack وقتی loop بیش از حد مسدود است"""
+        poll = max(0.05, self.block_threshold / 4)
+        while not self._stopped.wait(poll):
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled < self.block_threshold or self._stall_reported:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            self._stall_reported = True
+            self.block_count += 1
+            self.blocks.append((time.time(), stalled, stack))
+            logger.warning(f"event loop به مدت {stalled:.2f}s مسدود شد:\n{stack}")
+            if self.on_block is not None:
+                try:
+                    self.on_block(stalled, stack)
+                except Exception:
+                    pass
+
+    def percentiles(self) -> dict:
+        values = sorted(self.samples)
+        return {
+            '0.5': percentile(values, 0.5),
+            '0.95': percentile(values, 0.95),
+            '0.99': percentile(values, 0.99),
+        }
+
+    async def _check_alert(self, now: float):
+        if self.on_alert is None or now - self._last_alert < self.alert_cooldown:
+            return
+        if len(self.samples) < self.samples.maxlen // 4:
+            return
+        p95 = self.percentiles()['0.95']
+        if p95 < self.alert_threshold:
+            return
+        self._last_alert = now
+        text = (
+            f"⚠️ تاخیر event loop بالاست\n"
+            f"p95: {p95 * 1000:.0f}ms (آستانه {self.alert_threshold * 1000:.0f}ms)\n"
+            f"تعداد مسدود شدن‌ها: {self.block_count}"
+        )
+        if self.blocks:
+            _, duration, stack = self.blocks[-1]
+            text += f"\n\nآخرین مسدودی ({duration:.2f}s):\n{stack[-1500:]}"
+        try:
+            await self.on_alert(text)
+        except Exception as e:
+            logger.error(f"خطا در ارسال هشدار event loop: {e}")
@@ -1,24 +1,58 @@
 import os
 import logging
 import mimetypes
-import requests
 import time
-import yt_dlp
 from urllib.parse import urlparse
 from pathlib import Path
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Bot, Chat, Message, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
-try:
-    from pyrogram.client import Client
-except ImportError:
-    from pyrogram import Client
 import asyncio
 import glob
 import concurrent.futures
+import hashlib
+import json
+import math
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import zlib
+from functools import partial
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from direct_send import DirectSendAdvisor, host_of
+from admission import AdmissionController, AdmissionRejected
+from jobs import Job
+from pipeline import Artifact, StageStats
+from bandwidth import BandwidthManager, EGRESS, INGRESS, TransferCancelled
+from keep_alive import WebhookReceiver, create_app, start_server
+from metrics import (
+    BYTES, CACHE_REQUESTS, DEDUP_SAVED_BYTES, ERRORS, EXECUTOR_QUEUE, JOBS, LOOP_BLOCKS, LOOP_LAG, MEMORY_BYTES, MEMORY_THROTTLED,
+    POSTPROCESS_RESULTS, PYROGRAM_SESSIONS, QUEUE_DEPTH, REGISTRY, STAGE_SECONDS,
+)
+from loopmon import LoopMonitor
+from memgov import MemoryGovernor, container_memory_limit
+from profiler import MemoryTracker, dump_tasks, render_folded, sample_stacks, top_functions
+from lazyimport import LazyModule
+from ytdl_pool import YoutubeDLPool
+from infocache import InfoCache
+from canonical import canonicalize_async, resolver as media_resolver
+from dedup import HASH_CHUNK_SIZE, ContentIndex, TailHasher, content_key, hash_file, new_hasher, sent_media
+from journal import JobJournal
+from lifecycle import Lifecycle
+import media
+
+# ماژول‌های سنگین فقط با اولین استفاده بارگذاری می‌شوند (راه‌اندازی سریع‌تر)
+yt_dlp = LazyModule('yt_dlp')
+pyrogram = LazyModule('pyrogram')
+requests = LazyModule('requests')
 
 # بارگذاری متغیرهای محیطی از فایل .env
 load_dotenv()
@@ -33,6 +67,100 @@ DIRECT_SEND_ONLY = os.getenv('DIRECT_SEND_ONLY', 'false').strip().lower() in ('1
 # پشتیبانی از کوکی‌ها برای yt-dlp (برای عبور از age-gate یا نیاز به لاگین)
 YTDLP_COOKIES = os.getenv('YTDLP_COOKIES', '').strip()  # مسیر فایل کوکی به فرمت Netscape
 YTDLP_COOKIE_HEADER = os.getenv('YTDLP_COOKIE_HEADER', '').strip()  # رشته Cookie آماده (اختیاری)
+# هر نمونه YoutubeDL در pool پس از این تعداد کار بسته و از نو ساخته می‌شود
+YTDLP_POOL_MAX_USES = int(os.getenv('YTDLP_POOL_MAX_USES', '50'))
+# cache اطلاعات استخراج شده ویدیوها بین درخواست‌ها (صفر = غیرفعال)
+INFO_CACHE_MB = int(os.getenv('INFO_CACHE_MB', '32'))
+# TTL اطلاعاتی که لینک‌هایشان زمان انقضا ندارند (ثانیه)
+INFO_CACHE_TTL = int(os.getenv('INFO_CACHE_TTL', '300'))
+
+# تصمیم‌گیری یادگیرنده برای ارسال مستقیم (آمار هر هاست بین ری‌استارت‌ها حفظ می‌شود)
+DIRECT_SEND_MIN_SAMPLES = int(os.getenv('DIRECT_SEND_MIN_SAMPLES', '3'))
+DIRECT_SEND_GOOD_RATIO = float(os.getenv('DIRECT_SEND_GOOD_RATIO', '0.8'))
+DIRECT_SEND_BAD_RATIO = float(os.getenv('DIRECT_SEND_BAD_RATIO', '0.2'))
+# حداکثر فایل‌هایی که hash محتوا و file_id آن‌ها برای ارسال دوباره بدون آپلود نگه داشته می‌شود (صفر = غیرفعال)
+CONTENT_INDEX_MAX = int(os.getenv('CONTENT_INDEX_MAX', '50000'))
+# ژورنال کارها در SQLite تا کارهای ناتمام پس از restart یا crash از آخرین checkpoint ادامه پیدا کنند
+JOB_JOURNAL = os.getenv('JOB_JOURNAL', 'true').strip().lower() in ('1','true','yes','on')
+# حداکثر دفعات ادامه یک کار (کاری که خودش باعث crash می‌شود نباید بی‌نهایت تکرار شود)
+JOB_MAX_RESUMES = int(os.getenv('JOB_MAX_RESUMES', '2'))
+
+# حالت supervisor: پروسه اصلی فقط آپدیت‌ها را دریافت و کارها را از طریق ژورنال بین پروسه‌های worker
+# تقسیم می‌کند (هر کدام event loop، pool های YoutubeDL و session Pyrogram خودش را دارد)؛ صفر = تک پروسه‌ای
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '0'))
+# تقسیم کارها: user (ترتیب و محدودیت‌های هر کاربر در یک پروسه) یا media (cache و dedup محلی برای محتوای تکراری)
+SHARD_BY = os.getenv('SHARD_BY', 'user').strip().lower()
+# شماره این پروسه worker (توسط supervisor تنظیم می‌شود؛ خالی = پروسه اصلی)
+WORKER_INDEX = int(os.environ['WORKER_INDEX']) if os.getenv('WORKER_INDEX', '').strip() else None
+SUPERVISOR_MODE = WORKER_PROCESSES > 0 and WORKER_INDEX is None
+# فاصله بررسی تغییر ژورنال (PRAGMA data_version، بدون قفل) توسط پروسه‌های worker (ثانیه)
+DISPATCH_POLL_INTERVAL = 0.1
+# مهلت تخلیه آرام پس از SIGTERM: کارهای در حال اجرا تا این مدت فرصت تمام شدن دارند و بقیه با
+# checkpoint ژورنال به نمونه جدید سپرده می‌شوند (ثانیه؛ کمتر از مهلت kill در orchestrator)
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '60'))
+# شناسه این نمونه ربات (مالک کارها در ژورنال)؛ پروسه‌های worker شناسه supervisor را به ارث می‌برند
+INSTANCE_ID = os.getenv('INSTANCE_ID', '').strip() or f'{socket.gethostname()}-{os.getpid()}-{int(time.time())}'
+
+# کنترل پذیرش: سقف کارهای همزمان، سقف هر کاربر، نرخ درخواست و اندازه صف سراسری
+MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', '5'))
+MAX_JOBS_PER_USER = int(os.getenv('MAX_JOBS_PER_USER', '2'))
+MAX_QUEUED_JOBS = int(os.getenv('MAX_QUEUED_JOBS', '50'))
+USER_RATE_PER_MIN = float(os.getenv('USER_RATE_PER_MIN', '6'))
+USER_BURST = float(os.getenv('USER_BURST', '5'))
+# ضریب aging در زمان‌بندی کوتاه‌ترین کار اول (ثانیه امتیاز به ازای هر ثانیه انتظار)
+SJF_AGING = float(os.getenv('SJF_AGING', '1.0'))
+
+# مرحله آپلود جدا از دانلود: تعداد worker ها، ظرفیت صف تحویل و تعداد تلاش‌های ارسال
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '3'))
+UPLOAD_QUEUE_SIZE = int(os.getenv('UPLOAD_QUEUE_SIZE', '5'))
+UPLOAD_RETRIES = int(os.getenv('UPLOAD_RETRIES', '3'))
+# هر worker دانلود (ارسال مستقیم) و آپلود می‌تواند یک اتصال Bot API را دقیقه‌ها نگه دارد؛
+# اتصال‌های اضافه برای ویرایش پیام‌های وضعیت تا این پیام‌ها با pool timeout گم نشوند
+TELEGRAM_POOL_SIZE = MAX_CONCURRENT_JOBS + UPLOAD_WORKERS + int(os.getenv('TELEGRAM_EXTRA_CONNECTIONS', '8'))
+
+# مدیریت پهنای باند (MB/s، صفر = بدون محدودیت) و سقف اتصال/سرعت هر هاست
+INGRESS_LIMIT_MB_S = float(os.getenv('INGRESS_LIMIT_MB_S', '0'))
+EGRESS_LIMIT_MB_S = float(os.getenv('EGRESS_LIMIT_MB_S', '0'))
+HOST_MAX_CONNECTIONS = int(os.getenv('HOST_MAX_CONNECTIONS', '4'))
+HOST_RATE_LIMIT_MB_S = float(os.getenv('HOST_RATE_LIMIT_MB_S', '0'))
+
+# آدرس سرور Bot API (خالی = api.telegram.org)، مثال: http://127.0.0.1:8081/bot
+BOT_API_URL = os.getenv('BOT_API_URL', '').strip()
+# سرور Bot API محلی (telegram-bot-api --local روی همین میزبان یا volume مشترک): آپلود تا 2000MB با مسیر
+# فایل به جای multipart و بدون نیاز به Pyrogram؛ پوشه downloads باید با همین مسیر برای سرور قابل خواندن باشد
+BOT_API_LOCAL = os.getenv('BOT_API_LOCAL', 'false').strip().lower() in ('1','true','yes','on')
+BOT_API_FILE_URL = os.getenv('BOT_API_FILE_URL', '').strip() or (
+    BOT_API_URL[:-len('/bot')] + '/file/bot' if BOT_API_URL.endswith('/bot') else ''
+)
+# سقف آپلود با Bot API؛ فایل‌های بزرگ‌تر با Pyrogram (MTProto) ارسال می‌شوند
+CLOUD_UPLOAD_LIMIT = 50 * 1024 * 1024
+BOT_API_UPLOAD_LIMIT = 2000 * 1024 * 1024 if BOT_API_LOCAL else CLOUD_UPLOAD_LIMIT
+
+# حالت دریافت آپدیت‌ها: polling (برای توسعه محلی) یا webhook (سرور aiohttp روی همان event loop)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').strip()  # آدرس عمومی سرور، مثال: https://mybot.onrender.com
+BOT_MODE = os.getenv('BOT_MODE', 'webhook' if WEBHOOK_URL else 'polling').strip().lower()
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '').strip()
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# پایش event loop: فاصله نمونه‌برداری، آستانه ثبت stack مسدودکننده و آستانه هشدار p95 (ثانیه)
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.25'))
+LOOP_BLOCK_THRESHOLD = float(os.getenv('LOOP_BLOCK_THRESHOLD', '0.5'))
+LOOP_ALERT_P95 = float(os.getenv('LOOP_ALERT_P95', '0.2'))
+LOOP_ALERT_COOLDOWN = float(os.getenv('LOOP_ALERT_COOLDOWN', '900'))
+# سقف مدت /profile (ثانیه)؛ thread نمونه‌برداری تا پایان مدت با GIL رقابت می‌کند
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '120'))
+
+# بودجه حافظه (MB): کارهای جدید تا وقتی مصرف پیش‌بینی شده از آن بیشتر باشد در صف می‌مانند.
+# خالی = 80% سقف حافظه container (cgroup)، صفر = غیرفعال
+MEMORY_BUDGET_MB = os.getenv('MEMORY_BUDGET_MB', '').strip()
+MEMORY_SAMPLE_INTERVAL = float(os.getenv('MEMORY_SAMPLE_INTERVAL', '1.0'))
+
+# بارگذاری yt-dlp و Pyrogram در پس‌زمینه پس از شروع پاسخ‌گویی ربات (تا اولین کار منتظر import نماند)
+WARMUP_IMPORTS = os.getenv('WARMUP_IMPORTS', 'true').strip().lower() in ('1','true','yes','on')
+WARMUP_DELAY = float(os.getenv('WARMUP_DELAY', '5'))
+PROCESS_STARTED = time.time()
 
 # محدودیت حجم فایل (MB) - برای جلوگیری از OOM در render.com
 MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', '2000'))  # پیش‌فرض 2000MB (2GB)
@@ -40,8 +168,28 @@ MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', '2000'))  # پیش‌فرض
 # آیدی ادمین
 ADMIN_ID = 818185073
 
-# ذخیره موقت کاربران فعال (در حافظه - بدون دیتابیس)
-active_users = {}  # {user_id: {'username': str, 'first_name': str, 'last_request': datetime}}
+# ذخیره موقت کاربران فعال (در حافظه - بدون دیتابیس)؛ قدیمی‌ترین‌ها پس از رسیدن به سقف حذف می‌شوند
+MAX_TRACKED_USERS = int(os.getenv('MAX_TRACKED_USERS', '10000'))
+active_users = OrderedDict()  # {user_id: {'username': str, 'first_name': str, 'last_request': datetime}}
+
+# مهلت دانلود مستقیم (ثانیه)؛ دانلود ویدیو دو برابر این مقدار فرصت دارد
+DOWNLOAD_TIMEOUT = int(os.getenv('DOWNLOAD_TIMEOUT', '300'))
+
+# فایل‌های مستقیم کوچک‌تر از این حجم (MB) در حافظه نگه داشته و بدون دیسک آپلود می‌شوند؛ صفر = غیرفعال
+SPOOL_MAX_MB = float(os.getenv('SPOOL_MAX_MB', '20'))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# پس‌پردازش اختیاری ویدیوهای روی دیسک پیش از آپلود با ffmpeg/ffprobe: moov به ابتدای فایل (پخش stream)،
+# مدت و ابعاد برای send_video و thumbnail
+POSTPROCESS = os.getenv('POSTPROCESS', 'false').strip().lower() in ('1','true','yes','on')
+POSTPROCESS_WORKERS = int(os.getenv('POSTPROCESS_WORKERS', '2'))
+# ویدیوهای کوچک‌تر از این حجم (MB) بدون پس‌پردازش ارسال می‌شوند تا هزینه آن بر کارهای کوچک غالب نشود
+POSTPROCESS_MIN_MB = float(os.getenv('POSTPROCESS_MIN_MB', '2'))
+# حداکثر زمان پس‌پردازش هر فایل (ثانیه)؛ پس از آن فایل بدون نتیجه پس‌پردازش ارسال می‌شود
+POSTPROCESS_TIMEOUT = float(os.getenv('POSTPROCESS_TIMEOUT', '30'))
+# تبدیل GIF به mp4 بی‌صدا (با ffmpeg) وقتی تبدیل و آپلود mp4 سریع‌تر از آپلود GIF خام پیش‌بینی شود
+GIF_TO_MP4 = os.getenv('GIF_TO_MP4', 'true').strip().lower() in ('1','true','yes','on')
+GIF_TO_MP4_TIMEOUT = float(os.getenv('GIF_TO_MP4_TIMEOUT', '60'))
 
 # تنظیمات لاگ
 logging.basicConfig(
@@ -60,16 +208,138 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 API_ID = os.getenv('API_ID')
 API_HASH = os.getenv('API_HASH')
 
+# اگر secret مشخص نشده، از روی توکن ساخته می‌شود تا بین ری‌استارت‌ها ثابت بماند
+if not WEBHOOK_SECRET and BOT_TOKEN:
+    WEBHOOK_SECRET = hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+
 # پوشه موقت برای ذخیره فایل‌ها
 DOWNLOAD_FOLDER = "downloads"
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
+# پوشه داده‌های ماندگار (جدا از downloads که مرتباً پاکسازی می‌شود)
+DATA_FOLDER = os.getenv('DATA_FOLDER', 'data')
+os.makedirs(DATA_FOLDER, exist_ok=True)
+
+
+def process_file(name: str) -> str:
+    """نام فایل داده این پروسه؛ پروسه‌های worker فایل جداگانه دارند تا ذخیره‌ها روی هم نوشته نشوند"""
+    if WORKER_INDEX is None:
+        return name
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.w{WORKER_INDEX}{ext}'
+
+
+direct_send_advisor = DirectSendAdvisor(
+    os.path.join(DATA_FOLDER, process_file('direct_send_stats.json')),
+    min_samples=DIRECT_SEND_MIN_SAMPLES,
+    good_ratio=DIRECT_SEND_GOOD_RATIO,
+    bad_ratio=DIRECT_SEND_BAD_RATIO,
+)
+content_index = ContentIndex(os.path.join(DATA_FOLDER, process_file('content_index.json')), max_entries=CONTENT_INDEX_MAX)
+job_journal = JobJournal(os.path.join(DATA_FOLDER, 'jobs.db') if JOB_JOURNAL else '')
+
 # ایجاد Pyrogram client برای فایل‌های بزرگ (بیشتر از 50MB)
 pyrogram_client = None
 pyrogram_client_lock = None
 
 # Executor برای اجرای کارهای blocking
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(5, MAX_CONCURRENT_JOBS))
+# thread اختصاصی ژورنال: نوشتن‌ها به ترتیب ثبت و بدون انتظار event loop برای قفل SQLite
+# (که ممکن است دست پروسه دیگری باشد) و بدون رقابت با دانلودهای executor
+journal_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal')
+# heartbeat نمونه در thread خودش: executor پر از دانلود یا thread ژورنال منتظر قفل نباید باعث شود
+# نمونه‌های دیگر این نمونه را مرده بدانند و کارهایش را بردارند
+heartbeat_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='heartbeat')
+# حداکثر پس‌پردازش‌های همزمان (هر کدام پروسه‌های ffmpeg/ffprobe خودش را دارد)
+postprocess_slots = asyncio.Semaphore(POSTPROCESS_WORKERS)
+# انتخاب بین آپلود GIF خام و تبدیل به mp4
+animation_cost = media.AnimationCost()
+# سرعت آپلود فرضی (بایت در ثانیه) تا وقتی آمار مرحله آپلود خالی است
+DEFAULT_UPLOAD_RATE = 2 * 1024 * 1024
+
+# کنترل مصرف حافظه پیش از آنکه container به خاطر OOM کشته شود
+# (در حالت supervisor بودجه بین پروسه‌های worker تقسیم می‌شود)
+memory_governor = MemoryGovernor(
+    budget=(
+        int(float(MEMORY_BUDGET_MB) * 1024 * 1024) if MEMORY_BUDGET_MB else int(container_memory_limit() * 0.8)
+    ) // (WORKER_PROCESSES if WORKER_INDEX is not None else 1),
+    interval=MEMORY_SAMPLE_INTERVAL,
+)
+
+# نمونه‌های ماندگار YoutubeDL (برای هر worker یکی برای استخراج و یکی برای دانلود)
+ytdl_pool = YoutubeDLPool(
+    lambda opts: yt_dlp.YoutubeDL(opts),
+    max_idle=MAX_CONCURRENT_JOBS * 2,
+    max_uses=YTDLP_POOL_MAX_USES,
+    on_checkout=lambda reused: CACHE_REQUESTS.inc(cache='ytdl_pool', result='hit' if reused else 'miss'),
+)
+
+# اطلاعات استخراج شده ویدیوها؛ درخواست دوباره همان ویدیو بدون صفحه، player و manifest
+info_cache = InfoCache(
+    INFO_CACHE_MB * 1024 * 1024,
+    default_ttl=INFO_CACHE_TTL,
+    on_lookup=lambda result: CACHE_REQUESTS.inc(cache='info', result=result),
+)
+
+# صف منصفانه کارها و worker هایی که آن را پردازش می‌کنند
+admission = AdmissionController(
+    max_active=MAX_CONCURRENT_JOBS,
+    per_user_active=MAX_JOBS_PER_USER,
+    max_queued=MAX_QUEUED_JOBS,
+    user_rate_per_min=USER_RATE_PER_MIN,
+    user_burst=USER_BURST,
+    aging=SJF_AGING,
+    memory=memory_governor,
+)
+background_tasks = []
+worker_tasks = []  # worker های دانلود و آپلود (هنگام تخلیه جدا از بقیه لغو می‌شوند)
+worker_processes = {}  # {shard: asyncio.subprocess.Process} در حالت supervisor
+# آخرین وضعیت منتشرشده پروسه‌های worker (متریک‌ها، آمار و سلامت event loop) {shard: dict}؛ در حالت
+# supervisor پنل ادمین، /loop و /metrics پروسه اصلی از این‌ها همه پروسه‌ها را نشان می‌دهند
+worker_snapshots = {}
+WORKER_SNAPSHOT_FOLDER = os.path.join(DATA_FOLDER, 'workers')
+# کارهایی که شروع شده‌اند و هنوز تحویل نشده یا شکست نخورده‌اند {job_id: Job}
+in_flight = {}
+
+# وضعیت چرخه عمر برای /health و /ready و تخلیه آرام هنگام deploy
+lifecycle = Lifecycle(DRAIN_TIMEOUT)
+# فاصله heartbeat نمونه در ژورنال و بررسی کارهای سپرده شده یا بی‌مالک (ثانیه)
+HEARTBEAT_INTERVAL = 5.0
+ADOPT_INTERVAL = 10.0
+
+# سرور HTTP (health و webhook) که روی event loop ربات اجرا می‌شود
+http_runner = None
+webhook_receiver = None
+
+loop_monitor = LoopMonitor(
+    interval=LOOP_LAG_INTERVAL,
+    block_threshold=LOOP_BLOCK_THRESHOLD,
+    alert_threshold=LOOP_ALERT_P95,
+    alert_cooldown=LOOP_ALERT_COOLDOWN,
+    on_block=lambda duration, stack: LOOP_BLOCKS.inc(),
+)
+
+# snapshot های حافظه (tracemalloc فقط با اولین /memsnap فعال می‌شود)
+memory_tracker = MemoryTracker()
+profile_lock = asyncio.Lock()
+
+# صف محدود فایل‌های آماده بین worker های دانلود و آپلود (در on_startup ساخته می‌شود)
+upload_queue = None
+download_stage = StageStats('download', MAX_CONCURRENT_JOBS)
+upload_stage = StageStats('upload', UPLOAD_WORKERS)
+
+# پهنای باند مشترک بین دانلودهای مستقیم، yt-dlp و آپلودهای Pyrogram
+bandwidth = BandwidthManager(
+    ingress_limit=INGRESS_LIMIT_MB_S * 1024 * 1024,
+    egress_limit=EGRESS_LIMIT_MB_S * 1024 * 1024,
+    host_connections=HOST_MAX_CONNECTIONS,
+    host_rate_limit=HOST_RATE_LIMIT_MB_S * 1024 * 1024,
+)
+
+# فایل‌های ناتمام جوان‌تر از این مقدار ممکن است متعلق به کارهای در حال اجرا باشند
+PARTIAL_FILE_MAX_AGE = 900
+# کارهای ناتمام قدیمی‌تر از این مقدار پس از restart ادامه داده نمی‌شوند (کاربر احتمالاً منتظر نیست)
+RESUME_MAX_AGE = 6 * 3600
 
 async def init_pyrogram_lock():
     """Initialize the asyncio lock for Pyrogram client"""
@@ -89,8 +359,8 @@ async def get_pyrogram_client():
         
         async with pyrogram_client_lock:
             if pyrogram_client is None:
-                pyrogram_client = Client(
-                    "file_downloader_bot",
+                pyrogram_client = pyrogram.Client(
+                    process_file("file_downloader_bot"),
                     api_id=int(API_ID),
                     api_hash=API_HASH,
                     bot_token=BOT_TOKEN,
@@ -101,12 +371,54 @@ async def get_pyrogram_client():
         logger.error(f"خطا در ایجاد Pyrogram client: {e}")
         return None
 
+async def get_started_pyrogram_client():
+    """Pyrogram client متصل (یکبار start می‌شود و بین آپلودهای همزمان مشترک است)"""
+    client = await get_pyrogram_client()
+    if client is None:
+        return None
+    async with pyrogram_client_lock:
+        if not client.is_connected:
+            await asyncio.wait_for(client.start(), timeout=30)
+            PYROGRAM_SESSIONS.set(1, state='connected')
+    return client
+
+
+@contextmanager
+def track_pyrogram_upload():
+    """شمارش آپلودهای همزمان روی session مشترک Pyrogram"""
+    PYROGRAM_SESSIONS.inc(state='uploading')
+    try:
+        yield
+    finally:
+        PYROGRAM_SESSIONS.dec(state='uploading')
+
+
+async def stop_pyrogram_client():
+    """بستن اتصال Pyrogram هنگام خاموش شدن"""
+    try:
+        if pyrogram_client is not None and pyrogram_client.is_connected:
+            await asyncio.wait_for(pyrogram_client.stop(), timeout=10)
+            PYROGRAM_SESSIONS.set(0, state='connected')
+    except Exception as e:
+        logger.warning(f"نتوانستند Pyrogram client را بسته کنید: {e}")
+
+
+def protected_prefixes() -> tuple:
+    """
+    پیشوند فایل‌های کارهای ناتمام ژورنال که نباید پاک شوند
+
+    علاوه بر خود فایل، .part/.ytdl و فرمت‌های جداگانه yt-dlp همان نام (Title.f137.mp4) را هم شامل می‌شود.
+    """
+    return tuple(os.path.splitext(path)[0] + '.' for path in job_journal.active_files())
+
+
 def cleanup_old_files():
     """پاکسازی فایل‌های قدیمی از پوشه downloads"""
     try:
         now = datetime.now()
+        protected = protected_prefixes()
         for filepath in glob.glob(os.path.join(DOWNLOAD_FOLDER, '*')):
-            if os.path.isfile(filepath):
+            if os.path.isfile(filepath) and not filepath.startswith(protected):
                 file_age = now - datetime.fromtimestamp(os.path.getmtime(filepath))
                 if file_age > timedelta(hours=1):
                     try:
@@ -117,13 +429,117 @@ def cleanup_old_files():
     except Exception as e:
         logger.error(f"خطا در cleanup: {e}")
 
-def cleanup_partial_files():
-    """حذف فایل‌های ناتمام (.part, .ytdl, .temp)"""
+def track_active_user(user):
+    """ثبت کاربر و آخرین درخواست او (با سقف MAX_TRACKED_USERS)"""
+    active_users[user.id] = {
+        'username': user.username or 'بدون یوزرنیم',
+        'first_name': user.first_name or 'نامشخص',
+        'last_request': datetime.now()
+    }
+    active_users.move_to_end(user.id)
+    while len(active_users) > MAX_TRACKED_USERS:
+        active_users.popitem(last=False)
+
+
+async def run_transfer(func, *args, timeout: float):
+    """
+    اجرای انتقال blocking در executor با لغو همکارانه
+
+    asyncio.wait_for نمی‌تواند thread را متوقف کند؛ با timeout یا cancel، رویداد لغو set می‌شود
+    و thread در اولین consume بعدی با TransferCancelled خارج می‌شود (به جای ادامه دانلود در پس‌زمینه).
+    """
+    cancel = threading.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(executor, func, *args, cancel), timeout=timeout)
+    except BaseException:
+        cancel.set()
+        raise
+
+
+async def journal_call(method, *args, **kwargs):
+    """اجرای یک عملیات ژورنال کارها (job_journal) در thread اختصاصی آن"""
+    return await asyncio.get_running_loop().run_in_executor(journal_executor, partial(method, *args, **kwargs))
+
+
+def journal_checkpoint(journal_id: int, filepath: str, offset: int, validator: str = ''):
+    """
+    checkpoint دانلود از thread دانلود بدون انتظار
+
+    نوشتن به ترتیب در thread ژورنال انجام می‌شود (پیش از finish همان کار)؛ دانلود پشت claim و adopt
+    که ممکن است منتظر قفل نوشتن SQLite پروسه‌های دیگر باشند نمی‌ماند.
+    """
+    if job_journal.checkpoint_due(journal_id, offset, validator):
+        try:
+            journal_executor.submit(job_journal.progress, journal_id, filepath, offset, validator)
+        except RuntimeError:
+            # توقف ربات: thread ژورنال بسته شده
+            pass
+
+
+def cleanup_downloads():
+    """پاکسازی فایل‌های قدیمی و ناتمام رها‌شده (برای اجرا در executor)"""
+    cleanup_old_files()
+    cleanup_partial_files(PARTIAL_FILE_MAX_AGE)
+
+
+def _cleanup_failed_download(filepath=None, old_files: bool = False):
+    discard_download(filepath)
+    cleanup_partial_files(PARTIAL_FILE_MAX_AGE)
+    if old_files:
+        cleanup_old_files()
+
+
+async def cleanup_failed_download(filepath=None, old_files: bool = False):
+    """
+    حذف فایل (یا buffer) دانلود ناموفق و فایل‌های ناتمام رها‌شده در executor
+
+    glob پوشه دانلود، پرس‌وجوی ژورنال و حذف فایل‌های بزرگ روی event loop اجرا نمی‌شوند.
+    """
+    await asyncio.get_running_loop().run_in_executor(executor, _cleanup_failed_download, filepath, old_files)
+
+
+def startup_maintenance():
+    """پاکسازی فایل‌های قدیمی، ناتمام و لینک‌های منقضی (در پس‌زمینه پس از شروع ربات، در executor)"""
+    started = time.perf_counter()
+    cleanup_old_files()
+    # فقط فایل‌های ناتمامی که پیش از شروع این پروسه ساخته شده‌اند
+    cleanup_partial_files(time.time() - PROCESS_STARTED)
+    cleanup_old_links()
+    job_journal.prune()
+    logger.info(f"🧹 پاکسازی شروع کار در {time.perf_counter() - started:.2f}s انجام شد")
+
+
+async def warmup_imports():
+    """بارگذاری ماژول‌های سنگین پس از اینکه ربات پاسخ‌گو شد"""
+    await asyncio.sleep(WARMUP_DELAY)
+    loop = asyncio.get_running_loop()
+    # با سرور Bot API محلی Pyrogram استفاده نمی‌شود
+    for module in (yt_dlp,) if BOT_API_LOCAL else (yt_dlp, pyrogram):
+        if not module.loaded:
+            await loop.run_in_executor(executor, module.load)
+            logger.info(f"🔥 {module!r} در {module.load_seconds:.2f}s پیش‌بارگذاری شد")
+    # compile کردن regex استخراج‌کننده‌ها تا تشخیص هویت لینک‌ها روی event loop ارزان باشد
+    started = time.perf_counter()
+    await loop.run_in_executor(executor, media_resolver.warm)
+    logger.info(f"🔥 تطبیق آفلاین استخراج‌کننده‌ها در {time.perf_counter() - started:.2f}s آماده شد")
+
+
+def cleanup_partial_files(min_age_seconds: float = 0):
+    """حذف فایل‌های ناتمام (.part, .ytdl, .temp) قدیمی‌تر از min_age_seconds"""
     try:
         patterns = ['*.part', '*.ytdl', '*.temp', '*.tmp']
+        now = time.time()
+        # فایل‌های ناتمام کارهایی که پس از restart ادامه داده می‌شوند
+        protected = protected_prefixes()
         for pattern in patterns:
             for filepath in glob.glob(os.path.join(DOWNLOAD_FOLDER, pattern)):
+                if filepath.startswith(protected):
+                    continue
                 try:
+                    # فایل‌های ناتمام کارهای همزمان دیگر را حذف نکن
+                    if min_age_seconds and now - os.path.getmtime(filepath) < min_age_seconds:
+                        continue
                     os.remove(filepath)
                     logger.info(f"فایل ناتمام حذف شد: {filepath}")
                 except Exception as e:
@@ -150,6 +566,7 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("👥 مشاهده کاربران", callback_data="admin_users")],
         [InlineKeyboardButton("📊 آمار ربات", callback_data="admin_stats")],
+        [InlineKeyboardButton("📶 پهنای باند", callback_data="admin_bandwidth")],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -213,12 +630,126 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"📊 محدودیت حجم: {MAX_FILE_SIZE_MB} MB\n"
         )
         
+        # وضعیت صف کارها
+        queue_stats = admission.stats()
+        stats_text += (
+            f"\n⚙️ کارهای در حال اجرا: {queue_stats['active']}/{MAX_CONCURRENT_JOBS}\n"
+            f"🕒 در صف: {queue_stats['queued']}/{MAX_QUEUED_JOBS}\n"
+            f"⛔ رد شده: {queue_stats['rejected']}\n"
+            f"⏱ میانگین مدت هر کار: {queue_stats['avg_duration']:.0f}s\n"
+        )
+        stats_text += (
+            f"⏬ دانلود: {download_stage.summary()}\n"
+            f"⏫ آپلود: {upload_stage.summary()}\n"
+            f"📦 صف تحویل: {upload_queue.qsize() if upload_queue else 0}/{UPLOAD_QUEUE_SIZE}\n"
+        )
+        lag = loop_monitor.percentiles()
+        stats_text += (
+            f"🔁 تاخیر event loop: p95 {lag['0.95'] * 1000:.0f}ms، "
+            f"{loop_monitor.block_count} مسدودی (/loop)\n"
+        )
+        memory = memory_governor.stats()
+        stats_text += f"🧠 حافظه: {memory['rss'] / (1024 * 1024):.0f} MB"
+        if memory_governor.enabled:
+            throttled = sum(memory['throttled'].values())
+            stats_text += (
+                f" از بودجه {memory['budget'] / (1024 * 1024):.0f} MB، "
+                f"{throttled} کار معطل حافظه ({memory['throttled_seconds']:.0f}s)، {memory['waiting']} در انتظار"
+            )
+        stats_text += "\n"
+        pool = ytdl_pool.stats()
+        stats_text += (
+            f"♻️ YoutubeDL: {pool['reused']} استفاده مجدد، {pool['created']} ساخته شده، "
+            f"{pool['idle']} بیکار\n"
+        )
+        dedup = content_index.stats()
+        stats_text += (
+            f"🧬 فایل تکراری: {dedup['hits']} ارسال با file_id (نرخ {dedup['hit_rate'] * 100:.0f}%)، "
+            f"{dedup['saved_bytes'] / (1024 * 1024):.0f} MB آپلود صرفه‌جویی شد\n"
+        )
+        animations = animation_cost.stats()
+        if animations['converted'] or animations['kept']:
+            stats_text += (
+                f"🎞 GIF: {animations['converted']} تبدیل به mp4 (حجم {animations['ratio'] * 100:.0f}% GIF)، "
+                f"{animations['kept']} بدون تبدیل، {animations['saved_bytes'] / (1024 * 1024):.0f} MB کمتر آپلود شد\n"
+            )
+        journaled = await journal_call(job_journal.stats)
+        if job_journal.enabled:
+            stats_text += (
+                f"📒 ژورنال کارها: {journaled['unfinished']} ناتمام، "
+                f"{journaled['resumed']} کار پس از restart ادامه داده شد\n"
+            )
+        if SUPERVISOR_MODE:
+            alive = sum(1 for process in worker_processes.values() if process.returncode is None)
+            stats_text += f"👷 پروسه‌های worker: {alive}/{WORKER_PROCESSES} (تقسیم بر اساس {SHARD_BY})\n"
+            for index, snapshot in sorted(worker_snapshots.items()):
+                worker_queue = snapshot['admission']
+                pool = snapshot['ytdl_pool']
+                stats_text += (
+                    f"• worker {index} (pid {snapshot['pid']}): ⚙️ {worker_queue['active']}/{MAX_CONCURRENT_JOBS} فعال، "
+                    f"{worker_queue['queued']} در صف، 🔁 p95 {snapshot['loop']['lag']['0.95'] * 1000:.0f}ms، "
+                    f"{snapshot['loop']['blocks']} مسدودی، 🧠 {snapshot['rss'] / (1024 * 1024):.0f} MB\n"
+                    f"   ⏬ {snapshot['download']}\n"
+                    f"   ⏫ {snapshot['upload']}\n"
+                    f"   ♻️ YoutubeDL {pool['reused']}/{pool['created']}، "
+                    f"🧬 {snapshot['dedup']['hits']} ارسال با file_id، "
+                    f"🗂 hit {snapshot['info_cache']['hit_rate'] * 100:.0f}%\n"
+                )
+        cached = info_cache.stats()
+        stats_text += (
+            f"🗂 cache اطلاعات ویدیو: {cached['entries']} ورودی، {cached['bytes'] / (1024 * 1024):.1f} MB، "
+            f"نرخ hit {cached['hit_rate'] * 100:.0f}%\n"
+        )
+        completion = admission.completion_stats()
+        if completion:
+            stats_text += "\n⏳ میانگین زمان تکمیل بر اساس حجم:\n"
+            for class_name, (count, mean_seconds) in completion.items():
+                stats_text += f"• {class_name}: {mean_seconds:.1f}s ({count} کار)\n"
+        
+        # آمار ارسال مستقیم پرتکرارترین هاست‌ها
+        direct_hosts = direct_send_advisor.summary(5)
+        if direct_hosts:
+            stats_text += "\n📡 ارسال مستقیم (موفق/ناموفق):\n"
+            for host, host_stats in direct_hosts:
+                stats_text += (
+                    f"• {host}: {host_stats.get('success', 0):.0f}/{host_stats.get('failure', 0):.0f}"
+                    f" ({host_stats.get('latency') or 0:.1f}s)\n"
+                )
+        
         # دکمه بازگشت
         keyboard = [[InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await query.edit_message_text(stats_text, reply_markup=reply_markup)
     
+    elif query.data == "admin_bandwidth":
+        # نمایش سرعت زنده هر انتقال
+        def format_rate(value):
+            return f"{value / (1024 * 1024):.2f} MB/s" if value else "∞"
+        
+        bandwidth_text = (
+            "📶 پهنای باند\n\n"
+            f"⬇️ ورودی: {format_rate(bandwidth.total_rate(INGRESS))} از {format_rate(bandwidth.limits[INGRESS])}\n"
+            f"⬆️ خروجی: {format_rate(bandwidth.total_rate(EGRESS))} از {format_rate(bandwidth.limits[EGRESS])}\n"
+            f"🔌 سقف اتصال هر هاست: {HOST_MAX_CONNECTIONS} (انتظار: {bandwidth.connection_waits})\n\n"
+        )
+        streams = bandwidth.snapshot()
+        if not streams:
+            bandwidth_text += "📭 انتقال فعالی وجود ندارد."
+        for info in streams[:20]:
+            arrow = "⬇️" if info['direction'] == INGRESS else "⬆️"
+            bandwidth_text += (
+                f"{arrow} کار {info['job_id']} - {info['host']}\n"
+                f"   {format_rate(info['rate'])} (سهم: {format_rate(info['allocation'])})"
+                f" - {info['bytes'] / (1024 * 1024):.1f} MB در {info['elapsed']:.0f}s\n"
+            )
+        
+        # دکمه بازگشت
+        keyboard = [[InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.edit_message_text(bandwidth_text, reply_markup=reply_markup)
+    
     elif query.data == "admin_back":
         # بازگشت به منوی اصلی
         total_users = len(active_users)
@@ -226,6 +757,7 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         keyboard = [
             [InlineKeyboardButton("👥 مشاهده کاربران", callback_data="admin_users")],
             [InlineKeyboardButton("📊 آمار ربات", callback_data="admin_stats")],
+            [InlineKeyboardButton("📶 پهنای باند", callback_data="admin_bandwidth")],
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -238,12 +770,16 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(admin_text, reply_markup=reply_markup)
 
 
-def save_user_link(user_id: int, url: str, timestamp: str):
-    """ذخیره لینک کاربر در فایل متنی"""
+# بازنویسی فایل لینک‌ها در پاکسازی نباید با افزودن همزمان لینک جدید تداخل کند
+links_lock = threading.Lock()
+
+
+def save_user_link(user_id: int, url: str, timestamp: str, key: str = ''):
+    """ذخیره لینک کاربر در فایل متنی (key: هویت یکتای محتوا از canonicalize)"""
     try:
         log_file = os.path.join(DOWNLOAD_FOLDER, 'user_links.txt')
-        with open(log_file, 'a', encoding='utf-8') as f:
-            f.write(f"{user_id}|{url}|{timestamp}\n")
+        with links_lock, open(log_file, 'a', encoding='utf-8') as f:
+            f.write(f"{user_id}|{url}|{timestamp}|{key}\n" if key else f"{user_id}|{url}|{timestamp}\n")
     except Exception as e:
         logger.error(f"خطا در ذخیره لینک: {e}")
 
@@ -259,12 +795,14 @@ def get_user_links(user_id: int):
         with open(log_file, 'r', encoding='utf-8') as f:
             for line in f:
                 parts = line.strip().split('|')
-                if len(parts) == 3:
-                    uid, url, timestamp = parts
+                # خطوط قدیمی سه بخشی هستند و خطوط جدید کلید هویت محتوا را هم دارند
+                if len(parts) in (3, 4):
+                    uid, url, timestamp = parts[:3]
                     if int(uid) == user_id:
                         user_links.append({
                             'url': url,
-                            'date': timestamp
+                            'date': timestamp,
+                            'key': parts[3] if len(parts) == 4 else url,
                         })
         return user_links
     except Exception as e:
@@ -289,8 +827,8 @@ async def check_and_notify_expiring_links(bot):
         with open(log_file, 'r', encoding='utf-8') as f:
             for line in f:
                 parts = line.strip().split('|')
-                if len(parts) == 3:
-                    uid, url, timestamp = parts
+                if len(parts) in (3, 4):
+                    uid, url, timestamp = parts[:3]
                     try:
                         link_date = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
                         
@@ -354,26 +892,27 @@ def cleanup_old_links():
         now = datetime.now()
         one_month_ago = now - timedelta(days=30)
         
-        with open(log_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                parts = line.strip().split('|')
-                if len(parts) == 3:
-                    uid, url, timestamp = parts
-                    try:
-                        # تبدیل timestamp به datetime
-                        link_date = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-                        
-                        # فقط لینک‌های کمتر از 1 ماه را نگه دار
-                        if link_date > one_month_ago:
+        with links_lock:
+            with open(log_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.strip().split('|')
+                    if len(parts) in (3, 4):
+                        uid, url, timestamp = parts[:3]
+                        try:
+                            # تبدیل timestamp به datetime
+                            link_date = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+                            
+                            # فقط لینک‌های کمتر از 1 ماه را نگه دار
+                            if link_date > one_month_ago:
+                                valid_links.append(line.strip())
+                        except ValueError:
+                            # اگر فرمت تاریخ اشتباه بود، نگه دار
                             valid_links.append(line.strip())
-                    except ValueError:
-                        # اگر فرمت تاریخ اشتباه بود، نگه دار
-                        valid_links.append(line.strip())
-        
-        # نوشتن لینک‌های معتبر به فایل
-        with open(log_file, 'w', encoding='utf-8') as f:
-            for link in valid_links:
-                f.write(link + '\n')
+            
+            # نوشتن لینک‌های معتبر به فایل
+            with open(log_file, 'w', encoding='utf-8') as f:
+                for link in valid_links:
+                    f.write(link + '\n')
         
         logger.info(f"پاکسازی لینک‌های قدیمی: {len(valid_links)} لینک باقی ماند")
     except Exception as e:
@@ -402,8 +941,9 @@ async def check_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ آیدی کاربر باید عدد باشد.")
         return
     
-    # خواندن لینک‌های کاربر از فایل
-    user_links = get_user_links(target_user_id)
+    # خواندن لینک‌های کاربر از فایل (در executor چون کل فایل پیمایش می‌شود)
+    loop = asyncio.get_running_loop()
+    user_links = await loop.run_in_executor(executor, get_user_links, target_user_id)
     
     if not user_links:
         await update.message.reply_text(
@@ -414,7 +954,7 @@ async def check_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ساخت پیام تاریخچه
     history_text = (
         f"🆔 آیدی کاربر: {target_user_id}\n"
-        f"📊 تعداد لینک‌ها: {len(user_links)}\n\n"
+        f"📊 تعداد لینک‌ها: {len(user_links)} ({len({link['key'] for link in user_links})} محتوای یکتا)\n\n"
         "📜 تاریخچه لینک‌ها:\n\n"
     )
     
@@ -435,15 +975,111 @@ async def check_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(history_text)
 
 
+async def loop_health(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش تاخیر event loop و آخرین callback مسدودکننده - فقط برای ادمین"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ شما دسترسی به این دستور ندارید.")
+        return
+    
+    lag = loop_monitor.percentiles()
+    loop_text = (
+        "⏱ سلامت event loop\n\n"
+        f"p50: {lag['0.5'] * 1000:.1f}ms\n"
+        f"p95: {lag['0.95'] * 1000:.1f}ms\n"
+        f"p99: {lag['0.99'] * 1000:.1f}ms\n"
+        f"بیشترین: {loop_monitor.max_lag * 1000:.0f}ms\n"
+        f"🚧 تعداد مسدود شدن (بیش از {LOOP_BLOCK_THRESHOLD}s): {loop_monitor.block_count}\n"
+    )
+    # در حالت supervisor کارها در پروسه‌های worker اجرا می‌شوند؛ event loop هر کدام جدا
+    blocks = [('', loop_monitor.blocks[-1])] if loop_monitor.blocks else []
+    for index, snapshot in sorted(worker_snapshots.items()):
+        lag = snapshot['loop']['lag']
+        loop_text += (
+            f"👷 worker {index}: p50 {lag['0.5'] * 1000:.1f}ms، p95 {lag['0.95'] * 1000:.1f}ms، "
+            f"p99 {lag['0.99'] * 1000:.1f}ms، بیشترین {snapshot['loop']['max_lag'] * 1000:.0f}ms، "
+            f"{snapshot['loop']['blocks']} مسدودی\n"
+        )
+        if snapshot['loop']['last_block']:
+            blocks.append((f" (worker {index})", snapshot['loop']['last_block']))
+    if blocks:
+        # جدیدترین مسدودی از بین همه پروسه‌ها
+        label, (timestamp, duration, stack) = max(blocks, key=lambda block: block[1][0])
+        loop_text += (
+            f"\n🕐 آخرین مسدودی{label}: {datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')}"
+            f" ({duration:.2f}s)\n\n{stack[-2500:]}"
+        )
+    await update.message.reply_text(loop_text[:4000])
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """پروفایل نمونه‌برداری پروسه برای N ثانیه و ارسال folded stacks - فقط برای ادمین"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ شما دسترسی به این دستور ندارید.")
+        return
+    
+    try:
+        seconds = float(context.args[0]) if context.args else 10
+    except ValueError:
+        seconds = 0
+    if not math.isfinite(seconds) or seconds <= 0:
+        await update.message.reply_text("❌ مدت نامعتبر است.\nمثال: /profile 30")
+        return
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    if profile_lock.locked():
+        await update.message.reply_text("⏳ یک پروفایل دیگر در حال اجراست.")
+        return
+    
+    async with profile_lock:
+        await update.message.reply_text(f"🔬 نمونه‌برداری به مدت {seconds:.0f} ثانیه...")
+        # thread جدا تا executor کارهای دانلود اشغال نشود
+        folded = await asyncio.to_thread(sample_stacks, seconds)
+    
+    samples = sum(folded.values())
+    caption = f"🔬 {samples} نمونه\n"
+    for frame, count in top_functions(folded, 5):
+        caption += f"• {count * 100 / max(samples, 1):.0f}% {frame}\n"
+    filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded"
+    await update.message.reply_document(
+        document=render_folded(folded),
+        filename=filename,
+        caption=caption[:1000],
+    )
+
+
+async def memsnap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """snapshot حافظه و مقایسه با snapshot قبلی (/memsnap stop برای توقف ردیابی) - فقط برای ادمین"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ شما دسترسی به این دستور ندارید.")
+        return
+    
+    if context.args and context.args[0] == 'stop':
+        text = memory_tracker.stop()
+    else:
+        # گرفتن snapshot روی حافظه بزرگ زمان‌بر است
+        loop = asyncio.get_running_loop()
+        text = await loop.run_in_executor(executor, memory_tracker.snapshot)
+    await update.message.reply_text(text[:4000])
+
+
+async def tasks_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """stack همه task های asyncio - فقط برای ادمین"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ شما دسترسی به این دستور ندارید.")
+        return
+    
+    dump = dump_tasks()
+    await update.message.reply_document(
+        document=dump.encode('utf-8'),
+        filename=f"tasks_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+        caption=dump.split('\n', 1)[0],
+    )
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """پیام خوش‌آمدگویی"""
     # ثبت کاربر در لیست فعال
     user = update.effective_user
-    active_users[user.id] = {
-        'username': user.username or 'بدون یوزرنیم',
-        'first_name': user.first_name or 'نامشخص',
-        'last_request': datetime.now()
-    }
+    track_active_user(user)
     welcome_message = (
         "سلام! 👋\n\n"
         "من یک ربات دانلود و ارسال فایل هستم.\n\n"
@@ -569,18 +1205,106 @@ def is_video_site(url: str) -> bool:
     return any(site in url_lower for site in video_sites)
 
 
-def _extract_video_info(url: str, ydl_opts: dict) -> dict:
-    """استخراج اطلاعات ویدیو (برای اجرا در executor)"""
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        return ydl.extract_info(url, download=False)
+def is_gif_site(url: str) -> bool:
+    """بررسی اینکه URL از سایت‌های GIF است"""
+    netloc = urlparse(url).netloc
+    return any(site in netloc for site in [
+        'gfycat', 'redgifs', 'myteenwebcam', 'thefapp', 'xgroovy',
+        'xgifer', 'hentaigifz', 'hardcoregify'
+    ])
+
+
+def _extract_video_info(url: str, ydl_opts: dict, headers: dict = None, canonical_url: str = None) -> dict:
+    """استخراج اطلاعات ویدیو و ذخیره آن در info_cache (برای اجرا در executor)"""
+    with ytdl_pool.checkout(ydl_opts, headers) as ydl:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False), remove_private_keys=True)
+    info_cache.put(info, url, canonical_url)
+    return info
+
+def is_expired_link_error(error) -> bool:
+    """خطای دانلودی که نشان می‌دهد لینک‌های امضاشده رسانه منقضی یا باطل شده‌اند"""
+    message = str(error)
+    return 'HTTP Error 403' in message or 'HTTP Error 410' in message
+
+def _bandwidth_progress_hook(stream):
+    """progress hook برای yt-dlp که بایت‌های دانلود شده را به مدیر پهنای باند گزارش می‌دهد"""
+    last_bytes = {}
+
+    def hook(d):
+        if d.get('status') != 'downloading':
+            return
+        key = d.get('tmpfilename') or d.get('filename')
+        downloaded = d.get('downloaded_bytes') or 0
+        delta = downloaded - last_bytes.get(key, 0)
+        last_bytes[key] = downloaded
+        if delta > 0:
+            stream.consume(delta)
+
+    return hook
+
+def _checkpoint_progress_hook(on_progress):
+    """
+    progress hook برای yt-dlp که مسیر و پیشرفت فایل را در ژورنال ثبت می‌کند
+
+    پس از restart همان فایل .part (با همان outtmpl) توسط yt-dlp از جایی که مانده ادامه داده می‌شود.
+    """
+    def hook(d):
+        if d.get('status') == 'downloading' and d.get('filename'):
+            on_progress(d['filename'], d.get('downloaded_bytes') or 0)
+
+    return hook
+
+def _hash_progress_hook(hasher):
+    """progress hook برای yt-dlp که محتوا را همزمان با دانلود hash می‌کند (dedup.TailHasher)"""
+    def hook(d):
+        if d.get('status') == 'downloading':
+            hasher.update(d.get('tmpfilename') or d.get('filename'))
+        elif d.get('status') == 'finished':
+            hasher.finish()
+
+    return hook
+
+def _download_video_sync(url: str, ydl_opts: dict, headers: dict = None, info: dict = None,
+                         job_id=None, on_progress=None, hasher=None, outtmpl: str = None, cancel=None) -> dict:
+    """
+    دانلود ویدیو (برای اجرا در executor)
 
-def _download_video_sync(url: str, ydl_opts: dict) -> dict:
-    """دانلود ویدیو (برای اجرا در executor)"""
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        return ydl.extract_info(url, download=True)
+    info: اطلاعات از قبل استخراج شده؛ انتخاب فرمت و دانلود بدون استخراج دوباره صفحه.
+    اگر لینک‌های آن منقضی شده باشد (403/410)، از cache حذف و یک بار از نو استخراج می‌شود.
+    on_progress: function(filepath, downloaded) برای checkpoint در ژورنال
+    hasher: dedup.TailHasher برای hash همزمان با دانلود
+    outtmpl: الگوی نام فایل این کار (جزو پروفایل ytdl_pool نیست)
+    """
+    with bandwidth.stream(job_id, host_of(url), INGRESS, cancel=cancel) as stream:
+        hooks = [_bandwidth_progress_hook(stream)]
+        if on_progress is not None:
+            hooks.append(_checkpoint_progress_hook(on_progress))
+        if hasher is not None:
+            hooks.append(_hash_progress_hook(hasher))
+        if info is not None:
+            try:
+                with ytdl_pool.checkout(ydl_opts, headers, hooks, outtmpl) as ydl:
+                    return ydl.process_ie_result(info, download=True)
+            except TransferCancelled:
+                raise
+            except Exception as e:
+                if not is_expired_link_error(e):
+                    raise
+                logger.info(f"لینک‌های رسانه {url[:80]} منقضی شده؛ استخراج دوباره")
+                info_cache.invalidate(url)
+                CACHE_REQUESTS.inc(cache='info', result='stale')
+        with ytdl_pool.checkout(ydl_opts, headers, hooks, outtmpl) as ydl:
+            return ydl.extract_info(url, download=True)
+
+async def download_video_ytdlp(url: str, status_message=None, job_id=None, on_progress=None, tag: str = '',
+                               hasher=None) -> tuple:
+    """دانلود ویدیو با yt-dlp از سایت‌های مختلف (async + non-blocking)
 
-async def download_video_ytdlp(url: str, status_message=None) -> tuple:
-    """دانلود ویدیو با yt-dlp از سایت‌های مختلف (async + non-blocking)"""
+    on_progress: function(filepath, downloaded) برای checkpoint پیشرفت در ژورنال
+    hasher: dedup.TailHasher برای hash محتوا همزمان با دانلود
+    tag: پسوند یکتای نام فایل تا دانلودهای همزمان ویدیوهای هم‌نام (در پروسه‌های مختلف) روی هم ننویسند؛
+    برای کارهای ژورنال شده ثابت است تا .part پس از restart پیدا شود
+    """
     try:
         loop = asyncio.get_running_loop()
     except RuntimeError:
@@ -589,7 +1313,8 @@ async def download_video_ytdlp(url: str, status_message=None) -> tuple:
     
     try:
         # تنظیمات yt-dlp
-        output_template = os.path.join(DOWNLOAD_FOLDER, '%(title)s.%(ext)s')
+        # جدا از ydl_opts به ytdl_pool داده می‌شود تا پسوند یکتای هر کار، پروفایل pool را یکتا نکند
+        output_template = os.path.join(DOWNLOAD_FOLDER, f"%(title)s{f'-{tag}' if tag else ''}.%(ext)s")
         
         # انتخاب کیفیت بر اساس محدودیت حجم
         if MAX_FILE_SIZE_MB <= 300:
@@ -603,11 +1328,8 @@ async def download_video_ytdlp(url: str, status_message=None) -> tuple:
         parsed = urlparse(url)
         
         # برای سایت‌های GIF، اولویت با GIF است
-        is_gif_site = any(site in parsed.netloc for site in [
-            'gfycat', 'redgifs', 'myteenwebcam', 'thefapp', 'xgroovy',
-            'xgifer', 'hentaigifz', 'hardcoregify'
-        ])
-        if is_gif_site:
+        gif_site = is_gif_site(url)
+        if gif_site:
             video_format = 'best[ext=gif]/best[ext=mp4]/best'
         origin_url = f"{parsed.scheme}://{parsed.netloc}"
         base_headers = {
@@ -618,9 +1340,9 @@ async def download_video_ytdlp(url: str, status_message=None) -> tuple:
             'DNT': '1',
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1',
-            'Referer': url,
-            'Origin': origin_url,
         }
+        # هدرهای مخصوص همین لینک جزو پروفایل pool نیستند تا نمونه‌های YoutubeDL بین کارها مشترک بمانند
+        job_headers = {'Referer': url, 'Origin': origin_url}
         # اگر کوکی هدر داده شده، اضافه کن (برای عبور از age-gate و 404 های ساختگی)
         if YTDLP_COOKIE_HEADER:
             base_headers['Cookie'] = YTDLP_COOKIE_HEADER
@@ -694,17 +1416,24 @@ async def download_video_ytdlp(url: str, status_message=None) -> tuple:
         if PROXY_URL and ALLOW_DOWNLOAD_VIA_PROXY:
             ydl_opts_info['proxy'] = PROXY_URL
         
-        # ابتدا اطلاعات ویدیو را دریافت کنیم (بدون دانلود)
-        if status_message:
-            await status_message.edit_text("🔍 در حال دریافت اطلاعات ویدیو...")
-        
-        try:
-            info = await asyncio.wait_for(
-                loop.run_in_executor(executor, _extract_video_info, url, ydl_opts_info),
-                timeout=60
-            )
-        except asyncio.TimeoutError:
-            return None, "❌ خطا: زمان دریافت اطلاعات ویدیو تمام شد", 0
+        # ابتدا اطلاعات ویدیو را دریافت کنیم (بدون دانلود)؛ برای محتوای پرتکرار از cache
+        canonical = await canonicalize_async(url)
+        info = info_cache.get(url, canonical.identity, canonical.url)
+        if info is None:
+            if status_message:
+                await status_message.edit_text("🔍 در حال دریافت اطلاعات ویدیو...")
+            
+            try:
+                with STAGE_SECONDS.time(stage='extract'):
+                    info = await asyncio.wait_for(
+                        loop.run_in_executor(
+                            executor, _extract_video_info, url, ydl_opts_info, job_headers, canonical.url
+                        ),
+                        timeout=60
+                    )
+            except asyncio.TimeoutError:
+                record_error('extract', url, 'Timeout')
+                return None, "❌ خطا: زمان دریافت اطلاعات ویدیو تمام شد", 0
         
         # بررسی حجم تخمینی ویدیو
         filesize = info.get('filesize') or info.get('filesize_approx') or 0
@@ -718,7 +1447,6 @@ async def download_video_ytdlp(url: str, status_message=None) -> tuple:
         video_format_pref = f"best[ext=mp4][height<=720]/best[ext=mp4]/{video_format}"
         ydl_opts = {
             'format': video_format_pref,
-            'outtmpl': output_template,
             'quiet': True,
             'no_warnings': True,
             'extract_flat': False,
@@ -737,7 +1465,7 @@ async def download_video_ytdlp(url: str, status_message=None) -> tuple:
         }
         
         # فقط برای ویدیو merge به mp4 کن, نه GIF
-        if not is_gif_site:
+        if not gif_site:
             ydl_opts['merge_output_format'] = 'mp4'
         
         # تنظیمات اضافی برای xhamster
@@ -759,14 +1487,17 @@ async def download_video_ytdlp(url: str, status_message=None) -> tuple:
             await status_message.edit_text("⏬ در حال دانلود ویدیو...")
         
         try:
-            info = await asyncio.wait_for(
-                loop.run_in_executor(executor, _download_video_sync, url, ydl_opts),
-                timeout=600
-            )
+            with STAGE_SECONDS.time(stage='download'):
+                info = await run_transfer(
+                    _download_video_sync, url, ydl_opts, job_headers, info, job_id, on_progress, hasher,
+                    output_template, timeout=DOWNLOAD_TIMEOUT * 2
+                )
         except asyncio.TimeoutError:
-            cleanup_partial_files()
-            return None, "❌ خطا: زمان دانلود ویدیو تمام شد (بیش از 10 دقیقه)", 0
+            record_error('download', url, 'Timeout')
+            await cleanup_failed_download()
+            return None, f"❌ خطا: زمان دانلود ویدیو تمام شد (بیش از {format_wait(DOWNLOAD_TIMEOUT * 2)})", 0
         except Exception as dl_e:
+            record_error('download', url, dl_e)
             # تلاش مجدد با فرمت‌های مختلف برای xhamster در صورت 404
             if 'xhamster' in parsed.netloc and ('404' in str(dl_e) or 'HTTP Error 404' in str(dl_e)):
                 fallback_formats = [
@@ -782,18 +1513,18 @@ async def download_video_ytdlp(url: str, status_message=None) -> tuple:
                         fallback_opts['format'] = fallback_format
                         fallback_opts['socket_timeout'] = 30
                         fallback_opts['retries'] = 3
-                        info = await asyncio.wait_for(
-                            loop.run_in_executor(executor, _download_video_sync, url, fallback_opts),
-                            timeout=600
+                        info = await run_transfer(
+                            _download_video_sync, url, fallback_opts, job_headers, None, job_id, on_progress, hasher,
+                            output_template, timeout=DOWNLOAD_TIMEOUT * 2
                         )
                         break
                     except Exception:
                         continue
                 else:
-                    cleanup_partial_files()
+                    await cleanup_failed_download()
                     return None, f"❌ خطا در دانلود ویدیو: {str(dl_e)}", 0
             else:
-                cleanup_partial_files()
+                await cleanup_failed_download()
                 # پیام راهنما برای xhamster در خطای 404
                 if 'xhamster' in parsed.netloc and ('404' in str(dl_e) or 'HTTP Error 404' in str(dl_e)):
                     hint = "\nℹ️ راهنما: برای xhamster ممکن است نیاز به کوکی مرورگر باشد. متغیرهای YTDLP_COOKIES یا YTDLP_COOKIE_HEADER را تنظیم کنید."
@@ -801,28 +1532,12 @@ async def download_video_ytdlp(url: str, status_message=None) -> tuple:
                     hint = ''
                 return None, f"❌ خطا در دانلود ویدیو: {str(dl_e)}{hint}", 0
         
-        # پیدا کردن فایل دانلود شده
-        if 'requested_downloads' in info and info['requested_downloads']:
-            filepath = info['requested_downloads'][0]['filepath']
-        else:
-            title = info.get('title', 'video')
-            ext = info.get('ext', 'mp4')
-            filepath = os.path.join(DOWNLOAD_FOLDER, f"{title}.{ext}")
-        
-        if not os.path.exists(filepath):
-            pattern = os.path.join(DOWNLOAD_FOLDER, f"*{info.get('id', '')}*")
-            files = glob.glob(pattern)
-            if files:
-                filepath = files[0]
-            else:
-                raise FileNotFoundError("فایل دانلود شده یافت نشد")
-        
-        # بررسی حجم نهایی فایل
-        file_size = os.path.getsize(filepath)
+        # پیدا کردن فایل دانلود شده و حجم نهایی آن (glob پوشه دانلود در executor)
+        filepath, file_size = await asyncio.get_running_loop().run_in_executor(executor, _locate_download, info)
         file_size_mb = file_size / (1024 * 1024)
         
         if file_size_mb > MAX_FILE_SIZE_MB:
-            os.remove(filepath)
+            await cleanup_failed_download(filepath)
             return None, f"❌ حجم فایل دانلود شده ({file_size_mb:.0f} MB) از حد مجاز ({MAX_FILE_SIZE_MB} MB) بیشتر است", 0
         
         # تشخیص نوع فایل بر اساس پسوند
@@ -842,101 +1557,222 @@ async def download_video_ytdlp(url: str, status_message=None) -> tuple:
     
     except Exception as e:
         logger.error(f"خطا در دانلود ویدیو با yt-dlp: {e}")
-        cleanup_partial_files()
+        record_error('extract', url, e)
+        await cleanup_failed_download()
         return None, f"❌ خطا در دانلود ویدیو: {str(e)}", 0
 
 
-def _download_file_sync(url: str, filename: str, filepath: str, proxies=None) -> tuple:
+def _locate_download(info: dict) -> tuple:
+    """(مسیر، حجم) فایلی که yt-dlp دانلود کرده (برای اجرا در executor)"""
+    if 'requested_downloads' in info and info['requested_downloads']:
+        filepath = info['requested_downloads'][0]['filepath']
+    else:
+        title = info.get('title', 'video')
+        ext = info.get('ext', 'mp4')
+        filepath = os.path.join(DOWNLOAD_FOLDER, f"{title}.{ext}")
+    
+    if not os.path.exists(filepath):
+        pattern = os.path.join(DOWNLOAD_FOLDER, f"*{info.get('id', '')}*")
+        files = glob.glob(pattern)
+        if files:
+            filepath = files[0]
+        else:
+            raise FileNotFoundError("فایل دانلود شده یافت نشد")
+    return filepath, os.path.getsize(filepath)
+
+
+def _download_file_sync(url: str, filename: str, filepath: str, proxies=None, hasher=None, job_id=None,
+                        validator: str = '', on_progress=None, cancel=None) -> tuple:
     """دانلود فایل (برای اجرا در executor)"""
+    with bandwidth.stream(job_id, host_of(url), INGRESS, cancel=cancel) as stream:
+        return _download_stream_sync(url, filepath, stream, proxies, hasher, validator, on_progress)
+
+def response_validator(response) -> str:
+    """ETag قوی یا Last-Modified پاسخ برای If-Range (ETag ضعیف W/ در If-Range مجاز نیست)"""
+    etag = response.headers.get('ETag', '')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified', '')
+
+def _download_stream_sync(url: str, filepath, stream, proxies=None, hasher=None, validator: str = '',
+                          on_progress=None) -> tuple:
+    """
+    دانلود فایل با رعایت سهم پهنای باند stream (filepath: مسیر یا فایل باز مثل SpooledTemporaryFile)
+
+    hasher: hash محتوا همزمان با نوشتن هر chunk به‌روز می‌شود (بدون خواندن دوباره فایل)
+    validator: ادامه فایل ناتمام موجود در filepath با Range و If-Range (اگر فایل روی سرور عوض شده
+    باشد سرور 200 با کل فایل می‌دهد و دانلود از ابتدا انجام می‌شود)
+    on_progress: function(filepath, downloaded, validator='') برای checkpoint در ژورنال
+    """
     session = requests.Session()
     session.trust_env = False
-    session.headers.update({
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-        'Accept': '*/*',
-        'Connection': 'keep-alive',
-    })
-    
-    content_type = ''
-    total_size = 0
-    
     try:
-        head_response = session.head(url, allow_redirects=True, timeout=20)
-        content_type = head_response.headers.get('content-type', '') or ''
+        session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept': '*/*',
+            'Connection': 'keep-alive',
+        })
+        
+        content_type = ''
+        total_size = 0
+        
         try:
-            total_size = int(head_response.headers.get('content-length', 0) or 0)
-        except Exception:
-            total_size = 0
-    except Exception:
-        pass
-    
-    try:
-        response = session.get(url, stream=True, timeout=60, allow_redirects=True)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        if proxies:
+            head_response = session.head(url, allow_redirects=True, timeout=20)
+            content_type = head_response.headers.get('content-type', '') or ''
             try:
-                response = session.get(url, stream=True, timeout=60, allow_redirects=True, proxies=proxies)
-                response.raise_for_status()
-            except requests.exceptions.RequestException:
-                raise e
-        else:
-            if url.startswith('https://'):
-                url_http = 'http://' + url[8:]
+                total_size = int(head_response.headers.get('content-length', 0) or 0)
+            except Exception:
+                total_size = 0
+        except Exception:
+            pass
+        
+        offset = 0
+        request_headers = {}
+        if validator and isinstance(filepath, str) and os.path.exists(filepath):
+            offset = os.path.getsize(filepath)
+            # فایل کامل (یا بزرگ‌تر از فایل فعلی سرور) با Range پاسخ 416 می‌گیرد؛ از ابتدا
+            if total_size and offset >= total_size:
+                offset = 0
+            if offset:
+                request_headers = {'Range': f'bytes={offset}-', 'If-Range': validator}
+        
+        try:
+            response = session.get(url, stream=True, timeout=60, allow_redirects=True, headers=request_headers)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            if proxies:
                 try:
-                    response = session.get(url_http, stream=True, timeout=60, allow_redirects=True)
+                    response = session.get(url, stream=True, timeout=60, allow_redirects=True, proxies=proxies,
+                                           headers=request_headers)
                     response.raise_for_status()
                 except requests.exceptions.RequestException:
                     raise e
             else:
-                raise e
-    
-    if not content_type:
-        content_type = response.headers.get('content-type', '') or ''
-    if total_size == 0:
-        try:
-            total_size = int(response.headers.get('content-length', 0) or 0)
-        except Exception:
-            total_size = 0
-    
-    downloaded_size = 0
-    with open(filepath, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
-                downloaded_size += len(chunk)
-                
-                if downloaded_size > MAX_FILE_SIZE_MB * 1024 * 1024:
-                    raise Exception(f"حجم فایل از {MAX_FILE_SIZE_MB} MB بیشتر است")
-    
-    return content_type, total_size, downloaded_size
+                if url.startswith('https://'):
+                    url_http = 'http://' + url[8:]
+                    try:
+                        response = session.get(url_http, stream=True, timeout=60, allow_redirects=True,
+                                               headers=request_headers)
+                        response.raise_for_status()
+                    except requests.exceptions.RequestException:
+                        raise e
+                else:
+                    raise e
+        
+        resumed = bool(offset) and response.status_code == 206
+        if offset and not resumed:
+            logger.info(f"سرور ادامه دانلود {url[:80]} را نپذیرفت (HTTP {response.status_code})؛ دانلود از ابتدا")
+            offset = 0
+        if not content_type:
+            content_type = response.headers.get('content-type', '') or ''
+        if total_size == 0:
+            try:
+                total_size = int(response.headers.get('content-length', 0) or 0)
+                if total_size:
+                    total_size += offset
+            except Exception:
+                total_size = 0
+        
+        if not isinstance(filepath, str):
+            target = nullcontext(filepath)
+            on_progress = None
+        else:
+            target = open(filepath, 'r+b' if resumed else 'wb')
+        downloaded_size = offset
+        with target as f:
+            if resumed:
+                logger.info(f"ادامه دانلود {url[:80]} از {offset / (1024 * 1024):.1f} MB")
+                if hasher is not None:
+                    # hash بخش دانلود شده از روی دیسک (به جای دانلود دوباره)
+                    for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                        hasher.update(chunk)
+                f.seek(offset)
+            if on_progress is not None:
+                on_progress(filepath, offset, response_validator(response))
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    downloaded_size += len(chunk)
+                    stream.consume(len(chunk))
+                    if on_progress is not None:
+                        on_progress(filepath, downloaded_size)
+                    
+                    if downloaded_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+                        raise Exception(f"حجم فایل از {MAX_FILE_SIZE_MB} MB بیشتر است")
+        
+        return content_type, total_size, downloaded_size
+    finally:
+        # بستن session (و اتصال‌های pool آن) حتی در صورت خطا یا لغو
+        session.close()
+
+def discard_download(filepath):
+    """حذف فایل دانلود ناتمام یا بستن buffer حافظه آن"""
+    if filepath is None:
+        return
+    if not isinstance(filepath, str):
+        filepath.close()
+    elif os.path.exists(filepath):
+        os.remove(filepath)
+
+def _spill_to_disk(artifact: Artifact):
+    """نوشتن buffer حافظه یک Artifact در filepath آن (برای اجرا در executor)"""
+    artifact.buffer.seek(0)
+    with open(artifact.filepath, 'wb') as target:
+        shutil.copyfileobj(artifact.buffer, target, DOWNLOAD_CHUNK_SIZE)
+    artifact.buffer.close()
+    artifact.buffer = None
 
 def _check_file_size_sync(url: str) -> int:
     """بررسی حجم فایل (برای اجرا در executor)"""
     try:
-        session = requests.Session()
-        session.trust_env = False
-        head_response = session.head(url, allow_redirects=True, timeout=20)
-        content_length = head_response.headers.get('content-length', 0)
-        if content_length:
-            return int(content_length)
+        with requests.Session() as session:
+            session.trust_env = False
+            head_response = session.head(url, allow_redirects=True, timeout=20)
+            content_length = head_response.headers.get('content-length', 0)
+            if content_length:
+                return int(content_length)
     except Exception:
         pass
     return 0
 
-async def download_file(url: str, filename: str, status_message=None) -> tuple:
-    """دانلود فایل از URL با نمایش پیشرفت (async + non-blocking)"""
+def spool_allowed(size: int) -> bool:
+    """آیا فایلی با این حجم می‌تواند بدون دیسک در حافظه نگه داشته شود"""
+    # سرور Bot API محلی فایل روی دیسک را بدون کپی می‌خواند؛ buffer حافظه باید multipart ارسال شود
+    if BOT_API_LOCAL or not 0 < size <= SPOOL_MAX_MB * 1024 * 1024:
+        return False
+    # زیر فشار حافظه همان مسیر دیسک
+    return not memory_governor.enabled or memory_governor.projected(size) < memory_governor.budget
+
+
+async def download_file(url: str, filename: str, status_message=None, known_size: int = 0, job_id=None,
+                        in_memory: bool = False, hasher=None, resume_path: str = None, validator: str = '',
+                        on_progress=None) -> tuple:
+    """دانلود فایل از URL با نمایش پیشرفت (async + non-blocking)
+
+    known_size: حجم به‌دست‌آمده از probe قبلی (برای جلوگیری از HEAD تکراری)
+    in_memory: اگر حجم معلوم و کوچک باشد، به جای مسیر فایل یک SpooledTemporaryFile برگردانده می‌شود
+    که فقط در صورت بزرگ‌تر شدن از SPOOL_MAX_MB روی دیسک (فایل بی‌نام) می‌ریزد
+    hasher: hash جریانی محتوا (dedup.new_hasher) که در حلقه نوشتن به‌روز می‌شود
+    resume_path و validator: فایل ناتمام کار پیش از restart و ETag/Last-Modified آن برای ادامه با Range
+    on_progress: function(filepath, downloaded, validator='') برای checkpoint در ژورنال؛ با لغو
+    (خاموش شدن ربات) فایل ناتمام نگه داشته می‌شود تا پس از restart ادامه پیدا کند
+    """
     try:
         loop = asyncio.get_running_loop()
     except RuntimeError:
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
     
+    filepath = None
     try:
         proxies = {'http': PROXY_URL, 'https': PROXY_URL} if (PROXY_URL and ALLOW_DOWNLOAD_VIA_PROXY) else None
         
         # بررسی حجم فایل قبل از دانلود (در executor)
+        file_size_bytes = 0
         try:
-            file_size_bytes = await loop.run_in_executor(executor, _check_file_size_sync, url)
+            file_size_bytes = known_size or await loop.run_in_executor(executor, _check_file_size_sync, url)
             if file_size_bytes > 0:
                 file_size_mb = file_size_bytes / (1024 * 1024)
                 if file_size_mb > MAX_FILE_SIZE_MB:
@@ -949,36 +1785,45 @@ async def download_file(url: str, filename: str, status_message=None) -> tuple:
             ext = get_file_extension_from_url(url, '')
             filename = filename + ext
         
-        filepath = os.path.join(DOWNLOAD_FOLDER, filename)
+        if resume_path and os.path.exists(resume_path):
+            filepath = resume_path
+        elif in_memory and spool_allowed(file_size_bytes):
+            filepath = tempfile.SpooledTemporaryFile(max_size=int(SPOOL_MAX_MB * 1024 * 1024), dir=DOWNLOAD_FOLDER)
+        else:
+            filepath = os.path.join(DOWNLOAD_FOLDER, filename)
         
         # دانلود فایل در executor (non-blocking)
         if status_message:
             await status_message.edit_text("⏬ در حال دانلود...")
         
         try:
-            content_type, total_size, downloaded_size = await asyncio.wait_for(
-                loop.run_in_executor(executor, _download_file_sync, url, filename, filepath, proxies),
-                timeout=300
-            )
+            with STAGE_SECONDS.time(stage='download'):
+                content_type, total_size, downloaded_size = await run_transfer(
+                    _download_file_sync, url, filename, filepath, proxies, hasher, job_id, validator, on_progress,
+                    timeout=DOWNLOAD_TIMEOUT
+                )
         except asyncio.TimeoutError:
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            return None, "❌ زمان دانلود فایل تمام شد (بیش از 5 دقیقه)", 0
+            record_error('download', url, 'Timeout')
+            discard_download(filepath)
+            return None, f"❌ زمان دانلود فایل تمام شد (بیش از {format_wait(DOWNLOAD_TIMEOUT)})", 0
+        except asyncio.CancelledError:
+            if on_progress is None or not isinstance(filepath, str):
+                discard_download(filepath)
+            raise
         
         # بررسی حجم نهایی
         if downloaded_size > MAX_FILE_SIZE_MB * 1024 * 1024:
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            discard_download(filepath)
             return None, f"❌ حجم فایل ({downloaded_size/(1024*1024):.0f} MB) از حد مجاز ({MAX_FILE_SIZE_MB} MB) بیشتر است", 0
         
         return filepath, content_type, total_size
     
     except Exception as e:
         logger.error(f"خطا در دانلود فایل: {e}")
+        record_error('download', url, e)
         error_msg = str(e)
         
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        discard_download(filepath)
         
         if 'Connection refused' in error_msg or 'Errno 111' in error_msg:
             return None, "❌ اتصال به سرور فایل برقرار نشد", 0
@@ -992,11 +1837,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """مدیریت پیام‌های دریافتی"""
     # ثبت کاربر و به‌روزرسانی آخرین درخواست
     user = update.effective_user
-    active_users[user.id] = {
-        'username': user.username or 'بدون یوزرنیم',
-        'first_name': user.first_name or 'نامشخص',
-        'last_request': datetime.now()
-    }
+    track_active_user(user)
     
     # فوروارد پیام به ادمین (بدون ذخیره در سرور)
     try:
@@ -1018,66 +1859,978 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     url = message_text
+    # هویت یکتای محتوا (بدون درخواست شبکه) تا شکل‌های مختلف یک لینک یکی حساب شوند
+    canonical = await canonicalize_async(url, resolve=is_video_site(url))
     
     # تاریخ و زمان فعلی برای کپشن
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
-    # ذخیره لینک در فایل
-    save_user_link(user.id, url, current_time)
-    
-    # پاکسازی فایل‌های قدیمی قبل از شروع دانلود جدید
-    cleanup_old_files()
-    cleanup_partial_files()
+    # ذخیره لینک و پاکسازی فایل‌های قدیمی در executor تا event loop مسدود نشود
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(executor, save_user_link, user.id, url, current_time, canonical.key)
+    loop.run_in_executor(executor, cleanup_downloads)
     
     # پیام وضعیت
     status_message = await update.message.reply_text("⏳ در حال پردازش...")
     
-    filepath = None
+    # افزودن به صف منصفانه (یا رد زودهنگام در صورت شلوغی)
+    job = Job(
+        user_id=user.id,
+        chat_id=update.effective_chat.id,
+        message_id=update.message.message_id,
+        url=url,
+        canonical=canonical,
+        bot=context.bot,
+        status_message=status_message,
+        current_time=current_time,
+        kind='video' if is_video_site(url) else 'direct',
+    )
     try:
-        filename = f"file_{update.message.message_id}"
-        
-        # بررسی اینکه آیا از سایت‌های ویدیویی است
-        if is_video_site(url):
-            # استفاده از yt-dlp برای دانلود ویدیو
-            if DIRECT_SEND_ONLY:
-                await status_message.edit_text(
-                    "❌ دانلود ویدیو از این سایت در محیط محدود امکان‌پذیر نیست.\n"
-                    "لطفاً متغیر DIRECT_SEND_ONLY را غیرفعال کنید."
-                )
-                return
-            
-            await status_message.edit_text("🎬 شناسایی سایت ویدیویی - استفاده از yt-dlp...")
-            filepath, result, total_size = await download_video_ytdlp(url, status_message)
+        if SUPERVISOR_MODE:
+            # محدودیت‌ها اینجا بررسی می‌شوند؛ صف و اجرا در پروسه worker این کار
+            admission.admit(job, queued=await journal_call(job_journal.count, 'queued'))
         else:
-            # تلاش برای ارسال مستقیم توسط سرورهای تلگرام (بدون دانلود محلی)
+            estimate_job_cost(job)
+            admission.submit(job)
+    except AdmissionRejected as e:
+        JOBS.inc(outcome='rejected')
+        logger.info(f"درخواست کاربر {user.id} رد شد: {e}")
+        await status_message.edit_text(str(e))
+        return
+    if SUPERVISOR_MODE:
+        await journal_call(job_journal.add, job, shard=shard_of(job), claimed=False)
+        return
+    await journal_call(job_journal.add, job)
+    await schedule_job(job)
+
+
+async def schedule_job(job: Job):
+    """پس از افزودن کار به صف: بررسی حجم لینک مستقیم در پس‌زمینه و نمایش جایگاه صف"""
+    # برای لینک‌های مستقیم، حجم واقعی با HEAD در پس‌زمینه بررسی می‌شود
+    # (مگر اینکه هاست سابقه خوبی در ارسال مستقیم داشته باشد و دانلود محلی لازم نباشد)
+    if job.kind == 'direct':
+        if direct_send_advisor.decide(job.url, is_video_file(job.url))[0]:
+            admission.update_cost(job, 1, 'direct')
+        else:
+            spawn_task(probe_job(job))
+    
+    await notify_queue_position(job)
+
+
+def shard_of(job: Job) -> int:
+    """شماره پروسه worker یک کار (crc32 پایدار است؛ hash پایتون در هر پروسه فرق می‌کند)"""
+    key = job.canonical.key if SHARD_BY == 'media' else str(job.user_id)
+    return zlib.crc32(key.encode()) % WORKER_PROCESSES
+
+
+async def job_from_row(row: dict, bot) -> Job:
+    """بازسازی Job از ردیف ژورنال"""
+    url = row['url']
+    canonical = await canonicalize_async(url, resolve=is_video_site(url))
+    return Job(
+        user_id=row['user_id'],
+        chat_id=row['chat_id'],
+        message_id=row['message_id'],
+        url=url,
+        canonical=canonical,
+        bot=bot,
+        current_time=row['requested_at'],
+        kind=row['kind'],
+        journal_id=row['id'],
+    )
+
+
+def status_message_of(bot, chat_id: int, message_id: int) -> Message:
+    """پیام وضعیتی که پروسه اصلی فرستاده (برای edit_text و delete در پروسه worker)"""
+    message = Message(message_id=message_id, date=datetime.now(), chat=Chat(id=chat_id, type=Chat.PRIVATE))
+    message.set_bot(bot)
+    return message
+
+
+async def dispatch_loop(bot):
+    """پروسه worker: برداشتن کارهای تازه shard این پروسه از ژورنال و افزودن به صف محلی"""
+    parent = os.getppid()
+    backlog = False
+    while lifecycle.accepting:
+        # پروسه اصلی از دست رفته؛ نمونه جدید آن worker های خودش را می‌سازد
+        if os.getppid() != parent:
+            logger.error("پروسه اصلی در دسترس نیست؛ خروج worker")
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        # claim (قفل نوشتن) فقط وقتی پروسه دیگری چیزی نوشته یا دسته قبلی پر بوده؛ هر دو در thread ژورنال
+        if backlog or await journal_call(job_journal.changed):
+            # با تقسیم بر اساس user همه کارهای هر کاربر در همین پروسه‌اند و سقف محلی admission کافی است
+            per_user = MAX_JOBS_PER_USER if SHARD_BY == 'media' else 0
+            rows = await journal_call(job_journal.claim, WORKER_INDEX, job_journal.CLAIM_BATCH, per_user)
+            backlog = len(rows) >= job_journal.CLAIM_BATCH
+            for row in rows:
+                job = await job_from_row(row, bot)
+                job.status_message = status_message_of(bot, row['chat_id'], row['status_message_id'])
+                estimate_job_cost(job)
+                # محدودیت‌ها در پروسه اصلی بررسی شده‌اند
+                admission.submit(job, admitted=True)
+                await schedule_job(job)
+        await asyncio.sleep(DISPATCH_POLL_INTERVAL)
+
+
+async def resume_jobs(bot, shard: int = None, include_own: bool = False):
+    """
+    ادامه کارهای ناتمام پیش از restart یا crash (یا سپرده شده توسط نمونه قبلی هنگام تخلیه)
+    از آخرین checkpoint ژورنال و اطلاع به کاربران
+
+    shard: در پروسه worker فقط کارهایی که خود آن shard برداشته بود
+    include_own: کارهای خود این نمونه (پروسه worker ای که دوباره راه‌اندازی شده)
+    """
+    rows = await journal_call(job_journal.adopt, shard, include_own)
+    now = time.time()
+    resumed = 0
+    for row in rows:
+        url = row['url']
+        job = await job_from_row(row, bot)
+        job.resume = row
+        if row['resumes'] >= JOB_MAX_RESUMES or now - row['updated'] > RESUME_MAX_AGE:
+            await journal_call(job_journal.finish, job, 'failed')
+            JOBS.inc(outcome='failed_resume')
             try:
-                await status_message.edit_text("⏳ تلاش برای ارسال مستقیم توسط تلگرام...")
-                if is_video_file(url):
-                    await update.message.reply_video(
-                        video=url,
-                        caption="📹 ویدیو (ارسال مستقیم توسط تلگرام)",
-                        supports_streaming=True
-                    )
-                else:
-                    await update.message.reply_document(
-                        document=url,
-                        caption="📄 فایل (ارسال مستقیم توسط تلگرام)"
-                    )
-                await status_message.delete()
+                await bot.send_message(
+                    chat_id=job.chat_id,
+                    text=f"❌ ربات دوباره راه‌اندازی شد و پردازش این لینک ادامه پیدا نکرد.\n"
+                         f"لطفاً دوباره ارسال کنید:\n{url}",
+                )
+            except Exception as e:
+                logger.debug(f"خطا در اطلاع‌رسانی کار ناتمام {row['id']}: {e}")
+            continue
+        
+        try:
+            job.status_message = await bot.send_message(
+                chat_id=job.chat_id,
+                text=f"♻️ ربات دوباره راه‌اندازی شد؛ پردازش این لینک از جایی که مانده بود ادامه پیدا می‌کند:\n{url}",
+            )
+        except Exception as e:
+            # کاربر ربات را مسدود کرده یا چت در دسترس نیست
+            logger.warning(f"کار ناتمام {row['id']} ادامه داده نشد: {e}")
+            await journal_call(job_journal.finish, job, 'failed')
+            continue
+        # پیام وضعیت قبلی دیگر به‌روز نمی‌شود
+        if row['status_message_id']:
+            try:
+                await bot.delete_message(chat_id=job.chat_id, message_id=row['status_message_id'])
+            except Exception:
+                pass
+        
+        # کاری که هنگام تخلیه سپرده شده (owner خالی) crash نبوده و در سقف ادامه‌ها حساب نمی‌شود
+        await journal_call(
+            job_journal.update, job, row['state'], resumes=row['resumes'] + (1 if row['owner'] else 0),
+            status_message_id=job.status_message.message_id,
+        )
+        estimate_job_cost(job)
+        if row['size'] or row['downloaded']:
+            admission.update_cost(job, row['size'] or row['downloaded'], 'journal')
+        admission.submit(job, admitted=True)
+        job_journal.resumed += 1
+        resumed += 1
+    if rows:
+        logger.info(f"♻️ {resumed} کار ناتمام از {len(rows)} کار پیش از restart ادامه داده شد")
+
+
+async def adopt_loop(bot, shard: int = None):
+    """برداشتن دوره‌ای کارهایی که نمونه قبلی هنگام تخلیه سپرده یا با از دست رفتن آن بی‌مالک مانده‌اند"""
+    while True:
+        await asyncio.sleep(ADOPT_INTERVAL)
+        if not lifecycle.accepting:
+            return
+        await resume_jobs(bot, shard)
+
+
+async def heartbeat_loop():
+    """اعلام زنده بودن و وضعیت این نمونه در ژورنال (تا پایان تخلیه)"""
+    global journal_owned
+    while True:
+        await asyncio.get_running_loop().run_in_executor(heartbeat_executor, job_journal.heartbeat, lifecycle.state)
+        if SUPERVISOR_MODE:
+            journal_owned = await journal_call(job_journal.owned)
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+# کارهای ناتمام این نمونه در ژورنال (حالت supervisor)؛ با heartbeat به‌روز می‌شود تا /health روی
+# event loop منتظر قفل ژورنال نماند
+journal_owned = 0
+
+
+def pipeline_progress() -> dict:
+    """پیشرفت کارها برای /health (در حالت supervisor از ژورنال، مجموع همه پروسه‌های worker)"""
+    if SUPERVISOR_MODE:
+        return {
+            'in_flight': journal_owned,
+            'workers': sum(1 for process in worker_processes.values() if process.returncode is None),
+        }
+    return {'in_flight': len(in_flight), 'queued': admission.queued_count}
+
+
+async def drain_jobs():
+    """
+    تخلیه آرام کارها (پس از توقف دریافت آپدیت‌ها)
+
+    کارهای شروع‌نشده بلافاصله از طریق ژورنال به نمونه بعدی سپرده می‌شوند؛ کارهای در حال اجرا تا
+    پایان مهلت DRAIN_TIMEOUT فرصت دارند. بقیه لغو می‌شوند (checkpoint دانلود و فایل‌های کامل روی دیسک
+    می‌مانند) و نمونه بعدی از همان‌جا ادامه می‌دهد. بدون ژورنال کارهای در صف هم تا پایان مهلت اجرا
+    می‌شوند و به کاربران کارهای ناتمام اطلاع داده می‌شود.
+    """
+    if job_journal.enabled:
+        queued = admission.queued_jobs()
+        for job in queued:
+            admission.cancel(job)
+        lifecycle.handed_over += await journal_call(job_journal.release, [job.journal_id for job in queued])
+    logger.info(
+        f"🚰 تخلیه: {len(in_flight)} کار در حال اجرا، {admission.queued_count} در صف، "
+        f"{lifecycle.handed_over} سپرده شد (مهلت {lifecycle.remaining():.0f}s)"
+    )
+    while (in_flight or admission.queued_count) and lifecycle.remaining() > 0:
+        await asyncio.sleep(0.2)
+    if not in_flight and not admission.queued_count:
+        logger.info("🚰 تخلیه کامل شد؛ همه کارهای در حال اجرا تمام شدند")
+        return
+    
+    unfinished = list(in_flight.values()) + admission.queued_jobs()
+    for task in worker_tasks + list(pending_tasks):
+        task.cancel()
+    await asyncio.gather(*worker_tasks, *pending_tasks, return_exceptions=True)
+    if job_journal.enabled:
+        lifecycle.handed_over += await journal_call(job_journal.release)
+        logger.warning(f"🚰 مهلت تخلیه تمام شد؛ {len(unfinished)} کار با checkpoint به نمونه بعدی سپرده شد")
+        return
+    for job in unfinished:
+        try:
+            await job.status_message.edit_text(
+                "❌ ربات در حال به‌روزرسانی است و پردازش این لینک متوقف شد.\n"
+                f"لطفاً چند لحظه دیگر دوباره ارسال کنید:\n{job.url}"
+            )
+        except Exception:
+            pass
+    logger.warning(f"🚰 مهلت تخلیه تمام شد؛ {len(unfinished)} کار لغو شد")
+
+
+async def drain():
+    """تخلیه این نمونه: کارهای خودش یا (در حالت supervisor) پروسه‌های worker که هر کدام تخلیه می‌کنند"""
+    if SUPERVISOR_MODE:
+        await stop_worker_processes(DRAIN_TIMEOUT + 15)
+    else:
+        await drain_jobs()
+    lifecycle.stopped()
+    await asyncio.get_running_loop().run_in_executor(heartbeat_executor, job_journal.heartbeat, 'stopped')
+
+
+# GIF ها معمولاً کوچک هستند؛ حجم پیش‌فرض برای زمان‌بندی وقتی سابقه‌ای از هاست نداریم
+DEFAULT_GIF_COST = 5 * 1024 * 1024
+pending_tasks = set()
+
+
+def estimate_job_cost(job: Job):
+    """تخمین اولیه حجم کار از سابقه هاست (بدون درخواست شبکه)"""
+    size = admission.costs.estimate(host_of(job.url))
+    if size:
+        admission.update_cost(job, size, 'history')
+    elif is_gif_site(job.url):
+        admission.update_cost(job, DEFAULT_GIF_COST, 'gif')
+
+
+async def probe_job(job: Job):
+    """HEAD لینک مستقیم برای تخمین دقیق حجم (نتیجه در ارسال مستقیم و دانلود هم استفاده می‌شود)"""
+    try:
+        loop = asyncio.get_running_loop()
+        with STAGE_SECONDS.time(stage='probe'):
+            probe = await loop.run_in_executor(executor, direct_send_advisor.probe, job.url)
+        if job.probe is None:
+            job.probe = probe
+        admission.update_cost(job, probe.get('size', 0), 'probe')
+    except Exception as e:
+        logger.debug(f"خطا در probe کار {job.job_id}: {e}")
+
+
+def format_wait(seconds: float) -> str:
+    """نمایش خوانای زمان انتظار"""
+    if seconds < 60:
+        return f"{max(1, int(seconds))} ثانیه"
+    return f"{int(seconds // 60)} دقیقه"
+
+
+async def notify_queue_position(job: Job):
+    """نمایش جایگاه کار در صف و زمان انتظار تخمینی (فقط در صورت تغییر)"""
+    position, eta = admission.positions().get(job.job_id, (0, 0))
+    if not position or position == job.queue_position:
+        return
+    job.queue_position = position
+    if eta <= 0:
+        return
+    try:
+        await job.status_message.edit_text(
+            f"🕒 در صف انتظار\n"
+            f"📍 جایگاه شما: {position}\n"
+            f"⏱ زمان انتظار تخمینی: {format_wait(eta)}"
+        )
+    except Exception as e:
+        logger.debug(f"خطا در به‌روزرسانی جایگاه صف: {e}")
+
+
+async def queue_feedback_loop():
+    """به‌روزرسانی دوره‌ای جایگاه کارهای در صف (با فاصله برای جلوگیری از flood)"""
+    while True:
+        await asyncio.sleep(3)
+        for job in admission.queued_jobs():
+            await notify_queue_position(job)
+
+
+def spawn_task(coro):
+    """اجرای یک coroutine در پس‌زمینه با نگه‌داشتن ارجاع تا پایان آن"""
+    task = asyncio.create_task(coro)
+    pending_tasks.add(task)
+    task.add_done_callback(pending_tasks.discard)
+    return task
+
+
+def user_error_message(error: Exception) -> str:
+    """پیام خطای کاربرپسند"""
+    error_msg = str(error)
+    if "timed out" in error_msg.lower() or "timeout" in error_msg.lower():
+        return "❌ زمان اتصال تمام شد. لطفاً دوباره تلاش کنید."
+    elif "memory" in error_msg.lower() or "out of memory" in error_msg.lower():
+        return "❌ حافظه کافی نیست. لطفاً فایل کوچک‌تری ارسال کنید."
+    elif "connection" in error_msg.lower():
+        return "❌ مشکل در اتصال به سرور. لطفاً دوباره تلاش کنید."
+    return f"❌ خطا در پردازش فایل: {error_msg[:100]}"
+
+
+def record_error(stage: str, url: str, error):
+    """ثبت کلاس خطا به تفکیک مرحله و هاست در متریک‌ها"""
+    error_class = error if isinstance(error, str) else type(error).__name__
+    ERRORS.inc(stage=stage, host=host_of(url) or 'unknown', error=error_class)
+
+
+def register_metric_callbacks():
+    """تعریف gauge هایی که هنگام خروجی گرفتن /metrics محاسبه می‌شوند"""
+    EXECUTOR_QUEUE.set_function(lambda: executor._work_queue.qsize())
+    QUEUE_DEPTH.set_function(lambda: {
+        ('admission_queued',): admission.queued_count,
+        ('admission_active',): admission.active_count,
+        ('upload',): upload_queue.qsize() if upload_queue else 0,
+        ('upload_active',): upload_stage.busy,
+    })
+    LOOP_LAG.set_function(lambda: {(q,): v for q, v in loop_monitor.percentiles().items()})
+    MEMORY_BYTES.set_function(lambda: {
+        ('rss',): memory_governor.rss,
+        ('projected',): memory_governor.projected(),
+        ('budget',): memory_governor.budget,
+    })
+
+
+async def download_worker(worker_id: int):
+    """worker دانلود: کارها را به نوبت از صف منصفانه برداشته و فایل آماده را به صف آپلود می‌دهد"""
+    while True:
+        job = await admission.next_job()
+        in_flight[job.job_id] = job
+        logger.info(f"worker {worker_id}: شروع کار {job.job_id} کاربر {job.user_id} (انتظار {job.wait_time():.1f}s)")
+        STAGE_SECONDS.observe(job.wait_time(), stage='queue')
+        artifact = None
+        started = time.monotonic()
+        download_stage.begin()
+        try:
+            artifact = await download_job(job)
+        except Exception as e:
+            logger.error(f"خطای پیش‌بینی نشده در کار {job.job_id}: {e}")
+            try:
+                await job.status_message.edit_text(user_error_message(e))
+            except Exception:
+                pass
+        finally:
+            download_stage.end(
+                time.monotonic() - started,
+                artifact.file_size if artifact else 0,
+                ok=artifact is not None or job.delivered,
+            )
+        if artifact is not None:
+            BYTES.inc(artifact.file_size, direction='in')
+            await postprocess_artifact(artifact)
+            # فایل کامل روی دیسک پس از restart بدون دانلود دوباره آپلود می‌شود (buffer حافظه نه)
+            await journal_call(
+                job_journal.update, job, 'uploading',
+                filepath=artifact.filepath if artifact.buffer is None else None,
+                size=artifact.file_size, content_type=artifact.content_type, digest=artifact.digest,
+            )
+        elif job.delivered:
+            JOBS.inc(outcome='delivered_direct')
+            await journal_call(job_journal.finish, job, 'delivered')
+            in_flight.pop(job.job_id, None)
+        else:
+            JOBS.inc(outcome='failed_download')
+            await journal_call(job_journal.finish, job, 'failed')
+            in_flight.pop(job.job_id, None)
+        try:
+            if artifact is not None:
+                # اگر صف آپلود پر باشد، دانلود بعدی منتظر می‌ماند (backpressure)
+                await upload_queue.put(artifact)
+        finally:
+            admission.finish(job)
+        if job.delivered:
+            admission.complete(job)
+
+
+async def upload_worker(worker_id: int):
+    """worker آپلود: فایل‌های آماده را از صف تحویل برداشته و به تلگرام ارسال می‌کند"""
+    while True:
+        artifact = await upload_queue.get()
+        try:
+            await process_upload(artifact)
+        except Exception as e:
+            logger.error(f"خطای پیش‌بینی نشده در آپلود کار {artifact.job.job_id}: {e}")
+        finally:
+            upload_queue.task_done()
+
+
+def upload_retry_delay(error: Exception, attempt: int):
+    """فاصله تا تلاش مجدد آپلود یا None اگر خطا قابل تکرار نیست"""
+    if isinstance(error, BadRequest):
+        return None
+    retry_after = getattr(error, 'retry_after', None)  # RetryAfter در Bot API
+    if retry_after is None and isinstance(getattr(error, 'value', None), int):
+        retry_after = error.value  # FloodWait در Pyrogram
+    if isinstance(retry_after, timedelta):
+        retry_after = retry_after.total_seconds()
+    if retry_after:
+        return float(retry_after) + 1
+    return 5.0 * (2 ** (attempt - 1))
+
+
+async def requeue_upload(artifact: Artifact, delay: float):
+    """بازگرداندن فایل آماده به صف آپلود پس از تاخیر (بدون دانلود مجدد)"""
+    await asyncio.sleep(delay)
+    await upload_queue.put(artifact)
+
+
+async def process_upload(artifact: Artifact):
+    """ارسال یک فایل آماده با تلاش مجدد از همان فایل در صورت خطا"""
+    job = artifact.job
+    status_message = job.status_message
+    artifact.attempts += 1
+    # همان محتوا قبلاً آپلود شده: ارسال با file_id بدون آپلود و رزرو حافظه
+    if artifact.attempts == 1 and await send_duplicate(artifact):
+        JOBS.inc(outcome='delivered_dedup')
+        await finish_upload(artifact)
+        return
+    # آپلود multipart Bot API (تا 50MB) کل فایل را در حافظه می‌خواند؛ Pyrogram جریانی است و
+    # سرور Bot API محلی فایل روی دیسک را خودش می‌خواند
+    in_memory = artifact.file_size <= CLOUD_UPLOAD_LIMIT and not (BOT_API_LOCAL and artifact.buffer is None)
+    in_memory_size = artifact.file_size if in_memory else 0
+    reservation = await memory_governor.acquire('upload', in_memory_size, key=('upload', job.job_id))
+    started = time.monotonic()
+    upload_stage.begin()
+    try:
+        try:
+            with STAGE_SECONDS.time(stage='upload'):
+                message = await upload_artifact(artifact)
+        finally:
+            memory_governor.release(reservation)
+    except Exception as e:
+        upload_stage.end(time.monotonic() - started, ok=False)
+        record_error('upload', job.url, e)
+        logger.error(f"خطا در ارسال کار {job.job_id} (تلاش {artifact.attempts}): {e}")
+        delay = upload_retry_delay(e, artifact.attempts)
+        if delay is not None and artifact.attempts < UPLOAD_RETRIES and artifact.exists():
+            upload_stage.retried += 1
+            try:
+                await status_message.edit_text(
+                    f"⚠️ خطا در ارسال، تلاش مجدد ({artifact.attempts + 1}/{UPLOAD_RETRIES}) "
+                    f"تا {delay:.0f} ثانیه دیگر..."
+                )
+            except Exception:
+                pass
+            spawn_task(requeue_upload(artifact, delay))
+            return
+        
+        try:
+            await status_message.edit_text(user_error_message(e))
+        except Exception:
+            pass
+        JOBS.inc(outcome='failed_upload')
+        await journal_call(job_journal.finish, job, 'failed')
+        in_flight.pop(job.job_id, None)
+        await asyncio.get_running_loop().run_in_executor(executor, artifact.discard)
+        return
+    
+    upload_stage.end(time.monotonic() - started, artifact.file_size)
+    BYTES.inc(artifact.file_size, direction='out')
+    JOBS.inc(outcome='delivered')
+    # file_id این آپلود برای ارسال دوباره همین محتوا از لینک‌های دیگر
+    media = sent_media(message)
+    if artifact.digest and media is not None:
+        content_index.record(artifact.digest, *media, artifact.file_size)
+        asyncio.get_running_loop().run_in_executor(executor, content_index.save)
+    await finish_upload(artifact)
+
+
+async def finish_upload(artifact: Artifact):
+    """پایان موفق تحویل: حذف پیام وضعیت و فایل موقت"""
+    job = artifact.job
+    job.delivered = True
+    admission.complete(job)
+    await journal_call(job_journal.finish, job, 'delivered')
+    in_flight.pop(job.job_id, None)
+    
+    # حذف پیام وضعیت
+    try:
+        await job.status_message.delete()
+    except Exception as e:
+        logger.debug(f"خطا در حذف پیام وضعیت: {e}")
+    
+    # حذف فایل موقت (یا آزاد کردن buffer حافظه)؛ حذف فایل‌های بزرگ ممکن است زمان ببرد
+    await asyncio.get_running_loop().run_in_executor(executor, artifact.discard)
+    logger.info(f"فایل {artifact.filepath} با موفقیت ارسال و حذف شد.")
+
+
+def _upload_progress_callback(stream):
+    """callback پیشرفت Pyrogram که آپلود را با سهم پهنای باند هماهنگ می‌کند"""
+    sent = {'bytes': 0}
+
+    async def progress(current, total):
+        delta = current - sent['bytes']
+        sent['bytes'] = current
+        if delta > 0:
+            await stream.consume_async(delta)
+
+    return progress
+
+
+def download_caption(kind: str, file_size_mb: float, current_time: str) -> str:
+    title = {'animation': "🎞️ GIF دانلود شده", 'video': "📹 ویدیو دانلود شده"}.get(kind, "📄 فایل دانلود شده")
+    return f"{title}\n📦 حجم: {file_size_mb:.2f} MB\n🕐 {current_time}"
+
+
+async def send_duplicate(artifact: Artifact) -> bool:
+    """
+    ارسال فایلی که همان محتوا قبلاً آپلود شده با file_id قبلی (بدون آپلود)
+
+    اگر تلگرام file_id را نپذیرد، از نگاشت حذف و آپلود معمولی انجام می‌شود.
+    """
+    if not artifact.digest:
+        return False
+    duplicate = content_index.lookup(artifact.digest)
+    CACHE_REQUESTS.inc(cache='content', result='hit' if duplicate else 'miss')
+    if duplicate is None:
+        return False
+    kind, file_id = duplicate
+    job = artifact.job
+    caption = download_caption(kind, artifact.file_size / (1024 * 1024), job.current_time)
+    try:
+        with STAGE_SECONDS.time(stage='dedup'):
+            if kind == 'animation':
+                await job.bot.send_animation(chat_id=job.chat_id, animation=file_id, caption=caption)
+            elif kind == 'video':
+                await job.bot.send_video(chat_id=job.chat_id, video=file_id, caption=caption, supports_streaming=True)
+            else:
+                await job.bot.send_document(chat_id=job.chat_id, document=file_id, caption=caption)
+    except BadRequest as e:
+        logger.warning(f"file_id تکراری برای کار {job.job_id} پذیرفته نشد، آپلود دوباره: {e}")
+        content_index.forget(artifact.digest)
+        return False
+    except Exception as e:
+        logger.warning(f"خطا در ارسال تکراری کار {job.job_id}، آپلود دوباره: {e}")
+        return False
+    content_index.delivered(artifact.file_size)
+    DEDUP_SAVED_BYTES.inc(artifact.file_size)
+    logger.info(f"کار {job.job_id}: محتوای تکراری با file_id قبلی ارسال شد ({artifact.file_size / (1024 * 1024):.1f} MB آپلود نشد)")
+    return True
+
+
+async def run_postprocess(stage: str, timeout: float, func, *args):
+    """
+    اجرای مرحله پس‌پردازش media.py با مهلت؛ خروجی نتیجه یا None (timeout یا خطا)، زمان در متریک stage
+
+    ffmpeg و ffprobe پروسه‌های جدا هستند و event loop فقط منتظر خروجی آن‌هاست؛ تعداد اجراهای همزمان
+    با POSTPROCESS_WORKERS محدود می‌شود. در timeout یا لغو کار پروسه‌های فرزند kill می‌شوند.
+    """
+    started = time.monotonic()
+    name = os.path.basename(args[0])
+
+    async def limited():
+        async with postprocess_slots:
+            return await func(*args)
+
+    try:
+        return await asyncio.wait_for(limited(), timeout=timeout)
+    except asyncio.TimeoutError:
+        POSTPROCESS_RESULTS.inc(result='timeout')
+        logger.warning(f"{stage} {name} در {timeout:.0f} ثانیه تمام نشد")
+    except Exception as e:
+        POSTPROCESS_RESULTS.inc(result='failed')
+        logger.error(f"خطا در {stage} {name}: {e}")
+    finally:
+        STAGE_SECONDS.observe(time.monotonic() - started, stage=stage)
+    return None
+
+
+def spill_buffer(artifact: Artifact) -> str:
+    """نوشتن buffer حافظه در فایل موقت برای ffmpeg؛ خروجی مسیر فایل"""
+    fd, path = tempfile.mkstemp(dir=DOWNLOAD_FOLDER, suffix=os.path.splitext(artifact.filename)[1] or '.gif')
+    with os.fdopen(fd, 'wb') as f, artifact.open() as data:
+        f.write(data)
+    return path
+
+
+async def convert_animation(artifact: Artifact):
+    """
+    تبدیل GIF به mp4 بی‌صدا وقتی زمان تبدیل و آپلود mp4 کمتر از آپلود GIF خام پیش‌بینی شود
+
+    پس از تبدیل، فایل کوچک‌تر ارسال می‌شود (زمان تبدیل دیگر هزینه نیست)؛ GIF های داخل حافظه
+    فقط در صورت تصمیم به تبدیل روی دیسک نوشته می‌شوند.
+    """
+    if not GIF_TO_MP4 or not media.ffmpeg_available():
+        return
+    if content_index.contains(artifact.digest):
+        POSTPROCESS_RESULTS.inc(result='skipped')
+        return
+    convert, reason = animation_cost.decide(artifact.file_size, upload_stage.throughput() or DEFAULT_UPLOAD_RATE)
+    logger.info(f"تبدیل GIF {'✓' if convert else '✗'} برای {artifact.filename}: {reason}")
+    if not convert:
+        animation_cost.chose(False)
+        POSTPROCESS_RESULTS.inc(result='gif_kept')
+        return
+    loop = asyncio.get_running_loop()
+    source = artifact.filepath
+    spilled = artifact.buffer is not None
+    if spilled:
+        source = await loop.run_in_executor(executor, spill_buffer, artifact)
+    try:
+        result = await run_postprocess('transcode', GIF_TO_MP4_TIMEOUT + 5, media.gif_to_mp4, source, GIF_TO_MP4_TIMEOUT)
+        if result is None:
+            return
+        if not result['output']:
+            POSTPROCESS_RESULTS.inc(result='failed')
+            logger.error(f"خطا در تبدیل GIF {artifact.filename}: {result['error']}")
+            return
+        animation_cost.record(artifact.file_size, result['size'], result['seconds'])
+        logger.info(
+            f"GIF {artifact.filename} در {result['seconds']:.2f}s از {artifact.file_size / (1024 * 1024):.2f} MB "
+            f"به {result['size'] / (1024 * 1024):.2f} MB تبدیل شد"
+        )
+        if result['size'] >= artifact.file_size:
+            await loop.run_in_executor(executor, os.remove, result['output'])
+            animation_cost.chose(False)
+            POSTPROCESS_RESULTS.inc(result='gif_kept')
+            return
+        animation_cost.chose(True, artifact.file_size - result['size'])
+        POSTPROCESS_RESULTS.inc(result='gif_mp4')
+        await loop.run_in_executor(executor, artifact.discard)
+        artifact.buffer = None
+        artifact.filepath = result['output']
+        artifact.file_size = result['size']
+        artifact.content_type = 'video/mp4'
+        artifact.duration = result['duration']
+        artifact.width = result['width']
+        artifact.height = result['height']
+    finally:
+        if spilled:
+            await loop.run_in_executor(executor, discard_download, source)
+
+
+async def postprocess_artifact(artifact: Artifact):
+    """
+    پس‌پردازش فایل دانلود شده پیش از آپلود: تبدیل GIF یا faststart، مدت، ابعاد و thumbnail ویدیو
+
+    فقط ویدیوهای روی دیسک بزرگ‌تر از POSTPROCESS_MIN_MB که file_id تکراری ندارند؛ هزینه با
+    POSTPROCESS_TIMEOUT محدود و در متریک مرحله postprocess ثبت می‌شود. شکست پس‌پردازش مانع ارسال نیست.
+    """
+    if artifact.content_type == 'image/gif':
+        await convert_animation(artifact)
+        return
+    if not POSTPROCESS or artifact.buffer is not None or not is_video_file(artifact.filepath, artifact.content_type):
+        return
+    if artifact.file_size < POSTPROCESS_MIN_MB * 1024 * 1024 or content_index.contains(artifact.digest):
+        POSTPROCESS_RESULTS.inc(result='skipped')
+        return
+    # مهلت داخلی process برای ffmpeg است؛ مهلت بیرونی برای انتظار در صف و بازنویسی فایل‌های بزرگ
+    result = await run_postprocess(
+        'postprocess', POSTPROCESS_TIMEOUT + 5, media.process, artifact.filepath, True, POSTPROCESS_TIMEOUT,
+    )
+    if result is None:
+        return
+    artifact.duration = result['duration']
+    artifact.width = result['width']
+    artifact.height = result['height']
+    artifact.thumbnail = result['thumbnail']
+    if result['error']:
+        POSTPROCESS_RESULTS.inc(result='unsupported')
+        logger.info(f"پس‌پردازش ناقص {artifact.filename}: {result['error']}")
+    else:
+        POSTPROCESS_RESULTS.inc(result='faststart' if result['faststart'] else 'ok')
+    logger.info(
+        f"پس‌پردازش {artifact.filename} در {result['seconds']:.2f}s: faststart={result['faststart']} "
+        f"{result['width']}x{result['height']} {result['duration']}s thumbnail={'✓' if result['thumbnail'] else '✗'}"
+    )
+
+
+def upload_thumbnail(artifact: Artifact):
+    """thumbnail برای Bot API: مسیر فایل برای سرور محلی، وگرنه bytes (حداکثر 200KB)"""
+    if not artifact.thumbnail:
+        return None
+    path = Path(artifact.thumbnail)
+    return path.absolute() if BOT_API_LOCAL else path.read_bytes()
+
+
+def video_attributes(artifact: Artifact) -> dict:
+    """مدت و ابعاد معلوم ویدیو برای send_video (Bot API و Pyrogram)"""
+    return {key: getattr(artifact, key) for key in ('duration', 'width', 'height') if getattr(artifact, key)}
+
+
+async def upload_artifact(artifact: Artifact):
+    """ارسال فایل به تلگرام (Pyrogram برای فایل‌های بزرگ، Bot API برای بقیه)؛ خروجی پیام ارسال شده"""
+    job = artifact.job
+    status_message = job.status_message
+    current_time = job.current_time
+    filepath = artifact.filepath
+    content_type = artifact.content_type
+    file_size_mb = artifact.file_size / (1024 * 1024)
+    
+    # انتخاب روش ارسال بر اساس سایز فایل
+    if artifact.file_size > BOT_API_UPLOAD_LIMIT:
+        # استفاده از Pyrogram برای فایل‌های بزرگ (50MB تا 2GB)
+        await status_message.edit_text(
+            f"✅ دانلود کامل شد!\n"
+            f"📦 حجم: {file_size_mb:.2f} MB\n"
+            f"⏫ در حال ارسال (Pyrogram برای فایل بزرگ)..."
+        )
+        
+        try:
+            client = await get_started_pyrogram_client()
+            if client:
+                chat_id = job.chat_id
+                
+                # آپلود با سهم پهنای باند خروجی (بدون سقف اتصال برای تلگرام)
+                with bandwidth.stream(job.job_id, 'telegram', EGRESS, limit_connections=False) as stream, \
+                        track_pyrogram_upload():
+                    progress = _upload_progress_callback(stream)
+                    
+                    if artifact.is_animation:
+                        # ارسال GIF به عنوان Animation
+                        message = await client.send_animation(
+                            chat_id=chat_id,
+                            animation=filepath,
+                            caption=download_caption('animation', file_size_mb, current_time),
+                            progress=progress,
+                            **video_attributes(artifact)
+                        )
+                    elif is_video_file(filepath, content_type):
+                        # ارسال ویدیو
+                        message = await client.send_video(
+                            chat_id=chat_id,
+                            video=filepath,
+                            caption=download_caption('video', file_size_mb, current_time),
+                            supports_streaming=True,
+                            thumb=artifact.thumbnail or None,
+                            progress=progress,
+                            **video_attributes(artifact)
+                        )
+                    else:
+                        # ارسال سند
+                        message = await client.send_document(
+                            chat_id=chat_id,
+                            document=filepath,
+                            caption=download_caption('document', file_size_mb, current_time),
+                            progress=progress
+                        )
+                logger.info(f"فایل بزرگ {filepath} با Pyrogram ارسال شد")
+                return message
+            else:
+                raise Exception("Pyrogram client موجود نیست")
+        except Exception as e:
+            logger.error(f"خطا در ارسال با Pyrogram: {e}")
+            raise
+    else:
+        # Bot API برای فایل‌های زیر 50MB (یا تا 2GB با سرور محلی)
+        await status_message.edit_text(
+            f"✅ دانلود کامل شد!\n"
+            f"📦 حجم: {file_size_mb:.2f} MB\n"
+            f"⏫ در حال ارسال..."
+        )
+        if BOT_API_LOCAL and artifact.buffer is None:
+            # سرور محلی فایل را مستقیم از دیسک می‌خواند (file:// بدون multipart)
+            source = nullcontext(Path(filepath).absolute())
+        else:
+            source = artifact.open()
+        # پاسخ سرور محلی پس از آپلود کامل به تلگرام می‌رسد؛ حداقل 1MB/s فرض می‌شود
+        read_timeout = max(300, file_size_mb)
+        with source as f:
+            if artifact.is_animation:
+                # ارسال GIF به عنوان Animation
+                message = await job.bot.send_animation(
+                    chat_id=job.chat_id,
+                    animation=f,
+                    filename=artifact.filename,
+                    caption=download_caption('animation', file_size_mb, current_time),
+                    **video_attributes(artifact),
+                    read_timeout=read_timeout,
+                    write_timeout=300,
+                    connect_timeout=30,
+                    pool_timeout=30
+                )
+            elif is_video_file(filepath, content_type):
+                # ارسال به صورت ویدیو
+                message = await job.bot.send_video(
+                    chat_id=job.chat_id,
+                    video=f,
+                    filename=artifact.filename,
+                    caption=download_caption('video', file_size_mb, current_time),
+                    supports_streaming=True,
+                    thumbnail=upload_thumbnail(artifact),
+                    **video_attributes(artifact),
+                    read_timeout=read_timeout,
+                    write_timeout=300,
+                    connect_timeout=30,
+                    pool_timeout=30
+                )
+            else:
+                # ارسال به صورت سند
+                message = await job.bot.send_document(
+                    chat_id=job.chat_id,
+                    document=f,
+                    filename=artifact.filename,
+                    caption=download_caption('document', file_size_mb, current_time),
+                    read_timeout=read_timeout,
+                    write_timeout=300,
+                    connect_timeout=30,
+                    pool_timeout=30
+                )
+        return message
+
+
+def resume_point(job: Job) -> tuple:
+    """(مسیر فایل ناتمام، validator) برای ادامه دانلود مستقیم کار پیش از restart یا (None, '')"""
+    row = job.resume
+    if not row or row['state'] != 'downloading' or not row['validator'] or not row['filepath']:
+        return None, ''
+    if not os.path.exists(row['filepath']):
+        return None, ''
+    return row['filepath'], row['validator']
+
+
+def restore_artifact(job: Job):
+    """Artifact فایل کاملی که پیش از restart در صف آپلود بود (بدون دانلود دوباره) یا None"""
+    row = job.resume
+    if not row or row['state'] != 'uploading' or not row['filepath']:
+        return None
+    try:
+        if os.path.getsize(row['filepath']) != row['size']:
+            return None
+    except OSError:
+        return None
+    job.size = row['size']
+    artifact = Artifact(job, row['filepath'], row['content_type'], row['size'])
+    artifact.digest = row['digest']
+    return artifact
+
+
+async def download_job(job: Job):
+    """مرحله دانلود یک کار؛ خروجی Artifact آماده آپلود یا None (ارسال مستقیم یا خطا)"""
+    url = job.url
+    status_message = job.status_message
+    
+    filepath = None
+    try:
+        filename = f"file_{job.message_id}"
+        hasher = tail_hasher = None
+        checkpoint = partial(journal_checkpoint, job.journal_id)
+        
+        # کار ادامه‌یافته پس از restart که فایلش کامل دانلود شده بود
+        artifact = restore_artifact(job)
+        if artifact is not None:
+            await status_message.edit_text(
+                f"✅ فایل پیش از راه‌اندازی دوباره دانلود شده بود!\n"
+                f"📦 حجم: {artifact.file_size / (1024 * 1024):.2f} MB\n"
+                f"⏫ در صف ارسال..."
+            )
+            return artifact
+        await journal_call(job_journal.update, job, 'probing')
+        
+        # بررسی اینکه آیا از سایت‌های ویدیویی است
+        if is_video_site(url):
+            # استفاده از yt-dlp برای دانلود ویدیو
+            if DIRECT_SEND_ONLY:
+                await status_message.edit_text(
+                    "❌ دانلود ویدیو از این سایت در محیط محدود امکان‌پذیر نیست.\n"
+                    "لطفاً متغیر DIRECT_SEND_ONLY را غیرفعال کنید."
+                )
                 return
-            except Exception as direct_send_error:
-                logger.warning(f"ارسال مستقیم توسط تلگرام ناکام ماند: {direct_send_error}")
-                # اگر در محیط محدود هستیم، دانلود محلی را انجام ندهیم
-                if DIRECT_SEND_ONLY:
-                    await status_message.edit_text(
-                        "❌ ارسال مستقیم توسط تلگرام ناموفق بود و دانلود محلی در این محیط مجاز نیست.\n"
-                        "لطفاً لینک دیگری ارسال کنید یا متغیر DIRECT_SEND_ONLY را غیرفعال کنید."
-                    )
+            
+            await status_message.edit_text("🎬 شناسایی سایت ویدیویی - استفاده از yt-dlp...")
+            tail_hasher = TailHasher() if content_index.enabled else None
+            filepath, result, total_size = await download_video_ytdlp(
+                url, status_message, job.job_id, checkpoint, tag=str(job.journal_id or job.job_id), hasher=tail_hasher,
+            )
+        else:
+            # تصمیم‌گیری بر اساس سابقه هاست و probe ارزان HEAD
+            loop = asyncio.get_running_loop()
+            as_video = is_video_file(url)
+            resume_path, validator = resume_point(job)
+            if resume_path:
+                # بخشی از فایل پیش از restart دانلود شده؛ ادامه آن ارزان‌تر از هر گزینه دیگر است
+                try_direct, reason = False, f"ادامه فایل ناتمام {resume_path}"
+            else:
+                try_direct, reason = direct_send_advisor.decide(url, as_video)
+            if try_direct is None:
+                if job.probe is None:
+                    CACHE_REQUESTS.inc(cache='probe', result='miss')
+                    with STAGE_SECONDS.time(stage='probe'):
+                        job.probe = await loop.run_in_executor(executor, direct_send_advisor.probe, url)
+                else:
+                    CACHE_REQUESTS.inc(cache='probe', result='hit')
+                try_direct, reason = direct_send_advisor.decide(url, as_video, job.probe)
+            # در محیط محدود، دانلود محلی ممکن نیست پس همیشه ارسال مستقیم را امتحان کن
+            if DIRECT_SEND_ONLY:
+                try_direct = True
+            logger.info(f"ارسال مستقیم {'✓' if try_direct else '✗'} برای {url[:80]}: {reason}")
+
+            # تلاش برای ارسال مستقیم توسط سرورهای تلگرام (بدون دانلود محلی)
+            if try_direct:
+                started = time.monotonic()
+                try:
+                    await status_message.edit_text("⏳ تلاش برای ارسال مستقیم توسط تلگرام...")
+                    if as_video:
+                        await job.bot.send_video(
+                            chat_id=job.chat_id,
+                            video=url,
+                            caption="📹 ویدیو (ارسال مستقیم توسط تلگرام)",
+                            supports_streaming=True
+                        )
+                    else:
+                        await job.bot.send_document(
+                            chat_id=job.chat_id,
+                            document=url,
+                            caption="📄 فایل (ارسال مستقیم توسط تلگرام)"
+                        )
+                    direct_send_advisor.record(url, True, time.monotonic() - started)
+                    loop.run_in_executor(executor, direct_send_advisor.save)
+                    job.delivered = True
+                    await status_message.delete()
                     return
-                await status_message.edit_text("⏬ دانلود محلی آغاز شد...")
+                except Exception as direct_send_error:
+                    direct_send_advisor.record(url, False, time.monotonic() - started)
+                    loop.run_in_executor(executor, direct_send_advisor.save)
+                    logger.warning(f"ارسال مستقیم توسط تلگرام ناکام ماند: {direct_send_error}")
+                    # اگر در محیط محدود هستیم، دانلود محلی را انجام ندهیم
+                    if DIRECT_SEND_ONLY:
+                        await status_message.edit_text(
+                            "❌ ارسال مستقیم توسط تلگرام ناموفق بود و دانلود محلی در این محیط مجاز نیست.\n"
+                            "لطفاً لینک دیگری ارسال کنید یا متغیر DIRECT_SEND_ONLY را غیرفعال کنید."
+                        )
+                        return
+            await status_message.edit_text("⏬ دانلود محلی آغاز شد...")
 
             # دانلود محلی با نوار پیشرفت
-            filepath, result, total_size = await download_file(url, filename, status_message)
+            known_size = (job.probe or {}).get('size', 0)
+            hasher = new_hasher() if content_index.enabled else None
+            await journal_call(job_journal.update, job, 'downloading')
+            filepath, result, total_size = await download_file(
+                url, filename, status_message, known_size, job.job_id, in_memory=not resume_path, hasher=hasher,
+                resume_path=resume_path, validator=validator, on_progress=checkpoint,
+            )
         
         if filepath is None:
             await status_message.edit_text(result)
@@ -1085,9 +2838,32 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         content_type = result
         
+        if not isinstance(filepath, str):
+            # فایل کوچک در حافظه؛ نام فقط برای تشخیص نوع و ارسال
+            buffer = filepath
+            filepath = None
+            if not os.path.splitext(filename)[1]:
+                filename += get_file_extension_from_url(url, content_type)
+            artifact = Artifact(job, os.path.join(DOWNLOAD_FOLDER, filename), content_type, buffer.tell(), buffer=buffer)
+            if hasher is not None:
+                artifact.digest = content_key(hasher.hexdigest(), artifact.file_size)
+            if artifact.file_size > CLOUD_UPLOAD_LIMIT:
+                # حجم اعلام‌شده نادرست بود؛ Pyrogram و سرور Bot API محلی فایل روی دیسک می‌خواهند
+                await asyncio.get_running_loop().run_in_executor(executor, _spill_to_disk, artifact)
+            job.size = artifact.file_size
+            admission.costs.observe(host_of(url), artifact.file_size)
+            await status_message.edit_text(
+                f"✅ دانلود کامل شد!\n"
+                f"📦 حجم: {artifact.file_size / (1024 * 1024):.2f} MB\n"
+                f"⏫ در صف ارسال..."
+            )
+            return artifact
+        
         # بررسی حجم فایل
         file_size = os.path.getsize(filepath)
         file_size_mb = file_size / (1024 * 1024)
+        job.size = file_size
+        admission.costs.observe(host_of(url), file_size)
         
         # بررسی محدودیت 2 گیگابایت (با Pyrogram)
         if file_size_mb > 2000:
@@ -1096,115 +2872,28 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"حداکثر سایز مجاز ۲ گیگابایت هست.\n"
                 f"لطفاً ویدیو با کیفیت پایین‌تر یا فایل کوچک‌تر ارسال کنید."
             )
-            os.remove(filepath)
+            await cleanup_failed_download(filepath)
             return
         
         # آپدیت پیام وضعیت
         await status_message.edit_text(
             f"✅ دانلود کامل شد!\n"
             f"📦 حجم: {file_size_mb:.2f} MB\n"
-            f"⏫ در حال ارسال..."
+            f"⏫ در صف ارسال..."
         )
         
-        # انتخاب روش ارسال بر اساس سایز فایل
-        if file_size_mb > 50:
-            # استفاده از Pyrogram برای فایل‌های بزرگ (50MB تا 2GB)
-            await status_message.edit_text(
-                f"✅ دانلود کامل شد!\n"
-                f"📦 حجم: {file_size_mb:.2f} MB\n"
-                f"⏫ در حال ارسال (Pyrogram برای فایل بزرگ)..."
-            )
-            
-            try:
-                client = await get_pyrogram_client()
-                if client:
-                    # چک کردن اینکه آیا قبلاً متصل است
-                    try:
-                        if not client.is_connected:
-                            await asyncio.wait_for(client.start(), timeout=30)
-                    except (AttributeError, asyncio.TimeoutError):
-                        logger.warning("نتوانستند ارتباط Pyrogram client را بررسی کنید")
-                    
-                    # دریافت chat_id از update
-                    chat_id = update.message.chat_id
-                    
-                    if content_type == 'image/gif':
-                        # ارسال GIF به عنوان Animation
-                        await client.send_animation(
-                            chat_id=chat_id,
-                            animation=filepath,
-                            caption=f"🎞️ GIF دانلود شده\n📦 حجم: {file_size_mb:.2f} MB\n🕐 {current_time}"
-                        )
-                    elif is_video_file(filepath, content_type):
-                        # ارسال ویدیو
-                        await client.send_video(
-                            chat_id=chat_id,
-                            video=filepath,
-                            caption=f"📹 ویدیو دانلود شده\n📦 حجم: {file_size_mb:.2f} MB\n🕐 {current_time}",
-                            supports_streaming=True
-                        )
-                    else:
-                        # ارسال سند
-                        await client.send_document(
-                            chat_id=chat_id,
-                            document=filepath,
-                            caption=f"📄 فایل دانلود شده\n📦 حجم: {file_size_mb:.2f} MB\n🕐 {current_time}"
-                        )
-                    
-                    # فقط اگر ما آن را start کردیم, stop کنیم
-                    try:
-                        if hasattr(client, 'is_connected') and client.is_connected:
-                            await asyncio.wait_for(client.stop(), timeout=10)
-                    except (AttributeError, asyncio.TimeoutError):
-                        logger.warning("نتوانستند Pyrogram client را بسته کنید")
-                    logger.info(f"فایل بزرگ {filepath} با Pyrogram ارسال شد")
-                else:
-                    raise Exception("Pyrogram client موجود نیست")
-            except Exception as e:
-                logger.error(f"خطا در ارسال با Pyrogram: {e}")
-                raise
-        else:
-            # استفاده از Bot API معمولی برای فایل‌های کوچک (زیر 50MB)
-            with open(filepath, 'rb') as f:
-                if content_type == 'image/gif':
-                    # ارسال GIF به عنوان Animation
-                    await update.message.reply_animation(
-                        animation=f,
-                        caption=f"🎞️ GIF دانلود شده\n📦 حجم: {file_size_mb:.2f} MB\n🕐 {current_time}",
-                        read_timeout=300,
-                        write_timeout=300,
-                        connect_timeout=30,
-                        pool_timeout=30
-                    )
-                elif is_video_file(filepath, content_type):
-                    # ارسال به صورت ویدیو
-                    await update.message.reply_video(
-                        video=f,
-                        caption=f"📹 ویدیو دانلود شده\n📦 حجم: {file_size_mb:.2f} MB\n🕐 {current_time}",
-                        supports_streaming=True,
-                        read_timeout=300,
-                        write_timeout=300,
-                        connect_timeout=30,
-                        pool_timeout=30
-                    )
-                else:
-                    # ارسال به صورت سند
-                    await update.message.reply_document(
-                        document=f,
-                        caption=f"📄 فایل دانلود شده\n📦 حجم: {file_size_mb:.2f} MB\n🕐 {current_time}",
-                        read_timeout=300,
-                        write_timeout=300,
-                        connect_timeout=30,
-                        pool_timeout=30
-                    )
-        
-        # حذف پیام وضعیت
-        await status_message.delete()
+        artifact = Artifact(job, filepath, content_type, file_size)
+        if hasher is not None:
+            artifact.digest = content_key(hasher.hexdigest(), file_size)
+        elif content_index.enabled:
+            # فایل yt-dlp: hash همزمان با دانلود؛ اگر خروجی نهایی همان بایت‌های دانلود شده نباشد
+            # (merge صدا و تصویر یا remux توسط post-processor) یک بار خواندن فایل نهایی
+            digest = tail_hasher.digest(file_size) if tail_hasher is not None else None
+            if digest is None:
+                digest = await asyncio.get_running_loop().run_in_executor(executor, hash_file, filepath)
+            artifact.digest = content_key(digest, file_size)
+        return artifact
         
-        # حذف فایل موقت
-        os.remove(filepath)
-        logger.info(f"فایل {filepath} با موفقیت ارسال و حذف شد.")
-    
     except asyncio.TimeoutError:
         logger.error("خطا: Timeout در پردازش فایل")
         await status_message.edit_text(
@@ -1212,9 +2901,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "این ممکن است به دلیل حجم زیاد فایل یا سرعت پایین اینترنت باشد.\n"
             "لطفاً فایل کوچک‌تری انتخاب کنید."
         )
-        if filepath and os.path.exists(filepath):
-            os.remove(filepath)
-        cleanup_partial_files()
+        await cleanup_failed_download(filepath)
     
     except MemoryError:
         logger.error("خطا: کمبود حافظه (OOM)")
@@ -1222,31 +2909,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "❌ حافظه سرور کافی نیست.\n"
             "لطفاً فایل کوچک‌تری ارسال کنید."
         )
-        if filepath and os.path.exists(filepath):
-            os.remove(filepath)
-        cleanup_partial_files()
-        cleanup_old_files()
+        await cleanup_failed_download(filepath, old_files=True)
     
     except Exception as e:
-        error_msg = str(e)
-        logger.error(f"خطا در پردازش فایل: {error_msg}")
-        
-        # پیام خطای کاربرپسند
-        if "timed out" in error_msg.lower() or "timeout" in error_msg.lower():
-            user_msg = "❌ زمان اتصال تمام شد. لطفاً دوباره تلاش کنید."
-        elif "memory" in error_msg.lower() or "out of memory" in error_msg.lower():
-            user_msg = "❌ حافظه کافی نیست. لطفاً فایل کوچک‌تری ارسال کنید."
-        elif "connection" in error_msg.lower():
-            user_msg = "❌ مشکل در اتصال به سرور. لطفاً دوباره تلاش کنید."
-        else:
-            user_msg = f"❌ خطا در پردازش فایل: {error_msg[:100]}"
-        
-        await status_message.edit_text(user_msg)
+        logger.error(f"خطا در پردازش فایل: {e}")
+        await status_message.edit_text(user_error_message(e))
         
         # حذف فایل در صورت خطا
-        if filepath and os.path.exists(filepath):
-            os.remove(filepath)
-        cleanup_partial_files()
+        await cleanup_failed_download(filepath)
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1263,40 +2933,46 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ خطایی رخ داد. لطفاً دوباره تلاش کنید.")
 
 
-def main():
-    """تابع اصلی برای اجرای ربات"""
-    # بررسی توکن
-    if not BOT_TOKEN:
-        print("❌ توکن ربات یافت نشد!")
-        print("لطفاً فایل .env را بررسی کنید یا توکن را در کد تنظیم کنید.")
-        return
-    
-    print(f"✅ توکن ربات بارگذاری شد")
-    print(f"🔑 API ID: {API_ID}")
-    print(f"📊 محدودیت حجم فایل: {MAX_FILE_SIZE_MB} MB")
-    
-    # پاکسازی فایل‌های قدیمی و ناتمام در استارت
-    print("🧹 در حال پاکسازی فایل‌های قدیمی...")
-    cleanup_old_files()
-    cleanup_partial_files()
-    cleanup_old_links()
-    print("✅ پاکسازی کامل شد")
-    
-    # شروع Flask server برای keep-alive (برای Render.com)
-    try:
-        from keep_alive import keep_alive
-        keep_alive()
-        print("🌐 Flask server برای keep-alive راه‌اندازی شد")
-    except ImportError:
-        print("⚠️ keep_alive.py یافت نشد - در حالت عادی اجرا می‌شود")
-    
-    # ساخت Application با پشتیبانی از پراکسی و تایم‌اوت بالا برای آپلود فایل‌های بزرگ
-    app_builder = Application.builder().token(BOT_TOKEN)
-    
-    # تنظیم HTTPXRequest با تایم‌اوت بالا برای آپلود فایل‌های بزرگ
-    from telegram.request import HTTPXRequest
+async def start_http_server(application):
+    """راه‌اندازی سرور aiohttp برای health check و (در حالت webhook) دریافت آپدیت‌ها"""
+    global http_runner, webhook_receiver
+    if BOT_MODE == 'webhook':
+        webhook_receiver = WebhookReceiver(application, WEBHOOK_SECRET, WEBHOOK_WORKERS)
+        webhook_receiver.start()
+    app = create_app(
+        WEBHOOK_PATH if webhook_receiver else None, webhook_receiver, lifecycle,
+        worker_metrics=(
+            (lambda: {str(index): snapshot['metrics'] for index, snapshot in worker_snapshots.items()})
+            if SUPERVISOR_MODE else None
+        ),
+    )
+    http_runner = await start_server(app)
+
+
+async def stop_http_server():
+    """توقف سرور HTTP و worker های webhook"""
+    if webhook_receiver is not None:
+        await webhook_receiver.stop()
+    if http_runner is not None:
+        await http_runner.cleanup()
+
+
+def bot_api_options() -> dict:
+    """آرگومان‌های Bot برای سرور Bot API جایگزین یا محلی"""
+    options = {}
+    if BOT_API_URL:
+        options['base_url'] = BOT_API_URL
+    if BOT_API_LOCAL:
+        if BOT_API_FILE_URL:
+            options['base_file_url'] = BOT_API_FILE_URL
+        options['local_mode'] = True
+    return options
+
+
+def telegram_request() -> HTTPXRequest:
+    """HTTPXRequest با تایم‌اوت بالا برای آپلود فایل‌های بزرگ (و پراکسی در صورت تنظیم)"""
     request_kwargs = {
-        'connection_pool_size': 8,
+        'connection_pool_size': TELEGRAM_POOL_SIZE,
         'connect_timeout': 30.0,
         'read_timeout': 300.0,
         'write_timeout': 300.0,
@@ -1308,10 +2984,233 @@ def main():
         request_kwargs['proxy_url'] = PROXY_URL
         print(f"🌐 پراکسی برای Telegram Bot تنظیم شد: {PROXY_URL}")
     
-    request = HTTPXRequest(**request_kwargs)
-    app_builder.request(request)
+    return HTTPXRequest(**request_kwargs)
+
+
+def start_pipeline(bot):
+    """صف تحویل، worker های دانلود و آپلود و کنترل حافظه (در حالت supervisor فقط در پروسه‌های worker)"""
+    global upload_queue
+    upload_queue = asyncio.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+    memory_governor.on_throttle = lambda kind: MEMORY_THROTTLED.inc(stage=kind)
+    memory_governor.start()
+    if memory_governor.enabled:
+        print(f"🧠 بودجه حافظه: {memory_governor.budget / (1024 * 1024):.0f} MB")
+    for worker_id in range(MAX_CONCURRENT_JOBS):
+        worker_tasks.append(asyncio.create_task(download_worker(worker_id)))
+    for worker_id in range(UPLOAD_WORKERS):
+        worker_tasks.append(asyncio.create_task(upload_worker(worker_id)))
+    background_tasks.append(asyncio.create_task(queue_feedback_loop()))
+    print(f"👷 {MAX_CONCURRENT_JOBS} worker دانلود و {UPLOAD_WORKERS} worker آپلود راه‌اندازی شد")
+
+
+async def stop_pipeline():
+    """توقف worker ها و ذخیره داده‌های ماندگار"""
+    for task in worker_tasks + background_tasks:
+        task.cancel()
+    await memory_governor.stop()
+    await stop_pyrogram_client()
+    # بستن نمونه‌های YoutubeDL (ذخیره cookie jar در فایل کوکی)
+    await asyncio.get_running_loop().run_in_executor(executor, ytdl_pool.clear)
+    direct_send_advisor.save(force=True)
+    content_index.save(force=True)
+    # پس از نوشتن‌های در صف thread ژورنال
+    await journal_call(job_journal.close)
+    journal_executor.shutdown(wait=False)
+
+
+async def supervise_worker(index: int):
+    """اجرای یک پروسه worker و راه‌اندازی دوباره آن در صورت خروج (با فاصله افزایشی)"""
+    delay = 1.0
+    while lifecycle.accepting:
+        started = time.monotonic()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__),
+            env=dict(os.environ, WORKER_INDEX=str(index), INSTANCE_ID=INSTANCE_ID),
+        )
+        worker_processes[index] = process
+        code = await process.wait()
+        del worker_processes[index]
+        if not lifecycle.accepting:
+            return
+        if time.monotonic() - started > 60:
+            delay = 1.0
+        logger.error(f"پروسه worker {index} با کد {code} خارج شد؛ راه‌اندازی دوباره تا {delay:.0f} ثانیه دیگر")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30.0)
+
+
+async def stop_worker_processes(timeout: float = 30.0):
+    """SIGTERM به پروسه‌های worker (که هر کدام تخلیه می‌کنند) و انتظار برای خروج آن‌ها (پس از timeout، kill)"""
+    processes = list(worker_processes.values())
+    for process in processes:
+        try:
+            process.terminate()
+        except ProcessLookupError:
+            pass
+    try:
+        await asyncio.wait_for(asyncio.gather(*(process.wait() for process in processes)), timeout=timeout)
+    except asyncio.TimeoutError:
+        for process in processes:
+            if process.returncode is None:
+                process.kill()
+
+
+def worker_snapshot() -> dict:
+    """وضعیت این پروسه worker برای پروسه اصلی (متریک‌ها، آمار پنل ادمین و /loop)"""
+    return {
+        'pid': os.getpid(),
+        'time': time.time(),
+        'metrics': REGISTRY.snapshot(),
+        'admission': admission.stats(),
+        'download': download_stage.summary(),
+        'upload': upload_stage.summary(),
+        'loop': {
+            'lag': loop_monitor.percentiles(),
+            'max_lag': loop_monitor.max_lag,
+            'blocks': loop_monitor.block_count,
+            'last_block': loop_monitor.blocks[-1] if loop_monitor.blocks else None,
+        },
+        'rss': memory_governor.rss,
+        'ytdl_pool': ytdl_pool.stats(),
+        'dedup': content_index.stats(),
+        'info_cache': info_cache.stats(),
+    }
+
+
+def _write_worker_snapshot(snapshot: dict):
+    """ذخیره وضعیت این پروسه worker در پوشه مشترک (برای اجرا در executor)"""
+    os.makedirs(WORKER_SNAPSHOT_FOLDER, exist_ok=True)
+    path = os.path.join(WORKER_SNAPSHOT_FOLDER, f'w{WORKER_INDEX}.json')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def _read_worker_snapshots(pids: dict) -> dict:
+    """وضعیت پروسه‌های worker فعلی {shard: snapshot}؛ فایل پروسه قبلی همان shard نادیده گرفته می‌شود (در executor)"""
+    snapshots = {}
+    for index, pid in pids.items():
+        try:
+            with open(os.path.join(WORKER_SNAPSHOT_FOLDER, f'w{index}.json'), encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if snapshot.get('pid') == pid:
+            snapshots[index] = snapshot
+    return snapshots
+
+
+async def publish_snapshot_loop():
+    """پروسه worker: انتشار دوره‌ای وضعیت برای پروسه اصلی"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(executor, _write_worker_snapshot, worker_snapshot())
+        except Exception as e:
+            logger.debug(f"خطا در ذخیره وضعیت worker: {e}")
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def collect_snapshots_loop():
+    """پروسه اصلی در حالت supervisor: خواندن دوره‌ای وضعیت پروسه‌های worker"""
+    global worker_snapshots
+    loop = asyncio.get_running_loop()
+    while True:
+        pids = {index: process.pid for index, process in worker_processes.items() if process.returncode is None}
+        worker_snapshots = await loop.run_in_executor(executor, _read_worker_snapshots, pids)
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def run_worker():
+    """پروسه worker در حالت supervisor: اجرای کارهای shard خود از ژورنال (بدون دریافت آپدیت)"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    bot = Bot(BOT_TOKEN, request=telegram_request(), **bot_api_options())
+    await bot.initialize()
+    try:
+        register_metric_callbacks()
+        loop_monitor.start()
+        start_pipeline(bot)
+        background_tasks.append(asyncio.create_task(publish_snapshot_loop()))
+        if WARMUP_IMPORTS:
+            background_tasks.append(asyncio.create_task(warmup_imports()))
+        await resume_jobs(bot, WORKER_INDEX, include_own=True)
+        background_tasks.append(asyncio.create_task(dispatch_loop(bot)))
+        background_tasks.append(asyncio.create_task(adopt_loop(bot, WORKER_INDEX)))
+        lifecycle.serving()
+        logger.info(f"👷 پروسه worker {WORKER_INDEX} (pid {os.getpid()}) آماده است")
+        await stop_event.wait()
+        lifecycle.begin_drain()
+        await drain_jobs()
+    finally:
+        await loop_monitor.stop()
+        await stop_pipeline()
+        await bot.shutdown()
+
+
+def build_application() -> Application:
+    """ساخت Application ربات با هندلرها، worker ها و زمان‌بندها"""
+    # ساخت Application با پشتیبانی از پراکسی و تایم‌اوت بالا برای آپلود فایل‌های بزرگ
+    app_builder = Application.builder().token(BOT_TOKEN)
+    app_builder.request(telegram_request())
+    options = bot_api_options()
+    if 'base_url' in options:
+        # سرور Bot API جایگزین (مثلاً سرور جعلی تست بار یا سرور محلی)
+        app_builder.base_url(options['base_url'])
+    if 'base_file_url' in options:
+        app_builder.base_file_url(options['base_file_url'])
+    if options.get('local_mode'):
+        app_builder.local_mode(True)
+        print(f"🛰 سرور Bot API محلی: {BOT_API_URL} (آپلود تا {BOT_API_UPLOAD_LIMIT // (1024 * 1024)}MB با مسیر فایل، بدون Pyrogram)")
     print(f"✅ تایم‌اوت برای آپلود فایل‌های بزرگ تنظیم شد (300 ثانیه)")
     
+    async def on_startup(application):
+        """راه‌اندازی سرور HTTP و worker های دانلود و آپلود (یا پروسه‌های worker در حالت supervisor)"""
+        await start_http_server(application)
+        register_metric_callbacks()
+        
+        async def send_loop_alert(text):
+            await application.bot.send_message(chat_id=ADMIN_ID, text=text[:4000])
+        
+        loop_monitor.on_alert = send_loop_alert
+        loop_monitor.start()
+        lifecycle.progress = pipeline_progress
+        if job_journal.enabled:
+            background_tasks.append(asyncio.create_task(heartbeat_loop()))
+        if SUPERVISOR_MODE:
+            await journal_call(job_journal.reshard, WORKER_PROCESSES)
+            for index in range(WORKER_PROCESSES):
+                background_tasks.append(asyncio.create_task(supervise_worker(index)))
+            background_tasks.append(asyncio.create_task(collect_snapshots_loop()))
+            print(f"🧩 حالت supervisor: {WORKER_PROCESSES} پروسه worker (تقسیم بر اساس {SHARD_BY})")
+        else:
+            start_pipeline(application.bot)
+            if job_journal.enabled:
+                spawn_task(resume_jobs(application.bot))
+                background_tasks.append(asyncio.create_task(adopt_loop(application.bot)))
+        # کارهای نگهداری و بارگذاری ماژول‌ها بعد از شروع پاسخ‌گویی
+        asyncio.get_running_loop().run_in_executor(executor, startup_maintenance)
+        if WARMUP_IMPORTS:
+            background_tasks.append(asyncio.create_task(warmup_imports()))
+        lifecycle.serving()
+    
+    async def on_shutdown(application):
+        """توقف worker ها و ذخیره داده‌های ماندگار هنگام خاموش شدن"""
+        await loop_monitor.stop()
+        await stop_http_server()
+        await stop_worker_processes()
+        await stop_pipeline()
+    
+    app_builder.post_init(on_startup)
+    app_builder.post_shutdown(on_shutdown)
+    
     application = app_builder.build()
     
     # اضافه کردن هندلرها
@@ -1319,6 +3218,10 @@ def main():
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("admin", admin_panel))
     application.add_handler(CommandHandler("check", check_user))
+    application.add_handler(CommandHandler("loop", loop_health))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("memsnap", memsnap_command))
+    application.add_handler(CommandHandler("tasks", tasks_command))
     application.add_handler(CallbackQueryHandler(admin_callback))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
@@ -1345,10 +3248,135 @@ def main():
     else:
         print("⚠️ JobQueue در دسترس نیست. برای فعال‌سازی, python-telegram-bot[job-queue] را نصب کنید.")
     
+    return application
+
+
+async def run_webhook(application: Application):
+    """اجرای ربات در حالت webhook: آپدیت‌ها توسط سرور aiohttp روی همین event loop دریافت می‌شوند"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        webhook_url = WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
+        await application.bot.set_webhook(
+            url=webhook_url,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        print(f"🔗 Webhook تنظیم شد: {webhook_url}")
+        await stop_event.wait()
+    finally:
+        # webhook حذف نمی‌شود (نمونه جدید آن را تنظیم کرده)؛ آپدیت‌های تازه با 503 به آن سپرده می‌شوند
+        lifecycle.begin_drain()
+        await webhook_receiver.drain()
+        lifecycle.updates_released = True
+        await application.stop()
+        await drain()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def run_polling(application: Application):
+    """
+    اجرای ربات در حالت polling با تخلیه آرام
+
+    با SIGTERM ابتدا polling متوقف و آخرین offset تایید می‌شود تا نمونه جدید بلافاصله دریافت آپدیت‌ها را
+    از همان‌جا شروع کند، سپس آپدیت‌های دریافت شده پردازش و کارها تخلیه می‌شوند.
+
+    جایگزینی بدون قطعی فقط در حالت webhook پشتیبانی می‌شود: تلگرام در هر لحظه یک getUpdates را می‌پذیرد
+    و تا وقتی نمونه قبلی polling می‌کند، نمونه جدید فقط 409 Conflict می‌گیرد.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        await stop_event.wait()
+    finally:
+        lifecycle.begin_drain()
+        # polling پیش از تخلیه کارها متوقف می‌شود تا getUpdates نمونه جدید با 409 Conflict رد نشود؛
+        # شکست تایید offset مانع تخلیه و سپردن کارها نیست
+        try:
+            if application.updater.running:
+                await application.updater.stop()
+            lifecycle.updates_released = True
+            logger.info("🚰 دریافت آپدیت‌ها متوقف و offset به نمونه بعدی سپرده شد")
+        except Exception as e:
+            logger.error(f"خطا در توقف polling: {e}")
+        await application.stop()
+        await drain()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def main():
+    """تابع اصلی برای اجرای ربات"""
+    # بررسی توکن
+    if not BOT_TOKEN:
+        print("❌ توکن ربات یافت نشد!")
+        print("لطفاً فایل .env را بررسی کنید یا توکن را در کد تنظیم کنید.")
+        return
+    
+    print(f"✅ توکن ربات بارگذاری شد")
+    if BOT_API_LOCAL and not BOT_API_URL:
+        print("❌ برای سرور Bot API محلی (BOT_API_LOCAL) متغیر BOT_API_URL لازم است.")
+        return
+    print(f"🔑 API ID: {API_ID}")
+    print(f"📊 محدودیت حجم فایل: {MAX_FILE_SIZE_MB} MB")
+    
+    # بارگذاری آمار ارسال مستقیم هاست‌ها
+    direct_send_advisor.load()
+    content_index.load()
+    job_journal.open()
+    if WORKER_PROCESSES and not job_journal.enabled:
+        print("❌ حالت چند پروسه‌ای (WORKER_PROCESSES) به ژورنال کارها (JOB_JOURNAL) نیاز دارد.")
+        return
+    if WORKER_INDEX is not None:
+        job_journal.instance = INSTANCE_ID
+        asyncio.run(run_worker())
+        return
+    job_journal.register(INSTANCE_ID)
+    
+    application = build_application()
+    
     # شروع ربات
     print("🤖 ربات در حال اجرا است...")
     print("برای توقف ربات از Ctrl+C استفاده کنید.")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if BOT_MODE == 'webhook':
+        if not WEBHOOK_URL:
+            print("❌ برای حالت webhook متغیر WEBHOOK_URL لازم است.")
+            return
+        print(f"🌐 حالت webhook با {WEBHOOK_WORKERS} worker پردازش آپدیت")
+        asyncio.run(run_webhook(application))
+    else:
+        # حالت polling برای توسعه محلی (health check همچنان روی سرور aiohttp)
+        print("🔁 حالت polling")
+        asyncio.run(run_polling(application))
 
 
 if __name__ == '__main__':
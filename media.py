@@ -0,0 +1,249 @@
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import time
+
+ISO_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+# محدودیت‌های thumbnail در تلگرام: JPEG، حداکثر 320 پیکسل و 200KB
+THUMB_SIZE = 320
+# پسوند GIF تبدیل شده به mp4 بی‌صدا؛ از روی نام پس از restart هم به صورت Animation ارسال می‌شود
+ANIMATION_SUFFIX = '.gif.mp4'
+
+
+async def run(command: list, timeout: float, capture: bool = False) -> bytes:
+    """
+    اجرای ffmpeg/ffprobe به صورت subprocess حلقه asyncio؛ خروجی stdout (اگر capture)
+
+    مثل subprocess.run با check=True خطا می‌دهد (CalledProcessError یا TimeoutExpired)؛ در timeout
+    یا لغو کار، پروسه فرزند kill می‌شود تا ffmpeg رها شده CPU و دیسک را مصرف نکند.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE if capture else subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(command, timeout) from None
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+    return stdout
+
+
+def error_text(error) -> str:
+    """پیام کوتاه خطای ffmpeg/ffprobe (انتهای stderr) یا خود استثنا"""
+    if isinstance(error, subprocess.CalledProcessError):
+        lines = (error.stderr or b'').decode(errors='replace').strip().splitlines()
+        return lines[-1][:200] if lines else f'کد خروج {error.returncode}'
+    if isinstance(error, subprocess.TimeoutExpired):
+        return f'پس از {error.timeout:g} ثانیه متوقف شد'
+    return str(error) or error.__class__.__name__
+
+
+async def faststart(path: str, timeout: float):
+    """
+    remux بدون کدگذاری دوباره (ffmpeg -c copy -movflags +faststart) تا moov در ابتدای فایل باشد
+
+    بدون moov در ابتدا تلگرام و پخش‌کننده‌ها پیش از رسیدن کل فایل مدت و ابعاد را نمی‌دانند و
+    پخش stream شروع نمی‌شود. فایل اصلی فقط پس از موفقیت ffmpeg جایگزین می‌شود.
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise FileNotFoundError('ffmpeg نصب نیست')
+    root, ext = os.path.splitext(path)
+    # پسوند همان فایل تا ffmpeg همان muxer (mp4 یا mov) را انتخاب کند
+    tmp_path = f'{root}.faststart{ext}'
+    command = [
+        ffmpeg, '-nostdin', '-loglevel', 'error', '-y', '-i', path, '-map', '0', '-dn', '-ignore_unknown',
+        '-c', 'copy', '-movflags', '+faststart', tmp_path,
+    ]
+    try:
+        await run(command, timeout)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+async def probe(path: str, timeout: float = 10.0) -> dict:
+    """مدت (ثانیه) و ابعاد نمایش اولین stream ویدیو با ffprobe (با احتساب چرخش)"""
+    ffprobe = shutil.which('ffprobe')
+    if not ffprobe:
+        raise FileNotFoundError('ffprobe نصب نیست')
+    command = [
+        ffprobe, '-v', 'error', '-select_streams', 'v:0', '-of', 'json',
+        '-show_entries', 'format=duration:stream=width,height:stream_tags=rotate:stream_side_data=rotation', path,
+    ]
+    data = json.loads(await run(command, timeout, capture=True))
+    info = {'duration': round(float(data.get('format', {}).get('duration') or 0)), 'width': 0, 'height': 0}
+    streams = data.get('streams') or []
+    if streams:
+        stream = streams[0]
+        width, height = int(stream.get('width') or 0), int(stream.get('height') or 0)
+        # قدیمی: تگ rotate؛ ffmpeg جدید: ماتریس نمایش در side data
+        rotation = stream.get('tags', {}).get('rotate') or next(
+            (item['rotation'] for item in stream.get('side_data_list', []) if 'rotation' in item), 0
+        )
+        if abs(int(float(rotation))) % 180 == 90:
+            width, height = height, width
+        info['width'], info['height'] = width, height
+    return info
+
+
+async def thumbnail(path: str, output: str, at: float, timeout: float) -> bool:
+    """ذخیره یک فریم به عنوان JPEG کوچک با ffmpeg (در صورت نصب بودن)"""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return False
+    command = [
+        ffmpeg, '-nostdin', '-loglevel', 'error', '-y', '-ss', f'{at:.2f}', '-i', path, '-frames:v', '1',
+        '-vf', f'scale={THUMB_SIZE}:{THUMB_SIZE}:force_original_aspect_ratio=decrease', '-q:v', '5', output,
+    ]
+    try:
+        await run(command, timeout)
+    except (subprocess.SubprocessError, OSError):
+        return False
+    return os.path.exists(output) and 0 < os.path.getsize(output) <= 200 * 1024
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which('ffmpeg') is not None
+
+
+async def gif_to_mp4(path: str, timeout: float = 60.0) -> dict:
+    """
+    تبدیل GIF به mp4 بی‌صدای H.264 (همان قالبی که تلگرام خودش GIF ها را به آن تبدیل می‌کند)
+
+    ابعاد زوج می‌شوند (لازمه yuv420p) و moov در ابتدای فایل است. فایل GIF دست نمی‌خورد؛
+    انتخاب بین دو فایل با فراخواننده است.
+    """
+    started = time.monotonic()
+    output = os.path.splitext(path)[0] + ANIMATION_SUFFIX
+    result = {'output': '', 'size': 0, 'duration': 0, 'width': 0, 'height': 0, 'error': ''}
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        result['error'] = 'ffmpeg نصب نیست'
+    else:
+        command = [
+            ffmpeg, '-nostdin', '-loglevel', 'error', '-y', '-i', path, '-an',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p',
+            '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2', '-movflags', '+faststart', output,
+        ]
+        try:
+            await run(command, timeout)
+            result['output'] = output
+            result['size'] = os.path.getsize(output)
+            result.update(await probe(output, max(1.0, timeout - (time.monotonic() - started))))
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            result['error'] = error_text(e)
+        except BaseException:
+            # لغو کار: خروجی نیمه‌کاره نماند
+            if os.path.exists(output):
+                os.remove(output)
+            raise
+        if result['error'] and os.path.exists(output):
+            os.remove(output)
+            result['output'] = ''
+    result['seconds'] = time.monotonic() - started
+    return result
+
+
+class AnimationCost:
+    """
+    انتخاب بین آپلود GIF خام و تبدیل آن به mp4 بر اساس هزینه کل (زمان تبدیل + زمان آپلود)
+
+    سرعت تبدیل (بایت GIF در ثانیه) و نسبت حجم mp4 به GIF از تبدیل‌های قبلی با میانگین نمایی
+    یاد گرفته می‌شوند؛ سرعت آپلود از آمار مرحله آپلود می‌آید. هر explore_every تصمیم یک تبدیل
+    بدون توجه به پیش‌بینی انجام می‌شود تا تخمین‌ها با تغییر محتوا یا CPU کهنه نشوند.
+    """
+
+    def __init__(self, encode_rate: float = 5 * 1024 * 1024, ratio: float = 0.2, alpha: float = 0.2,
+                 explore_every: int = 20):
+        self.encode_rate = encode_rate  # بایت GIF در ثانیه
+        self.ratio = ratio  # حجم mp4 / حجم GIF
+        self.alpha = alpha
+        self.explore_every = explore_every
+        self.decisions = 0
+        self.converted = 0
+        self.kept = 0
+        self.saved_bytes = 0
+
+    def estimate(self, size: int, upload_rate: float) -> tuple:
+        """(ثانیه هزینه آپلود GIF، ثانیه هزینه تبدیل و آپلود mp4)"""
+        keep = size / upload_rate
+        convert = size / self.encode_rate + size * self.ratio / upload_rate
+        return keep, convert
+
+    def decide(self, size: int, upload_rate: float) -> tuple:
+        """(تبدیل شود؟، دلیل)"""
+        self.decisions += 1
+        keep, convert = self.estimate(size, upload_rate)
+        reason = f'GIF {keep:.2f}s در برابر mp4 {convert:.2f}s (نسبت {self.ratio:.2f})'
+        if convert < keep:
+            return True, reason
+        if self.explore_every and self.decisions % self.explore_every == 0:
+            return True, reason + '، تبدیل آزمایشی'
+        return False, reason
+
+    def record(self, gif_size: int, mp4_size: int, seconds: float):
+        if gif_size <= 0:
+            return
+        self.ratio += self.alpha * (mp4_size / gif_size - self.ratio)
+        if seconds > 0:
+            self.encode_rate += self.alpha * (gif_size / seconds - self.encode_rate)
+
+    def chose(self, converted: bool, saved: int = 0):
+        if converted:
+            self.converted += 1
+            self.saved_bytes += saved
+        else:
+            self.kept += 1
+
+    def stats(self) -> dict:
+        return {
+            'converted': self.converted,
+            'kept': self.kept,
+            'ratio': self.ratio,
+            'encode_rate': self.encode_rate,
+            'saved_bytes': self.saved_bytes,
+        }
+
+
+async def process(path: str, make_thumbnail: bool = True, timeout: float = 30.0) -> dict:
+    """
+    پس‌پردازش یک ویدیو: faststart (فقط mp4/mov)، مدت و ابعاد، و thumbnail
+
+    هر مرحله مستقل است و شکستش مانع بقیه نمی‌شود؛ خروجی دیکشنری نتیجه‌ها با زمان صرف شده.
+    """
+    started = time.monotonic()
+    result = {'faststart': False, 'duration': 0, 'width': 0, 'height': 0, 'thumbnail': '', 'error': ''}
+
+    def remaining() -> float:
+        return timeout - (time.monotonic() - started)
+
+    if path.lower().endswith(ISO_EXTENSIONS):
+        try:
+            await faststart(path, remaining())
+            result['faststart'] = True
+        except (subprocess.SubprocessError, OSError) as e:
+            result['error'] = error_text(e)
+    if remaining() > 1:
+        try:
+            result.update(await probe(path, remaining()))
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            result['error'] = result['error'] or error_text(e)
+    if make_thumbnail and remaining() > 1:
+        output = path + '.thumb.jpg'
+        # فریمی کمی بعد از شروع (فریم اول اغلب سیاه است)
+        at = min(1.0, result['duration'] / 10) if result['duration'] else 0.0
+        if await thumbnail(path, output, at, remaining()):
+            result['thumbnail'] = output
+    result['seconds'] = time.monotonic() - started
+    return result
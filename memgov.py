@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# هزینه حافظه اولیه هر نوع کار (بایت) تا وقتی اندازه‌گیری واقعی نداریم
+DEFAULT_COSTS = {
+    'direct': 32 * MB,  # دانلود جریانی با chunk های کوچک
+    'video': 200 * MB,  # yt-dlp: استخراج، قطعه‌های HLS/DASH و ادغام
+    'upload': 16 * MB,  # آپلود جریانی Pyrogram
+}
+# کارهایی که حافظه‌شان با حجم فایل رشد می‌کند: Bot API کل فایل را برای multipart در حافظه می‌خواند
+SIZE_FACTORS = {'upload': 2.0}
+MIN_COST = 8 * MB
+
+
+def process_rss() -> int:
+    """RSS فعلی پروسه (بایت)؛ صفر اگر قابل خواندن نباشد"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def container_memory_limit() -> int:
+    """سقف حافظه cgroup (v2 یا v1)؛ صفر اگر سقفی تعریف نشده باشد"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return 0
+
+
+class Reservation:
+    """سهم حافظه رزرو شده برای یک کار در حال اجرا"""
+
+    __slots__ = ('kind', 'cost', 'start_rss', 'peak_rss')
+
+    def __init__(self, kind: str, cost: int, rss: int):
+        self.kind = kind
+        self.cost = cost
+        self.start_rss = rss
+        self.peak_rss = rss
+
+    def pending(self) -> int:
+        """بخشی از هزینه تخمینی که هنوز در RSS دیده نشده"""
+        return max(0, self.cost - (self.peak_rss - self.start_rss))
+
+
+class MemoryGovernor:
+    """
+    پذیرش کارها بر اساس بودجه حافظه
+
+    - RSS پروسه به صورت دوره‌ای نمونه‌برداری می‌شود
+    - برای هر نوع کار (direct، video، upload) هزینه حافظه با میانگین متحرک بیشینه رشد RSS
+      در طول اجرای کارهای قبلی تخمین زده می‌شود
+    - کار جدید فقط وقتی شروع می‌شود که RSS فعلی + هزینه‌های هنوز دیده‌نشده کارهای در حال
+      اجرا + هزینه کار جدید از بودجه کمتر باشد؛ وگرنه منتظر می‌ماند (نه رد)
+    - اگر هیچ کاری در حال اجرا نباشد، کار همیشه پذیرفته می‌شود تا صف قفل نشود
+    """
+
+    def __init__(self, budget: int = 0, interval: float = 1.0, on_throttle=None):
+        self.budget = budget  # بایت، صفر = غیرفعال
+        self.interval = interval
+        self.on_throttle = on_throttle  # function(kind) برای هر کاری که منتظر حافظه ماند
+        self.costs = dict(DEFAULT_COSTS)
+        self.rss = process_rss()
+        self.peak_rss = self.rss
+        self.throttled = {}  # {kind: تعداد کارهای معطل شده}
+        self.throttled_seconds = 0.0
+        self._active = set()
+        self._waiting = {}  # {key: زمان اولین رد} برای شمارش هر کار فقط یک بار
+        self._task = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    def sample(self) -> int:
+        rss = process_rss()
+        if rss:
+            self.rss = rss
+            self.peak_rss = max(self.peak_rss, rss)
+            for reservation in self._active:
+                reservation.peak_rss = max(reservation.peak_rss, rss)
+        return self.rss
+
+    def estimate(self, kind: str, size: int = 0) -> int:
+        """هزینه حافظه تخمینی یک کار (بایت)"""
+        return max(self.costs.get(kind, MIN_COST), int(size * SIZE_FACTORS.get(kind, 0)))
+
+    def projected(self, extra: int = 0) -> int:
+        """مصرف پیش‌بینی شده: RSS فعلی + هزینه‌های هنوز دیده‌نشده کارهای فعال + extra"""
+        return self.rss + sum(r.pending() for r in self._active) + extra
+
+    def try_acquire(self, kind: str, size: int = 0, key=None):
+        """رزرو حافظه برای یک کار؛ Reservation یا None اگر بودجه اجازه ندهد"""
+        cost = self.estimate(kind, size)
+        if self.enabled and self._active and self.projected(cost) > self.budget:
+            if key not in self._waiting:
+                self._waiting[key] = time.monotonic()
+                self.throttled[kind] = self.throttled.get(kind, 0) + 1
+                if self.on_throttle is not None:
+                    self.on_throttle(kind)
+                logger.info(
+                    f"کار {kind} منتظر حافظه ماند: {self.projected(cost) / MB:.0f}MB "
+                    f"پیش‌بینی از بودجه {self.budget / MB:.0f}MB"
+                )
+            return None
+        waited_since = self._waiting.pop(key, None)
+        if waited_since is not None:
+            self.throttled_seconds += time.monotonic() - waited_since
+        reservation = Reservation(kind, cost, self.rss)
+        self._active.add(reservation)
+        return reservation
+
+    async def acquire(self, kind: str, size: int = 0, key=None) -> Reservation:
+        """انتظار تا آزاد شدن حافظه کافی و رزرو آن"""
+        while True:
+            reservation = self.try_acquire(kind, size, key)
+            if reservation is not None:
+                return reservation
+            await asyncio.sleep(self.interval)
+            self.sample()
+
+    def release(self, reservation: Reservation):
+        """پایان کار: به‌روزرسانی هزینه تخمینی نوع کار از رشد مشاهده‌شده RSS"""
+        if reservation is None or reservation not in self._active:
+            return
+        self._active.discard(reservation)
+        self.sample()
+        base = self.costs.get(reservation.kind, MIN_COST)
+        # هزینه کارهایی که از روی حجم فایل محاسبه شده، هزینه پایه آن نوع را تغییر نمی‌دهد
+        if reservation.cost <= base:
+            growth = reservation.peak_rss - reservation.start_rss
+            self.costs[reservation.kind] = max(MIN_COST, int(base * 0.8 + growth * 0.2))
+
+    def forget(self, key):
+        """کاری که در حال انتظار لغو شد"""
+        self._waiting.pop(key, None)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.sample()
+
+    def stats(self) -> dict:
+        return {
+            'budget': self.budget,
+            'rss': self.rss,
+            'peak_rss': self.peak_rss,
+            'projected': self.projected(),
+            'active': len(self._active),
+            'waiting': len(self._waiting),
+            'throttled': dict(self.throttled),
+            'throttled_seconds': self.throttled_seconds,
+            'costs': dict(self.costs),
+        }
@@ -0,0 +1,233 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# مرزهای پیش‌فرض هیستوگرام مدت زمان (ثانیه)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# حداکثر تعداد سری هر متریک (برچسب‌های اضافی در سری "other" جمع می‌شوند)
+MAX_SERIES = 500
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _with_label(sample: str, name: str, value) -> str:
+    """افزودن یک برچسب به سطر نمونه خروجی متنی (name{...} value)"""
+    end = min(index for index in (sample.find('{'), sample.find(' ')) if index >= 0)
+    label = f'{name}="{_escape(value)}"'
+    if sample[end] == '{':
+        return f'{sample[:end + 1]}{label},{sample[end + 1:]}'
+    return f'{sample[:end]}{{{label}}}{sample[end:]}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    """مجموعه متریک‌ها و تولید خروجی متنی Prometheus"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> dict:
+        """{name: [help, kind, samples]} برای انتقال متریک‌های یک پروسه worker به پروسه اصلی (JSON)"""
+        with self._lock:
+            metrics = list(self._metrics)
+        return {metric.name: [metric.help, metric.kind, metric.samples()] for metric in metrics}
+
+    def render(self, workers: dict = None) -> str:
+        """
+        خروجی متنی Prometheus
+
+        workers: {برچسب worker: snapshot()} پروسه‌های دیگر؛ نمونه‌های آن‌ها با برچسب worker زیر همان
+        HELP/TYPE متریک این پروسه می‌آیند
+        """
+        families = self.snapshot()
+        for worker, snapshot in (workers or {}).items():
+            for name, (help, kind, samples) in snapshot.items():
+                family = families.setdefault(name, [help, kind, []])
+                family[2] = family[2] + [_with_label(sample, 'worker', worker) for sample in samples]
+        lines = []
+        for name, (help, kind, samples) in families.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames=(), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        if key not in self._values and len(self._values) >= MAX_SERIES:
+            return tuple('other' for _ in self.labelnames)
+        return key
+
+
+class Counter(_Metric):
+    """شمارنده افزایشی"""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        """مجموع همه سری‌ها"""
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in items]
+
+
+class Gauge(_Metric):
+    """مقدار لحظه‌ای؛ می‌تواند با تابع callback هنگام خروجی گرفتن محاسبه شود"""
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """function بدون برچسب یک عدد و با برچسب دیکشنری {tuple(labels): value} برمی‌گرداند"""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                result = self._function()
+            except Exception:
+                return []
+            items = result.items() if isinstance(result, dict) else [((), result)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in items]
+
+
+class Histogram(_Metric):
+    """هیستوگرام با مرزهای ثابت (سربار ثبت: یک جستجوی دودویی و چند جمع)"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [شمارش هر bucket (غیرتجمعی) + Inf، مجموع، تعداد]
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """اندازه‌گیری مدت یک بلوک (در کد sync و async قابل استفاده است)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def summary(self, **labels):
+        """(تعداد، میانگین) برای یک سری"""
+        series = self._values.get(self._key(labels))
+        if not series or not series[2]:
+            return 0, 0.0
+        return series[2], series[1] / series[2]
+
+    def counts(self, **labels) -> list:
+        """کپی شمارش غیرتجمعی bucket های یک سری (آخرین عنصر: بیشتر از بزرگ‌ترین مرز)"""
+        series = self._values.get(self._key(labels))
+        with self._lock:
+            return list(series[0]) if series else [0] * (len(self.buckets) + 1)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(series[0]), series[1], series[2])) for key, series in self._values.items()]
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+# متریک‌های مشترک ربات
+STAGE_SECONDS = Histogram('bot_stage_duration_seconds', 'Duration of each pipeline stage', ['stage'])
+BYTES = Counter('bot_bytes_total', 'Bytes transferred', ['direction'])
+JOBS = Counter('bot_jobs_total', 'Jobs by outcome', ['outcome'])
+ERRORS = Counter('bot_errors_total', 'Errors by stage, host and error class', ['stage', 'host', 'error'])
+CACHE_REQUESTS = Counter('bot_cache_requests_total', 'Cache lookups by cache and result', ['cache', 'result'])
+EXECUTOR_QUEUE = Gauge('bot_executor_queue_depth', 'Tasks waiting for a thread in the blocking executor')
+QUEUE_DEPTH = Gauge('bot_queue_depth', 'Jobs waiting or running per pipeline queue', ['queue'])
+PYROGRAM_SESSIONS = Gauge('bot_pyrogram_sessions', 'Pyrogram client state', ['state'])
+LOOP_LAG = Gauge('bot_event_loop_lag_seconds', 'Event loop scheduling lag percentiles', ['quantile'])
+LOOP_BLOCKS = Counter('bot_event_loop_blocks_total', 'Times the event loop was blocked past the threshold')
+MEMORY_BYTES = Gauge('bot_memory_bytes', 'Process RSS, projected usage and budget of the memory governor', ['kind'])
+DEDUP_SAVED_BYTES = Counter('bot_dedup_saved_bytes_total', 'Upload bytes avoided by resending a known file_id')
+POSTPROCESS_RESULTS = Counter('bot_postprocess_total', 'Video post-processing runs by result', ['result'])
+MEMORY_THROTTLED = Counter('bot_memory_throttled_total', 'Jobs delayed by the memory governor', ['stage'])
@@ -0,0 +1,101 @@
+import os
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+
+from jobs import Job
+
+
+@dataclass
+class Artifact:
+    """
+    فایل دانلود شده‌ای که منتظر آپلود در صف تحویل است
+
+    فایل‌های کوچک در buffer (SpooledTemporaryFile) نگه داشته می‌شوند و هرگز روی دیسک
+    نوشته نمی‌شوند؛ در این حالت filepath فقط نام فایل را مشخص می‌کند.
+    """
+    job: Job
+    filepath: str
+    content_type: str
+    file_size: int
+    attempts: int = 0
+    staged: float = field(default_factory=time.monotonic)
+    buffer: object = None
+    digest: str = ''  # کلید محتوا (hash:حجم) برای ارسال دوباره با file_id
+    # نتیجه پس‌پردازش ویدیو (صفر/خالی = نامعلوم، تلگرام خودش حدس می‌زند)
+    duration: int = 0
+    width: int = 0
+    height: int = 0
+    thumbnail: str = ''
+
+    @property
+    def filename(self) -> str:
+        return os.path.basename(self.filepath)
+
+    @property
+    def is_animation(self) -> bool:
+        """ارسال به صورت Animation: GIF خام یا GIF تبدیل شده به mp4 بی‌صدا (پسوند .gif.mp4)"""
+        return self.content_type == 'image/gif' or self.filepath.endswith('.gif.mp4')
+
+    def exists(self) -> bool:
+        if self.buffer is not None:
+            return not self.buffer.closed
+        return os.path.exists(self.filepath)
+
+    def open(self):
+        """
+        محتوای فایل برای ارسال: فایل باز روی دیسک یا bytes برای buffer حافظه
+
+        SpooledTemporaryFile نام ندارد و Bot API از روی نام فایل شیء باز خطا می‌دهد؛ Bot API به هر حال
+        کل محتوا را در حافظه می‌خواند پس bytes هزینه اضافه ندارد. buffer بسته نمی‌شود تا تلاش مجدد ممکن باشد.
+        """
+        if self.buffer is not None:
+            self.buffer.seek(0)
+            return nullcontext(self.buffer.read())
+        return open(self.filepath, 'rb')
+
+    def discard(self):
+        """آزاد کردن حافظه یا حذف فایل موقت"""
+        if self.buffer is not None:
+            self.buffer.close()
+        elif os.path.exists(self.filepath):
+            os.remove(self.filepath)
+        if self.thumbnail and os.path.exists(self.thumbnail):
+            os.remove(self.thumbnail)
+
+
+class StageStats:
+    """آمار یک مرحله pipeline (دانلود یا آپلود)"""
+
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def begin(self):
+        self.busy += 1
+
+    def end(self, seconds: float, nbytes: int = 0, ok: bool = True):
+        self.busy -= 1
+        self.seconds += seconds
+        if ok:
+            self.completed += 1
+            self.bytes += nbytes
+        else:
+            self.failed += 1
+
+    def throughput(self) -> float:
+        """میانگین سرعت (بایت در ثانیه) در زمان مشغول بودن این مرحله"""
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.busy}/{self.concurrency} مشغول، "
+            f"{self.completed} موفق، {self.failed} ناموفق، {self.retried} تلاش مجدد، "
+            f"{self.bytes / (1024 * 1024):.0f} MB با {self.throughput() / (1024 * 1024):.1f} MB/s"
+        )
@@ -0,0 +1,120 @@
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# حداکثر مدت یک پروفایل (ثانیه)
+MAX_PROFILE_SECONDS = 120
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_stacks(seconds: float, interval: float = 0.01) -> Counter:
+    """
+    پروفایل نمونه‌برداری از همه thread های پروسه (برای اجرا در thread جدا)
+
+    هر interval ثانیه stack همه thread ها خوانده می‌شود و خروجی به صورت
+    folded stacks (قالب flamegraph.pl / speedscope) شمارش می‌شود.
+    تا وقتی این تابع اجرا نشده هیچ هزینه‌ای ندارد.
+    """
+    seconds = min(max(seconds, 1), MAX_PROFILE_SECONDS)
+    own_thread = threading.get_ident()
+    names = {}
+    folded = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread in threading.enumerate():
+            names[thread.ident] = thread.name
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            folded[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return folded
+
+
+def render_folded(folded: Counter) -> bytes:
+    return ''.join(f"{stack} {count}\n" for stack, count in folded.most_common()).encode('utf-8')
+
+
+def top_functions(folded: Counter, limit: int = 10) -> list:
+    """پرتکرارترین فریم‌های بالای stack: [(frame, samples)]"""
+    leaves = Counter()
+    for stack, count in folded.items():
+        leaves[stack.rsplit(';', 1)[-1]] += count
+    return leaves.most_common(limit)
+
+
+class MemoryTracker:
+    """snapshot های tracemalloc و مقایسه هر snapshot با قبلی (فقط پس از اولین درخواست فعال می‌شود)"""
+
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self._previous = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def snapshot(self, limit: int = 15) -> str:
+        """گرفتن snapshot؛ در اولین فراخوانی فقط ردیابی شروع و snapshot پایه ثبت می‌شود"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self._previous = tracemalloc.take_snapshot()
+                return "🧠 ردیابی حافظه شروع شد. برای دیدن تغییرات دوباره /memsnap را بزنید."
+            current = tracemalloc.take_snapshot()
+            filters = [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ]
+            current = current.filter_traces(filters)
+            previous = self._previous.filter_traces(filters) if self._previous else None
+            self._previous = current
+        traced, peak = tracemalloc.get_traced_memory()
+        lines = [f"🧠 حافظه ردیابی‌شده: {traced / 1024 / 1024:.1f} MB (بیشینه {peak / 1024 / 1024:.1f} MB)"]
+        if previous is None:
+            return lines[0]
+        lines.append("\nبیشترین تغییر نسبت به snapshot قبلی:")
+        for stat in current.compare_to(previous, 'lineno')[:limit]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d}) "
+                f"{os.path.basename(frame.filename)}:{frame.lineno} = {stat.size / 1024:.1f} KiB"
+            )
+        return '\n'.join(lines)
+
+    def stop(self) -> str:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return "ردیابی حافظه فعال نیست."
+            tracemalloc.stop()
+            self._previous = None
+        return "🧠 ردیابی حافظه متوقف شد."
+
+
+def dump_tasks() -> str:
+    """stack فعلی همه task های asyncio (باید روی event loop صدا زده شود)"""
+    current = asyncio.current_task()
+    tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+    out = io.StringIO()
+    out.write(f"{len(tasks)} task\n\n")
+    for task in tasks:
+        marker = ' (current)' if task is current else ''
+        out.write(f"=== {task.get_name()}{marker}: {task.get_coro()!r}\n")
+        task.print_stack(limit=20, file=out)
+        out.write('\n')
+    return out.getvalue()
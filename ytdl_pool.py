@@ -0,0 +1,141 @@
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def freeze(value):
+    """تبدیل تنظیمات (dict/list تو در تو) به کلید hashable"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class YoutubeDLPool:
+    """
+    نمونه‌های ماندگار YoutubeDL به ازای هر پروفایل تنظیمات
+
+    ساخت YoutubeDL هر بار registry استخراج‌کننده‌ها، opener شبکه و خواندن فایل کوکی را
+    تکرار می‌کند و اتصال‌های گرم و cookie jar را دور می‌ریزد. این pool برای هر پروفایل
+    (تنظیمات بدون هدرهای مخصوص هر کار مثل Referer و الگوی نام فایل) نمونه‌های بیکار نگه می‌دارد:
+
+    - هر نمونه در طول یک کار انحصاری است (checkout) و بعد از آن به حالت پایه برمی‌گردد
+    - پس از max_uses کار یا هر خطا بسته و دور ریخته می‌شود
+    - حداکثر max_idle نمونه بیکار در کل نگه داشته می‌شود (قدیمی‌ترین پروفایل اول حذف می‌شود)
+    """
+
+    def __init__(self, factory, max_idle: int = 5, max_uses: int = 50, on_checkout=None):
+        self.factory = factory  # function(opts) -> YoutubeDL
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.on_checkout = on_checkout  # function(reused: bool)
+        self._idle = OrderedDict()  # {profile: [(ydl, uses, base_headers)]}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.recycled = 0
+
+    @property
+    def idle_count(self) -> int:
+        return sum(len(items) for items in self._idle.values())
+
+    def _take(self, profile):
+        with self._lock:
+            items = self._idle.get(profile)
+            if not items:
+                return None
+            entry = items.pop()
+            if not items:
+                del self._idle[profile]
+            return entry
+
+    def _put(self, profile, entry):
+        evicted = []
+        with self._lock:
+            self._idle.setdefault(profile, []).append(entry)
+            self._idle.move_to_end(profile)
+            while self.idle_count > self.max_idle:
+                oldest, items = next(iter(self._idle.items()))
+                evicted.append(items.pop(0))
+                if not items:
+                    del self._idle[oldest]
+        for ydl, _, _ in evicted:
+            self._close(ydl)
+
+    def _close(self, ydl):
+        self.recycled += 1
+        try:
+            ydl.close()
+        except Exception as e:
+            logger.debug(f"خطا در بستن YoutubeDL: {e}")
+
+    @contextmanager
+    def checkout(self, opts: dict, headers: dict = None, progress_hooks=(), outtmpl: str = None):
+        """
+        گرفتن انحصاری یک YoutubeDL برای opts
+
+        headers: هدرهای مخصوص این کار (مثل Referer و Origin) که جزو پروفایل نیستند
+        progress_hooks: hook های این کار که پس از پایان حذف می‌شوند
+        outtmpl: الگوی نام فایل این کار (مثلاً با پسوند یکتای کار)؛ opts نباید outtmpl داشته باشد
+        """
+        profile = freeze(opts)
+        entry = self._take(profile)
+        if entry is None:
+            ydl = self.factory(dict(opts))
+            entry = (ydl, 0, dict(ydl.params['http_headers']))
+            self.created += 1
+        else:
+            self.reused += 1
+        if self.on_checkout is not None:
+            self.on_checkout(entry[1] > 0)
+        ydl, uses, base_headers = entry
+        if headers:
+            ydl.params['http_headers'].update(headers)
+        # YoutubeDL الگو را هنگام ساخت به شکل {'default': ...} درمی‌آورد و هنگام دانلود از همان می‌خواند
+        base_outtmpl = ydl.params['outtmpl'].get('default')
+        if outtmpl:
+            ydl.params['outtmpl']['default'] = outtmpl
+        for hook in progress_hooks:
+            ydl.add_progress_hook(hook)
+        try:
+            yield ydl
+        except BaseException:
+            # وضعیت داخلی پس از خطا یا لغو قابل اعتماد نیست
+            self._close(ydl)
+            raise
+        # بازگشت به حالت پایه برای کار بعدی
+        ydl.params['http_headers'].clear()
+        ydl.params['http_headers'].update(base_headers)
+        if base_outtmpl is None:
+            ydl.params['outtmpl'].pop('default', None)
+        else:
+            ydl.params['outtmpl']['default'] = base_outtmpl
+        for hook in progress_hooks:
+            if hook in ydl._progress_hooks:
+                ydl._progress_hooks.remove(hook)
+        uses += 1
+        if uses >= self.max_uses:
+            self._close(ydl)
+        else:
+            self._put(profile, (ydl, uses, base_headers))
+
+    def clear(self):
+        """بستن همه نمونه‌های بیکار"""
+        with self._lock:
+            entries = [entry for items in self._idle.values() for entry in items]
+            self._idle.clear()
+        for ydl, _, _ in entries:
+            self._close(ydl)
+
+    def stats(self) -> dict:
+        return {
+            'idle': self.idle_count,
+            'profiles': len(self._idle),
+            'created': self.created,
+            'reused': self.reused,
+            'recycled': self.recycled,
+        }